@@ -21,6 +21,7 @@ from question_generator import memory_questions as memory_questions
 from question_generator import math_questions as math_questions
 from question_generator import process_questions as process_questions
 from question_generator import persistance_questions
+from src.canvas_requests import CanvasRequestLayer
 
 import logging
 logging.basicConfig()
@@ -39,6 +40,8 @@ logger.setLevel(logging.WARNING)
 
 QUESTION_GENERATOR_ATTEMPT_TIMEOUT_MULTIPLIER = 100
 
+# Shared rate limiting, retries and metrics for every canvas call we make.  Attached to our canvas object in main()
+canvas_requests = CanvasRequestLayer()
 
   
 
@@ -50,13 +53,13 @@ def add_question_group(
     existing_questions: Set[question_module.Question],
     question_class : typing.Type[question_module.CanvasQuestion],
 ):
-  group = quiz.create_question_group([
+  group = canvas_requests.call(quiz.create_question_group, [
     {
       "name": "Paging Questions",
       "pick_count": 1,
       "question_points": 1
     }
-  ])
+  ], idempotent=False)
   
   questions_to_add : Set[question_module.CanvasQuestion] = set()
   counter = 0
@@ -74,7 +77,7 @@ def add_question_group(
     question_for_canvas = q.get__canvas(course, quiz) # get_question_for_canvas(course, quiz, q)
     question_for_canvas["quiz_group_id"] = group.id
     log.info(f"Adding {q.__class__.__name__} {i+1}/{len(questions_to_add)}")
-    quiz.create_question(question=question_for_canvas)
+    canvas_requests.call(quiz.create_question, question=question_for_canvas, idempotent=False)
   
   return questions_to_add
 
@@ -83,7 +86,7 @@ def add_quiz(
     course: canvasapi.course.Course,
     assignment_group: canvasapi.course.AssignmentGroup|None = None
 ):
-  q = course.create_quiz(quiz={
+  q = canvas_requests.call(course.create_quiz, quiz={
     "title": f"New Quiz {datetime.now().strftime('%m/%d/%y %H:%M:%S.%f')}",
     "hide_results" : None,
     "show_correct_answers": True,
@@ -95,7 +98,7 @@ def add_quiz(
       Please take it as many times as necessary to get full marks!
       Please note that although the answers section may be a bit lengthy, check below them for a full explanation of how to solve the problem!
     """
-  })
+  }, idempotent=False)
   return q
 
 def create_quiz_with_questions(
@@ -129,14 +132,16 @@ def create_quiz_with_questions(
   #   log.debug(f"{pprint.pformat(q.__dict__)}")
 
 def create_assignment_group(canvas: canvasapi.Canvas, course: canvasapi.course.Course, name="dev") -> canvasapi.course.AssignmentGroup:
-  for assignment_group in course.get_assignment_groups():
+  for assignment_group in canvas_requests.call(lambda: list(course.get_assignment_groups())):
     if assignment_group.name == name:
       log.info("Found group existing, returning")
       return assignment_group
-  assignment_group = course.create_assignment_group(
+  assignment_group = canvas_requests.call(
+    course.create_assignment_group,
     name="dev",
     group_weight=0.0,
     position=0,
+    idempotent=False
   )
   return assignment_group
 
@@ -160,11 +165,12 @@ def main():
     canvas = canvasapi.Canvas(os.environ.get("CANVAS_API_URL_prod"), os.environ.get("CANVAS_API_KEY_prod"))
   else:
     canvas = canvasapi.Canvas(os.environ.get("CANVAS_API_URL"), os.environ.get("CANVAS_API_KEY"))
+  canvas_requests.attach(canvas)
   
   if args.test:
-    return test(course=canvas.get_course(args.course_id))
+    return test(course=canvas_requests.call(canvas.get_course, args.course_id))
   
-  course = canvas.get_course(args.course_id)
+  course = canvas_requests.call(canvas.get_course, args.course_id)
   assignment_group = create_assignment_group(canvas, course)
   create_quiz_with_questions(
     canvas,
@@ -187,6 +193,7 @@ def main():
     num_groups=args.num_groups,
     questions_per_group=args.questions_per_group,
   )
+  canvas_requests.describe()
   
 
 if __name__ == "__main__":
@@ -3,18 +3,29 @@ import collections
 import logging
 import os
 import shutil
-import tempfile
+import sys
 from typing import Tuple, List
 
 import jinja2
 import pypdf
 import question
 import argparse
-import subprocess
+
+# The build farm is shared with the quiz generator
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from latex_build import LatexBuildFarm, LATEX_JOBS, LATEX_TIMEOUT, combine_documents, split_document
 
 logging.basicConfig()
 logging.getLogger().setLevel(logging.DEBUG)
 
+# What exam_base.j2 keeps per exam, zeroed before each exam in a --single_document build.
+# Questions are plain text, so the only other state is LaTeX's own counters, which we reset as well.
+# The one thing shared across exams is pgf's random number stream, which is seeded once per compile rather than once per exam.
+EXAM_RESET = "".join(
+  rf"\setcounter{{{counter}}}{{0}}"
+  for counter in ["NumQuestions", "NumPoints", "section", "footnote", "figure", "table", "equation"]
+)
+
 
 def parse_args():
   parser = argparse.ArgumentParser()
@@ -22,6 +33,12 @@ def parse_args():
   parser.add_argument("--questions_file", nargs='+')
   parser.add_argument("--debug", action="store_true")
   parser.add_argument("--exam_name", default="CST334 Exam 3")
+  parser.add_argument("--jobs", default=LATEX_JOBS, type=int, help="How many exams to compile at once")
+  parser.add_argument("--precompile_preamble", action="store_true", help="Compile exams against a cached, precompiled preamble (needs mylatexformat)")
+  parser.add_argument("--single_document", action="store_true", help=(
+    "Compile every exam as part of one document, then split it into an exam per pdf.  "
+    "As without it, each exam ends up in out/exam_NNN.pdf and all of them in exam.pdf, but with the exam's name at the top of each page"
+  ))
   return parser.parse_args()
 
 
@@ -62,33 +79,20 @@ def main():
   if os.path.exists("out"): shutil.rmtree("out")
   os.mkdir("out")
   
-  for _ in range(args.num_exams):
+  if args.single_document:
+    # One big document, so give it as long as all the exams would have had
+    farm = LatexBuildFarm(jobs=1, output_dir="out", timeout=LATEX_TIMEOUT * args.num_exams, precompile_preamble=args.precompile_preamble)
+  else:
+    farm = LatexBuildFarm(jobs=args.jobs, output_dir="out", precompile_preamble=args.precompile_preamble)
+  exams = []
+  for exam_number in range(args.num_exams):
     exam_text, question_set = generate_exam(questions_file=args.questions_file, exam_name=args.exam_name)
     if args.debug:
-      tmp_tex = open("exam.tex", 'w')
-    else:
-      tmp_tex = tempfile.NamedTemporaryFile('w')
-      
-    tmp_tex.write(exam_text)
-    tmp_tex.flush()
-    p = subprocess.Popen(f"latexmk -pdf -output-directory={os.path.join(os.getcwd(), 'out')} {tmp_tex.name}", shell=True)
-    try:
-      p.wait(30)
-    except subprocess.TimeoutExpired:
-      logging.error("Latex Compile timedout")
-      p.kill()
-      logging.error("Copying output to debug.tex")
-      shutil.copy(f"{tmp_tex.name}", "debug.tex")
-      tmp_tex.close()
-      return
-    proc = subprocess.Popen(
-      f"latexmk -c {tmp_tex.name} -output-directory={os.path.join(os.getcwd(), 'out')}",
-      shell=True,
-      stdout=subprocess.PIPE,
-      stderr=subprocess.PIPE
-    )
-    proc.wait(timeout=30)
-    tmp_tex.close()
+      with open("exam.tex", 'w') as fid:
+        fid.write(exam_text)
+    exams.append((f"exam_{exam_number:03}", exam_text))
+    if not args.single_document:
+      farm.submit(*exams[-1])
     
     questions_by_subject = {
       s : list(filter((lambda q: q.subject == s), question_set))
@@ -105,10 +109,28 @@ def main():
         logging.info(f"  {counts_by_value[val]}x {val}points")
     logging.info(f"total: {sum(map((lambda q: q.points_value), question_set))}")
     
+  if args.single_document:
+    farm.submit("exams", combine_documents(exams, reset=EXAM_RESET))
+  
+  results = farm.wait()
+  farm.close()
+  farm.describe(results)
+  failed = [result for result in results if not result.ok]
+  if len(failed) > 0:
+    logging.error(f"Copying the source of {failed[0].name} to debug.tex")
+    shutil.copy(os.path.join("out", f"{failed[0].name}.tex"), "debug.tex")
+    return
+  
+  if args.single_document:
+    # Everything is already in one pdf, in order, so that is exam.pdf, and the split gives us the per-exam pdfs
+    paths = split_document(results[0])
+    shutil.copy(results[0].pdf_path, "exam.pdf")
+    logging.info(f"Wrote {len(paths)} exams to out/ and all of them to exam.pdf")
+    return
   
   writer = pypdf.PdfWriter()
-  for pdf_file in [os.path.join("out", f) for f in os.listdir("out") if f.endswith(".pdf")]:
-    writer.append(pdf_file)
+  for result in results:
+    writer.append(result.pdf_path)
   
   writer.write("exam.pdf")
   #shutil.rmtree("out")
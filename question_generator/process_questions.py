@@ -9,21 +9,17 @@ import os
 import pprint
 import random
 import uuid
-from typing import List, Tuple
+from typing import List, Tuple, TYPE_CHECKING
 
 
-import canvasapi
-import canvasapi.course
-import canvasapi.quiz
-
-import matplotlib.colors
-
 from .question import Question, CanvasQuestion__fill_in_the_blanks
 from .variable import Variable, VariableFloat
 
 import dataclasses
 
-import matplotlib.pyplot as plt
+if TYPE_CHECKING:
+  import canvasapi.course
+  import canvasapi.quiz
 
 import logging
 logging.basicConfig()
@@ -321,6 +317,8 @@ class SchedulingQuestion(Question, abc.ABC):
     
   
   def make_image(self, image_dir="imgs"):
+    # pyplot takes a good while to import, so only pay for it when we actually draw something
+    import matplotlib.pyplot as plt
     
     fig, ax = plt.subplots(1, 1)
     
@@ -1,18 +1,23 @@
 #!env python
+from __future__ import annotations
+
 import abc
 import datetime
+import hashlib
 import logging
 import sys
 import textwrap
 import time
 import random
-from typing import List, Dict
-
-import canvasapi.course
-import canvasapi.quiz
+from typing import List, Dict, TYPE_CHECKING
 
 from .variable import Variable
 
+# Only needed for annotations, and slow to import
+if TYPE_CHECKING:
+  import canvasapi.course
+  import canvasapi.quiz
+
 import logging
 logging.basicConfig()
 log = logging.getLogger(__name__)
@@ -95,17 +100,31 @@ class Question:
     
     return markdown_text
   
+  def get_fingerprint(self) -> bytes:
+    """128-bit digest of the variables (or, failing that, the body) of this question, so duplicates can be spotted before rendering."""
+    if self.given_vars is not None and self.target_vars is not None:
+      parts = [
+        sorted((var.name, repr(var.true_value)) for var in self.target_vars),
+        sorted((var.name, repr(var.true_value)) for var in self.given_vars),
+      ]
+    else:
+      parts = self.get_question_body()
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).digest()
+  
   @classmethod
   def generate_question_set(cls, num_variations, max_tries=None, module_kwargs={}):
     if max_tries is None: max_tries=100*num_variations
-    questions = set()
+    questions = []
+    fingerprints = set()
     num_tries = 0
     while (len(questions) < num_variations) and num_tries < max_tries:
       num_tries += 1
-      q_text = cls(**module_kwargs).to_markdown()
-      if q_text in questions:
+      question = cls(**module_kwargs)
+      fingerprint = question.get_fingerprint()
+      if fingerprint in fingerprints:
         continue
-      questions.add(q_text)
+      fingerprints.add(fingerprint)
+      questions.append(question.to_markdown())
     return questions
   
   @classmethod
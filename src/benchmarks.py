@@ -0,0 +1,326 @@
+#!env python
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+def benchmark_selection(args):
+  """Time to pick a set of questions hitting a point total, as the pool of questions grows."""
+  import question_selection
+
+  rng = random.Random(args.seed)
+  print(f"{'pool size':>10} {'total':>8} {'solutions':>14} {'mean (ms)':>10} {'max (ms)':>10}")
+  for pool_size in args.pool_sizes:
+    pool = [
+      types.SimpleNamespace(name=f"q{i}", points_value=rng.choice(args.point_values))
+      for i in range(pool_size)
+    ]
+    # Aim for roughly half of the pool so there are plenty of ways to hit it
+    total_points = sum(q.points_value for q in pool) // 2
+
+    timings = []
+    for _ in range(args.repeats):
+      start_time = time.perf_counter()
+      picked = question_selection.select_questions(pool, total_points, rng=rng)
+      timings.append(time.perf_counter() - start_time)
+      assert not picked or sum(q.points_value for q in picked) == total_points
+
+    num_solutions = question_selection.PointTotalSolver(pool).count_solutions(total_points)
+    print(
+      f"{pool_size:>10} {total_points:>8} {num_solutions:>14.3g} "
+      f"{1000 * sum(timings) / len(timings):>10.2f} {1000 * max(timings):>10.2f}"
+    )
+
+
+def benchmark_constraints(args):
+  """Time to compose an exam with topic quotas, question counts and an "at most one of" group, as the pool grows."""
+  from question import Question
+  import exam_constraints
+
+  rng = random.Random(args.seed)
+  constraints = exam_constraints.ExamConstraints.from_yaml({
+    "total points": args.total_points,
+    "questions": {"min": 10, "max": 25},
+    "topics": {
+      "memory": {"points": {"min": 20, "max": 40}},
+      "io": {"points": {"min": 10, "max": 30}, "questions": {"max": 4}},
+    },
+    "at most one of": [["q0", "q1", "q2"]],
+  })
+  print(f"{'pool size':>10} {'mean (ms)':>10} {'max (ms)':>10} {'3 versions (ms)':>16}")
+  for pool_size in args.pool_sizes:
+    pool = [
+      types.SimpleNamespace(name=f"q{i}", points_value=rng.choice(args.point_values), kind=rng.choice(list(Question.Topic)))
+      for i in range(pool_size)
+    ]
+    composer = exam_constraints.ExamComposer(pool, constraints)
+
+    timings = []
+    for _ in range(args.repeats):
+      start_time = time.perf_counter()
+      composer.compose(rng)
+      timings.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    composer.compose_versions(3, rng)
+    versions_time = time.perf_counter() - start_time
+
+    print(
+      f"{pool_size:>10} {1000 * sum(timings) / len(timings):>10.2f} {1000 * max(timings):>10.2f} "
+      f"{1000 * versions_time:>16.2f}"
+    )
+
+
+def benchmark_scheduling(args):
+  """Time to make interesting scheduling questions one at a time versus with the vectorized batch API."""
+  import numpy as np
+  from premade_questions.process import SchedulingQuestion
+
+  logging.getLogger("premade_questions.process").setLevel(logging.INFO)
+  rng = np.random.default_rng(args.seed)
+
+  start_time = time.perf_counter()
+  for _ in range(args.num_variations):
+    SchedulingQuestion(num_jobs=args.num_jobs)
+  one_at_a_time = time.perf_counter() - start_time
+
+  start_time = time.perf_counter()
+  SchedulingQuestion.generate_batch(args.num_variations, num_jobs=args.num_jobs, rng=rng)
+  batched = time.perf_counter() - start_time
+
+  start_time = time.perf_counter()
+  for kind in SchedulingQuestion.Kind:
+    arrivals = rng.integers(0, SchedulingQuestion.MAX_ARRIVAL_TIME, size=(args.num_variations, args.num_jobs), endpoint=True)
+    durations = rng.integers(SchedulingQuestion.MIN_JOB_DURATION, SchedulingQuestion.MAX_JOB_DURATION, size=(args.num_variations, args.num_jobs), endpoint=True)
+    SchedulingQuestion.simulate_batch(kind, arrivals, durations)
+  simulation_only = time.perf_counter() - start_time
+
+  print(f"{args.num_variations} variations, {args.num_jobs} jobs")
+  print(f"  one at a time:                      {1000 * one_at_a_time:10.2f} ms")
+  print(f"  generate_batch:                     {1000 * batched:10.2f} ms")
+  print(f"  simulate_batch (every scheduler):   {1000 * simulation_only:10.2f} ms")
+
+
+def benchmark_caching(args):
+  """Time to run each cache policy over traces of growing length."""
+  from premade_questions.cache_policies import CachePolicyRegistry, hit_rate
+
+  rng = random.Random(args.seed)
+  policies = CachePolicyRegistry.names()
+  print(f"{'trace length':>12} " + " ".join(f"{name + ' (ms)':>12}" for name in policies))
+  for trace_length in args.trace_lengths:
+    # Skewed towards a few popular pages, like a real program
+    trace = [int(rng.paretovariate(1.0)) % args.num_pages for _ in range(trace_length)]
+    timings = []
+    for name in policies:
+      start_time = time.perf_counter()
+      hit_rate(name, args.cache_size, trace)
+      timings.append(time.perf_counter() - start_time)
+    print(f"{trace_length:>12} " + " ".join(f"{1000 * timing:>12.2f}" for timing in timings))
+
+
+def benchmark_differential(args):
+  """How many candidate traces differential caching questions throw away before finding one that tells the policies apart."""
+  from premade_questions.memory_questions import CachingQuestion
+
+  logging.getLogger("premade_questions.memory_questions").setLevel(logging.INFO)
+  start_time = time.perf_counter()
+  for _ in range(args.num_questions):
+    CachingQuestion(
+      differential=True,
+      cache_size=args.cache_size,
+      num_elements=args.num_elements,
+      num_requests=args.num_requests,
+      cache_policies=list(CachingQuestion.Kind)
+    )
+  elapsed = time.perf_counter() - start_time
+
+  print(f"{'policy':>8} {'candidates':>12} {'accepted':>10} {'rate':>8}")
+  for kind, rate in CachingQuestion.acceptance_rates().items():
+    print(
+      f"{str(kind):>8} {CachingQuestion.differential_stats[(kind, 'candidates')]:>12} "
+      f"{CachingQuestion.differential_stats[(kind, 'accepted')]:>10} {100 * rate:>7.1f}%"
+    )
+  print(f"{1000 * elapsed / args.num_questions:0.2f} ms per question")
+
+
+def legacy_tex_escape(text):
+  """TableGenerator.tex_escape as it was before the native table renderer, to compare against."""
+  conv = {
+    '&': r'\&', '%': r'\%', '$': r'\$', '#': r'\#', '_': r'\_', '{': r'\{', '}': r'\}',
+    '~': r'\textasciitilde{}', '^': r'\^{}', '\\': r'\textbackslash{}', '<': r'\textless{}', '>': r'\textgreater{}',
+  }
+  regex = re.compile('|'.join(re.escape(str(key)) for key in sorted(conv.keys(), key = lambda item: - len(item))))
+  return regex.sub(lambda match: conv[match.group()], text)
+
+
+def legacy_table(table, output_format):
+  """TableGenerator.generate as it was before the native table renderer (pytablewriter for html)."""
+  from misc import OutputFormat
+  if output_format == OutputFormat.CANVAS:
+    import pytablewriter
+    table_writer = pytablewriter.HtmlTableWriter(headers=table.headers, value_matrix=table.value_matrix)
+    table_writer.type_hints = ["str" for _ in range(len(table.value_matrix[0]))]
+    return table_writer.dumps()
+  table_lines = [r"\begin{tabular}{" + '|c' * len(table.value_matrix[0]) + '|}', r"\toprule"]
+  if table.headers is not None:
+    table_lines.extend([' & '.join([legacy_tex_escape(element) for element in table.headers]) + r" \\", r"\midrule"])
+  table_lines.extend([' & '.join([legacy_tex_escape(element) for element in line]) + r" \\" for line in table.value_matrix])
+  table_lines.extend([r"\bottomrule", r"\end{tabular}"])
+  return '\n'.join(table_lines)
+
+
+def benchmark_tables(args):
+  """Time to render caching-question-sized tables natively versus the old pytablewriter / regex path, checking they match."""
+  from misc import OutputFormat
+  from question import TableGenerator
+
+  rng = random.Random(args.seed)
+  try:
+    import pytablewriter
+    output_formats = [OutputFormat.CANVAS, OutputFormat.LATEX]
+  except ImportError:
+    print("pytablewriter isn't installed, so only comparing LaTeX")
+    output_formats = [OutputFormat.LATEX]
+
+  print(f"{'rows':>6} {'format':>8} {'old (us)':>10} {'native (us)':>12} {'speedup':>8}")
+  for num_rows in args.num_rows:
+    # Like a caching question: request, hit, evicted and cache state, with answer blanks and characters to escape
+    tables = [
+      TableGenerator(
+        headers=["", "Page Requested", "Hit/Miss", "Evicted", "Cache State"],
+        value_matrix=[
+          [str(i), str(rng.randint(0, 9)), rng.choice(["Hit", "Miss", f"[answer__hit-{i}]"]), rng.choice(["-", "3", "a_b"]), "{1, 2} & <3>"]
+          for i in range(num_rows)
+        ]
+      )
+      for _ in range(args.num_tables)
+    ]
+    for output_format in output_formats:
+      for table in tables:
+        if table.generate(output_format) != legacy_table(table, output_format):
+          raise AssertionError(f"Native {output_format.name} table doesn't match the old one:\n{table.generate(output_format)}")
+      start_time = time.perf_counter()
+      for table in tables:
+        legacy_table(table, output_format)
+      old_time = time.perf_counter() - start_time
+      start_time = time.perf_counter()
+      for table in tables:
+        table.generate(output_format)
+      native_time = time.perf_counter() - start_time
+      print(
+        f"{num_rows:>6} {output_format.name:>8} {1e6 * old_time / len(tables):>10.1f} "
+        f"{1e6 * native_time / len(tables):>12.1f} {old_time / native_time:>7.1f}x"
+      )
+
+
+# Only canvas pushes, plotting and pandoc rendering need these, so a pdf-only run shouldn't import them
+DEFERRED_MODULES = ["canvasapi", "dotenv", "matplotlib", "pypandoc", "pytablewriter"]
+
+
+def benchmark_startup(args):
+  """Time for a fresh interpreter to import quiz.py and load a quiz yaml, failing if it is over budget or imports something it shouldn't."""
+  src_dir = os.path.dirname(os.path.abspath(__file__))
+  scenarios = {
+    "import quiz": "import quiz",
+    "load quiz yaml": f"import quiz; quiz.Quiz.from_yaml({args.quiz_yaml!r})",
+  }
+  report = f"import sys; print(' '.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+
+  # Every scenario has to be within the budget, and none of them may import a deferred module
+  failures = []
+  print(f"{'scenario':>16} {'median (ms)':>12} {'min (ms)':>10}  imported")
+  for name, script in scenarios.items():
+    timings = []
+    for _ in range(args.repeats):
+      start_time = time.perf_counter()
+      proc = subprocess.run([sys.executable, "-c", f"{script}; {report}"], cwd=src_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+      timings.append(time.perf_counter() - start_time)
+    imported = proc.stdout.decode().strip().splitlines()[-1:] or [""]
+    median_ms = 1000 * statistics.median(timings)
+    print(f"{name:>16} {median_ms:>12.1f} {1000 * min(timings):>10.1f}  {imported[0]}")
+    if median_ms > args.budget_ms:
+      failures.append(f"\"{name}\" took {median_ms:0.1f}ms, over its budget of {args.budget_ms}ms")
+    if imported[0] != "":
+      failures.append(f"\"{name}\" imported {imported[0]}")
+
+  if failures:
+    print("Startup check failed: " + "; ".join(failures))
+    sys.exit(1)
+
+
+def parse_args():
+  parser = argparse.ArgumentParser()
+  subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+  selection_parser = subparsers.add_parser("selection", help="Question selection time versus pool size")
+  selection_parser.add_argument("--pool_sizes", nargs="+", type=int, default=[10, 20, 30, 50, 100, 200, 400])
+  selection_parser.add_argument("--point_values", nargs="+", type=int, default=[1, 2, 4, 5, 8, 10])
+  selection_parser.add_argument("--repeats", type=int, default=10)
+  selection_parser.add_argument("--seed", type=int, default=0)
+  selection_parser.set_defaults(func=benchmark_selection)
+
+  constraints_parser = subparsers.add_parser("constraints", help="Constrained exam composition time versus pool size")
+  constraints_parser.add_argument("--pool_sizes", nargs="+", type=int, default=[50, 100, 200, 400])
+  constraints_parser.add_argument("--point_values", nargs="+", type=int, default=[1, 2, 4, 5, 8, 10])
+  constraints_parser.add_argument("--total_points", type=int, default=100)
+  constraints_parser.add_argument("--repeats", type=int, default=5)
+  constraints_parser.add_argument("--seed", type=int, default=0)
+  constraints_parser.set_defaults(func=benchmark_constraints)
+
+  scheduling_parser = subparsers.add_parser("scheduling", help="Scheduling question generation, one at a time versus batched")
+  scheduling_parser.add_argument("--num_variations", type=int, default=1000)
+  scheduling_parser.add_argument("--num_jobs", type=int, default=3)
+  scheduling_parser.add_argument("--seed", type=int, default=0)
+  scheduling_parser.set_defaults(func=benchmark_scheduling)
+
+  caching_parser = subparsers.add_parser("caching", help="Cache policy simulation time versus trace length")
+  caching_parser.add_argument("--trace_lengths", nargs="+", type=int, default=[1_000, 10_000, 100_000, 1_000_000])
+  caching_parser.add_argument("--cache_size", type=int, default=64)
+  caching_parser.add_argument("--num_pages", type=int, default=1024)
+  caching_parser.add_argument("--seed", type=int, default=0)
+  caching_parser.set_defaults(func=benchmark_caching)
+
+  differential_parser = subparsers.add_parser("differential", help="Acceptance rate of differential caching questions")
+  differential_parser.add_argument("--num_questions", type=int, default=600)
+  differential_parser.add_argument("--cache_size", type=int, default=3)
+  differential_parser.add_argument("--num_elements", type=int, default=5)
+  differential_parser.add_argument("--num_requests", type=int, default=10)
+  differential_parser.add_argument("--seed", type=int, default=0)
+  differential_parser.set_defaults(func=benchmark_differential)
+
+  tables_parser = subparsers.add_parser("tables", help="Native table rendering versus the old pytablewriter / regex path")
+  tables_parser.add_argument("--num_rows", nargs="+", type=int, default=[3, 10, 30, 100])
+  tables_parser.add_argument("--num_tables", type=int, default=200)
+  tables_parser.add_argument("--seed", type=int, default=0)
+  tables_parser.set_defaults(func=benchmark_tables)
+
+  startup_parser = subparsers.add_parser("startup", help="Startup time of a pdf-only run, against a budget")
+  startup_parser.add_argument("--quiz_yaml", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "../example_files/exam.yaml"))
+  startup_parser.add_argument("--repeats", type=int, default=5)
+  startup_parser.add_argument("--budget_ms", type=float, default=1000)
+  startup_parser.set_defaults(func=benchmark_startup)
+
+  return parser.parse_args()
+
+
+def main():
+  args = parse_args()
+  args.func(args)
+
+
+if __name__ == "__main__":
+  main()
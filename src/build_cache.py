@@ -0,0 +1,108 @@
+#!env python
+from __future__ import annotations
+
+import collections
+import hashlib
+import os
+import shutil
+import threading
+from typing import List
+
+from misc import OutputFormat
+from question import Question
+from renderers import RenderCache
+from variation_bank import VariationBank
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+class BuildCache:
+  """
+  What earlier builds made, so that rebuilding a quiz only regenerates the questions and recompiles the pdfs whose
+  content actually changed.
+  Question blocks are keyed by the question (class, kwargs and code, as in the variation bank), the seed they were
+  made from and the renderer version, so only questions with an exam seed can be cached.
+  Pdfs (and their logs) are keyed by a hash of their whole source.
+  """
+  def __init__(self, cache_dir):
+    self.cache_dir = cache_dir
+    # Blocks are just text, which the render cache already knows how to keep
+    self.blocks = RenderCache(cache_dir=os.path.join(cache_dir, "blocks"))
+    self.pdf_dir = os.path.join(cache_dir, "pdfs")
+    os.makedirs(self.pdf_dir, exist_ok=True)
+    # pdfs are looked up from the build farm's threads
+    self.lock = threading.Lock()
+    self.stats : collections.Counter[str] = collections.Counter()
+    self.regenerated : collections.Counter[str] = collections.Counter()
+    self.recompiled : List[str] = []
+
+  @staticmethod
+  def get_path_for_yaml(path_to_yaml) -> str:
+    return f"{os.path.splitext(path_to_yaml)[0]}.build-cache"
+
+  @staticmethod
+  def get_block_key(question: Question, seed: int|None) -> str|None:
+    if seed is None:
+      return None
+    key = VariationBank.get_key(question, OutputFormat.LATEX)
+    if key is None:
+      return None
+    return hashlib.sha256(repr((*key, seed)).encode("utf-8")).hexdigest()
+
+  def get_block(self, question: Question, seed: int|None) -> str|None:
+    key = self.get_block_key(question, seed)
+    if key is None:
+      return None
+    block = self.blocks.get(key)
+    self.stats["blocks reused" if block is not None else "blocks generated"] += 1
+    if block is None:
+      self.regenerated[question.name] += 1
+    return block
+
+  def put_block(self, question: Question, seed: int|None, block: str):
+    key = self.get_block_key(question, seed)
+    if key is not None:
+      self.blocks.put(key, block)
+
+  @staticmethod
+  def get_pdf_key(tex_source: str, engine: str) -> str:
+    return hashlib.sha256(f"{engine}\0{tex_source}".encode("utf-8")).hexdigest()
+
+  def get_pdf(self, name: str, tex_source: str, engine: str, pdf_path: str, log_path: str) -> bool:
+    """Copies the pdf and log from an earlier build of `tex_source` to the given paths, returning whether there was one."""
+    key = self.get_pdf_key(tex_source, engine)
+    cached_pdf = os.path.join(self.pdf_dir, f"{key}.pdf")
+    cached_log = os.path.join(self.pdf_dir, f"{key}.log")
+    if not (os.path.exists(cached_pdf) and os.path.exists(cached_log)):
+      with self.lock:
+        self.stats["pdfs compiled"] += 1
+        self.recompiled.append(name)
+      return False
+    shutil.copy(cached_pdf, pdf_path)
+    shutil.copy(cached_log, log_path)
+    with self.lock:
+      self.stats["pdfs reused"] += 1
+    return True
+
+  def put_pdf(self, tex_source: str, engine: str, pdf_path: str, log_path: str):
+    key = self.get_pdf_key(tex_source, engine)
+    # Copy to the side and rename so concurrent builds never see a partial entry
+    for path, extension in [(log_path, "log"), (pdf_path, "pdf")]:
+      tmp_path = os.path.join(self.pdf_dir, f"{key}.{extension}.{os.getpid()}.{threading.get_ident()}.tmp")
+      shutil.copy(path, tmp_path)
+      os.replace(tmp_path, os.path.join(self.pdf_dir, f"{key}.{extension}"))
+
+  def describe(self):
+    if sum(self.stats.values()) == 0:
+      return
+    log.info(
+      f"Build cache: reused {self.stats['blocks reused']} / {self.stats['blocks reused'] + self.stats['blocks generated']} "
+      f"question blocks and {self.stats['pdfs reused']} / {self.stats['pdfs reused'] + self.stats['pdfs compiled']} pdfs"
+    )
+    for name, count in self.regenerated.most_common():
+      log.info(f"  regenerated {name} ({count}x)")
+    for name in self.recompiled:
+      log.info(f"  recompiled {name}")
@@ -1,8 +1,13 @@
 #!env python
 
 import argparse
+import collections
 import collections.abc
+import concurrent.futures
+import dataclasses
+import itertools
 import pprint
+import threading
 import time
 import typing
 from datetime import datetime, timezone
@@ -14,9 +19,16 @@ import canvasapi.quiz
 import canvasapi.assignment
 import canvasapi.submission
 import dotenv, os
+import requests.exceptions
 import sys
 
 from quiz import Quiz, Question
+from canvas_requests import CanvasRequestLayer
+from generation import GenerationScheduler, render_variation
+from misc import OutputFormat
+from upload_journal import UploadJournal
+from variation_bank import VariationBank
+from variation_space import VariationSpaceEstimate
 
 import logging
 logging.basicConfig()
@@ -35,30 +47,77 @@ logger.setLevel(logging.WARNING)
 
 
 QUESTION_VARIATIONS_TO_TRY = 1000
+UPLOAD_CONCURRENCY = 4
+
+
+@dataclasses.dataclass
+class UploadStats:
+  generated : int = 0
+  banked : int = 0                # variations taken from the variation bank instead of generated
+  duplicates : int = 0
+  uploaded : int = 0
+  failed : int = 0
+  missing : int = 0               # variations we wanted but couldn't get uploaded
+  resumed : int = 0               # variations already uploaded by a previous run
+  skipped_groups : int = 0        # question groups a previous run finished
+  attempts_saved : int = 0        # attempts not made because a question had run out of new variations
+  generation_time : float = 0
+  start_time : float = dataclasses.field(default_factory=time.perf_counter)
+  lock : threading.Lock = dataclasses.field(default_factory=threading.Lock, repr=False)
+  
+  def describe(self):
+    elapsed = time.perf_counter() - self.start_time
+    log.info(
+      f"Pushed {self.uploaded} variations ({self.failed} failed, {self.duplicates} duplicates skipped) "
+      f"in {elapsed:0.1f}s: {self.uploaded / elapsed if elapsed > 0 else 0:0.2f} questions/s "
+      f"({self.generation_time:0.1f}s spent generating)"
+    )
+    if self.missing:
+      log.warning(f"Came up {self.missing} variations short because of failed uploads")
+    if self.attempts_saved:
+      log.info(f"Stopped early on questions that ran out of variations, saving {self.attempts_saved} attempts")
+    if self.banked:
+      log.info(f"Took {self.banked} variations from the variation bank")
+    if self.resumed or self.skipped_groups:
+      log.info(f"Resumed from journal: skipped {self.skipped_groups} finished groups and {self.resumed} variations already uploaded")
+
+
+def upload_succeeded(future: concurrent.futures.Future) -> bool:
+  return future.exception() is None and future.result()
 
 
 class CanvasInterface:
-  def __init__(self, *, course_id : int, prod=False):
+  def __init__(self, *, course_id : int, prod=False, canvas: canvasapi.Canvas|None = None):
     super().__init__()
-    dotenv.load_dotenv(os.path.join(os.path.expanduser("~"), ".env"))
-    log.debug(os.environ.get("CANVAS_API_URL"))
-    if prod:
-      log.warning("Using canvas PROD!")
-      self.canvas = canvasapi.Canvas(os.environ.get("CANVAS_API_URL_prod"), os.environ.get("CANVAS_API_KEY_prod"))
+    if canvas is not None:
+      # e.g. pointed at a mock server
+      self.canvas = canvas
     else:
-      log.info("Using canvas DEV")
-      self.canvas = canvasapi.Canvas(os.environ.get("CANVAS_API_URL"), os.environ.get("CANVAS_API_KEY_prod"))
-    self.course = self.canvas.get_course(course=course_id)
+      dotenv.load_dotenv(os.path.join(os.path.expanduser("~"), ".env"))
+      log.debug(os.environ.get("CANVAS_API_URL"))
+      if prod:
+        log.warning("Using canvas PROD!")
+        self.canvas = canvasapi.Canvas(os.environ.get("CANVAS_API_URL_prod"), os.environ.get("CANVAS_API_KEY_prod"))
+      else:
+        log.info("Using canvas DEV")
+        self.canvas = canvasapi.Canvas(os.environ.get("CANVAS_API_URL"), os.environ.get("CANVAS_API_KEY_prod"))
+    
+    # All of our canvas calls go through this so they share rate limiting, retries and metrics
+    self.requests = CanvasRequestLayer(self.canvas)
+    
+    self.course = self.requests.call(self.canvas.get_course, course=course_id)
   
   def create_assignment_group(self, name="dev") -> canvasapi.course.AssignmentGroup:
-    for assignment_group in self.course.get_assignment_groups():
+    for assignment_group in self.requests.call(lambda: list(self.course.get_assignment_groups())):
       if assignment_group.name == name:
         log.info("Found group existing, returning")
         return assignment_group
-    assignment_group = self.course.create_assignment_group(
+    assignment_group = self.requests.call(
+      self.course.create_assignment_group,
       name="dev",
       group_weight=0.0,
       position=1,
+      idempotent=False
     )
     return assignment_group
   
@@ -72,7 +131,7 @@ class CanvasInterface:
     if title is None:
       title = f"New Quiz {datetime.now().strftime('%m/%d/%y %H:%M:%S.%f')}"
     
-    q = self.course.create_quiz(quiz={
+    q = self.requests.call(self.course.create_quiz, quiz={
       "title": title,
       "hide_results" : None,
       "show_correct_answers": True,
@@ -87,84 +146,247 @@ class CanvasInterface:
         Please note that although the answers section may be a bit lengthy,
         below them is often an in-depth explanation on solving the problem!
       """
-    })
+    }, idempotent=False)
     return q
 
+  def get_or_create_quiz(
+      self,
+      title: str,
+      is_practice: bool,
+      journal: UploadJournal|None,
+      resume: bool
+  ) -> canvasapi.quiz.Quiz:
+    if journal is not None and resume:
+      quiz_id = journal.get_quiz_id(self.course.id, title)
+      if quiz_id is not None:
+        try:
+          canvas_quiz = self.requests.call(self.course.get_quiz, quiz_id)
+          log.info(f"Resuming push to quiz {quiz_id} ({title})")
+          return canvas_quiz
+        except canvasapi.exceptions.ResourceDoesNotExist:
+          log.warning(f"Quiz {quiz_id} from the journal no longer exists in canvas, starting over")
+    
+    assignment_group = self.create_assignment_group()
+    canvas_quiz = self.add_quiz(assignment_group, title, is_practice=is_practice)
+    if journal is not None:
+      journal.record_quiz(self.course.id, title, canvas_quiz.id)
+    return canvas_quiz
+  
   def push_quiz_to_canvas(
       self,
       quiz: Quiz,
       num_variations: int,
       title: typing.Optional[str] = None,
-      is_practice = False
+      is_practice = False,
+      upload_concurrency: int = UPLOAD_CONCURRENCY,
+      journal: UploadJournal|None = None,
+      resume = False,
+      scheduler: GenerationScheduler|None = None,
+      bank: VariationBank|None = None
   ):
-    assignment_group = self.create_assignment_group()
-    canvas_quiz = self.add_quiz(assignment_group, title, is_practice=is_practice)
+    if title is None:
+      title = quiz.name
+    canvas_quiz = self.get_or_create_quiz(title, is_practice, journal, resume)
+    
+    stats = UploadStats()
+    self.requests.set_max_concurrency(upload_concurrency)
     
+    # Generation happens on this thread while a pool of workers uploads what has been generated so far.
+    # The semaphore keeps generation from running too far ahead of the uploads.
+    uploads_in_flight = threading.BoundedSemaphore(2 * upload_concurrency)
     all_variations = set()
-    for question_i, question in enumerate(quiz):
-      log.debug(f"Generating #{question_i} ({question.name})")
-  
-      group : canvasapi.quiz.QuizGroup = canvas_quiz.create_question_group([
-        {
-          "name": f"{question.name}",
-          "pick_count": 1,
-          "question_points": question.points_value
-        }
-      ])
+    
+    # A variation only counts once its upload is confirmed (or while it is still in flight).
+    # Failed uploads give their slot, and their fingerprint, back so that a replacement gets made.
+    uploads_by_group : Dict[int, Dict[concurrent.futures.Future, str]] = {}
+    released_failures = set()
+    def count_uploads(group_id) -> int:
+      num_uploads = 0
+      for future, fingerprint in uploads_by_group[group_id].items():
+        if not future.done() or upload_succeeded(future):
+          num_uploads += 1
+        elif future not in released_failures:
+          released_failures.add(future)
+          all_variations.discard(fingerprint)
+      return num_uploads
+    
+    def upload_variations(executor, question_i, question, group_id, num_wanted):
+      # Banked variations go first, and we only generate once the bank runs out
+      banked_variations = iter(()) if bank is None else bank.draw(question, OutputFormat.CANVAS, all_variations)
+      
+      # With a scheduler, variations are generated ahead of us in other processes and handed over in order
+      variations = None
+      if scheduler is not None:
+        variations = scheduler.generate_variations(
+          question,
+          OutputFormat.CANVAS,
+          self.course,
+          canvas_quiz,
+          expected_count=num_wanted - count_uploads(group_id),
+          skip=all_variations
+        )
+      
+      # Stop once we have (probably) seen every variation rather than making all of our attempts
+      variation_space = VariationSpaceEstimate(question.possible_variations)
       
-      # Track all variations across every question, in case we have duplicate questions
-      variation_count = 0
       for attempt_number in range(QUESTION_VARIATIONS_TO_TRY):
+        variation_count = count_uploads(group_id)
+        if variation_count >= num_wanted:
+          break
+        if variation_space.is_exhausted():
+          stats.attempts_saved += QUESTION_VARIATIONS_TO_TRY - attempt_number
+          log.info(
+            f"#{question_i} ({question.name}) looks exhausted after {variation_space.num_attempts} attempts: "
+            f"{variation_space.num_distinct} distinct variations of an estimated {variation_space.estimate():0.1f}, "
+            f"skipping the remaining {QUESTION_VARIATIONS_TO_TRY - attempt_number} attempts"
+          )
+          break
         
         # Get the question in a format that is ready for canvas (e.g. json)
-        question_for_canvas = question.get__canvas(self.course, canvas_quiz)
-        question_fingerprint = question_for_canvas["question_text"]
-        try:
-          question_fingerprint += ''.join([str(a["answer_text"]) for a in question_for_canvas["answers"]])
-        except TypeError as e:
-          log.error(e)
-          log.warning("Continuing anyway")
-          
+        variation = None
+        question_fingerprint, question_for_canvas = next(banked_variations, (None, None))
+        if question_for_canvas is not None:
+          stats.banked += 1
+        else:
+          # Variations we have already seen come back unrendered
+          generation_start = time.perf_counter()
+          if variations is not None:
+            variation = next(variations)
+          else:
+            variation = render_variation(question, OutputFormat.CANVAS, question.next_seed(), self.course, canvas_quiz, all_variations)
+          stats.generation_time += time.perf_counter() - generation_start
+          stats.generated += 1
+          question_fingerprint, question_for_canvas = variation.fingerprint, variation.rendered
+          variation_space.observe(question_fingerprint)
         
         # if it is in the variations that we have already seen then skip ahead, else track
         if question_fingerprint in all_variations:
+          stats.duplicates += 1
+          question.record_duplicate()
           continue
         all_variations.add(question_fingerprint)
+        if bank is not None and variation is not None:
+          bank.put(question, OutputFormat.CANVAS, variation.seed, question_for_canvas, question_fingerprint)
         
         # Set group ID to add it to the question group
-        question_for_canvas["quiz_group_id"] = group.id
+        question_for_canvas["quiz_group_id"] = group_id
         
-        # Push question to canvas
-        log.debug(f"Pushing #{question_i} ({question.name}) {variation_count+1} / {num_variations} to canvas...")
-        try:
-          canvas_quiz.create_question(question=question_for_canvas)
-        except canvasapi.exceptions.CanvasException as e:
-          log.warning("Encountered Canvas error.")
-          log.warning(e)
-          log.warning("Sleeping for 1s...")
-          time.sleep(1)
+        # Hand the question off to the upload workers
+        uploads_in_flight.acquire()
+        future = executor.submit(
+          self.upload_question,
+          canvas_quiz,
+          question_for_canvas,
+          f"#{question_i} ({question.name}) {variation_count+1} / {num_wanted}",
+          stats,
+          journal,
+          question_fingerprint
+        )
+        future.add_done_callback(lambda _: uploads_in_flight.release())
+        uploads_by_group[group_id][future] = question_fingerprint
+      
+      if variations is not None:
+        variations.close()
+    
+    groups = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=upload_concurrency, thread_name_prefix="canvas-upload") as executor:
+      for question_i, question in enumerate(quiz):
+        
+        # Reuse the question group from a previous run if we have one, and skip it entirely if it was finished
+        previous_group = None if journal is None else journal.get_group(canvas_quiz.id, question_i, question.name)
+        if previous_group is not None and previous_group[1]:
+          log.debug(f"Skipping #{question_i} ({question.name}), already uploaded")
+          stats.skipped_groups += 1
           continue
         
-        # Update and check variations already seen
-        variation_count += 1
-        if variation_count >= num_variations:
-          break
-        if variation_count >= question.possible_variations:
-          break
+        log.debug(f"Generating #{question_i} ({question.name})")
+        
+        if previous_group is not None:
+          group_id = previous_group[0]
+          already_uploaded = journal.get_variations(group_id)
+        else:
+          group : canvasapi.quiz.QuizGroup = self.requests.call(canvas_quiz.create_question_group, [
+            {
+              "name": f"{question.name}",
+              "pick_count": 1,
+              "question_points": question.points_value
+            }
+          ], idempotent=False)
+          group_id = group.id
+          already_uploaded = set()
+          if journal is not None:
+            journal.record_group(canvas_quiz.id, question_i, question.name, group_id)
         
+        # Track all variations across every question, in case we have duplicate questions
+        all_variations.update(already_uploaded)
+        stats.resumed += len(already_uploaded)
+        
+        num_wanted = max(0, min(num_variations, question.possible_variations) - len(already_uploaded))
+        groups.append((question_i, question, group_id, num_wanted))
+        uploads_by_group[group_id] = {}
+        upload_variations(executor, question_i, question, group_id, num_wanted)
+      
+      # Uploads can fail after we have moved on from their group, so give those groups one more round.
+      # Groups that are only short because the question ran out of variations don't need one.
+      concurrent.futures.wait(itertools.chain(*uploads_by_group.values()))
+      for question_i, question, group_id, num_wanted in groups:
+        uploads = uploads_by_group[group_id]
+        if count_uploads(group_id) < num_wanted and not all(upload_succeeded(future) for future in uploads):
+          log.info(f"Replacing failed uploads for #{question_i} ({question.name})")
+          upload_variations(executor, question_i, question, group_id, num_wanted)
+      concurrent.futures.wait(itertools.chain(*uploads_by_group.values()))
+    
+    # Groups are only done once they have everything we could make for them, so a rerun will fill in anything that failed
+    for question_i, question, group_id, num_wanted in groups:
+      uploads = uploads_by_group[group_id]
+      num_uploaded = sum(1 for future in uploads if upload_succeeded(future))
+      if num_uploaded < num_wanted and not all(upload_succeeded(future) for future in uploads):
+        log.warning(f"#{question_i} ({question.name}) is {num_wanted - num_uploaded} variations short after failed uploads")
+        stats.missing += num_wanted - num_uploaded
+      elif journal is not None:
+        journal.mark_group_complete(group_id)
+    
+    stats.describe()
+    Question.describe_duplicates()
+    self.requests.describe()
+    return stats
+  
+  def upload_question(
+      self,
+      canvas_quiz: canvasapi.quiz.Quiz,
+      question_for_canvas: Dict,
+      description: str,
+      stats: UploadStats,
+      journal: UploadJournal|None = None,
+      fingerprint: str|None = None
+  ) -> bool:
+    log.debug(f"Pushing {description} to canvas...")
+    try:
+      self.requests.call(canvas_quiz.create_question, question=question_for_canvas, idempotent=False)
+    except (canvasapi.exceptions.CanvasException, requests.exceptions.RequestException) as e:
+      log.error(f"Giving up on pushing {description}: {e}")
+      with stats.lock:
+        stats.failed += 1
+      return False
+    if journal is not None:
+      journal.record_variation(question_for_canvas["quiz_group_id"], fingerprint)
+    with stats.lock:
+      stats.uploaded += 1
+    return True
+  
   def get_assignments(self):
-    assignments = self.course.get_assignments()
+    assignments = self.requests.call(lambda: list(self.course.get_assignments()))
     return assignments
   
   
   def get_submissions(self, assignments: List[canvasapi.assignment.Assignment]):
     submissions : List[canvasapi.submission.Submission] = []
     for assignment in assignments:
-      submissions.extend(assignment.get_submissions())
+      submissions.extend(self.requests.call(lambda: list(assignment.get_submissions())))
     return submissions
   
   def get_username(self, user_id: int):
-    return self.course.get_user(user_id).name
+    return self.requests.call(self.course.get_user, user_id).name
   
 class CanvasHelpers:
   @staticmethod
@@ -178,7 +400,7 @@ class CanvasHelpers:
   def get_unsubmitted_submissions(interface: CanvasInterface, assignment: canvasapi.assignment.Assignment) -> List[canvasapi.submission.Submission]:
     submissions : List[canvasapi.submission.Submission] = list(filter(
       lambda s: s.workflow_state == "unsubmitted",
-      assignment.get_submissions()
+      interface.requests.call(lambda: list(assignment.get_submissions()))
     ))
     return submissions
   
@@ -189,7 +411,7 @@ class CanvasHelpers:
       log.debug(f"Assignment: {assignment}")
       for submission in cls.get_unsubmitted_submissions(interface, assignment):
         log.debug(f"{submission.user_id} ({interface.get_username(submission.user_id)}) : {submission.workflow_state} : {submission.missing}")
-        submission.edit(submission={"late_policy_status" : "missing"})
+        interface.requests.call(submission.edit, submission={"late_policy_status" : "missing"})
   
  
 def main():
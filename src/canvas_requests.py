@@ -0,0 +1,246 @@
+#!env python
+from __future__ import annotations
+
+import dataclasses
+import random
+import threading
+import time
+from typing import Callable, TypeVar
+
+import canvasapi
+import canvasapi.exceptions
+import requests.exceptions
+import urllib3.exceptions
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+T = TypeVar("T")
+
+
+@dataclasses.dataclass
+class RequestMetrics:
+  requests : int = 0
+  retries : int = 0
+  failures : int = 0
+  throttled : int = 0             # requests Canvas refused because of rate limiting
+  throttle_waits : int = 0        # times we paused before sending because the bucket was low
+  throttle_wait_time : float = 0
+  request_time : float = 0
+  lowest_remaining : float|None = None
+
+  def describe(self):
+    log.info(
+      f"Canvas requests: {self.requests} requests ({self.request_time:0.1f}s), {self.retries} retries, {self.failures} failures, "
+      f"{self.throttled} throttled, {self.throttle_waits} throttle waits ({self.throttle_wait_time:0.1f}s), "
+      f"lowest rate limit remaining: {self.lowest_remaining}"
+    )
+
+
+class AdaptiveLimiter:
+  """
+  Caps the number of requests in flight, using additive increase / multiplicative decrease on the cap.
+  """
+  def __init__(self, max_concurrency: int, min_concurrency: int = 1):
+    self.max_concurrency = max_concurrency
+    self.min_concurrency = min_concurrency
+    self.limit = float(max_concurrency)
+    self.in_flight = 0
+    self.condition = threading.Condition()
+
+  def acquire(self):
+    with self.condition:
+      while self.in_flight >= int(self.limit):
+        self.condition.wait()
+      self.in_flight += 1
+
+  def release(self):
+    with self.condition:
+      self.in_flight -= 1
+      self.condition.notify_all()
+
+  def increase(self):
+    with self.condition:
+      self.limit = min(self.max_concurrency, self.limit + 1.0 / max(self.limit, 1.0))
+      self.condition.notify_all()
+
+  def decrease(self):
+    with self.condition:
+      self.limit = max(self.min_concurrency, self.limit / 2)
+
+  def set_max_concurrency(self, max_concurrency: int):
+    with self.condition:
+      self.max_concurrency = max(max_concurrency, self.min_concurrency)
+      self.limit = min(self.limit, self.max_concurrency)
+      self.condition.notify_all()
+
+
+class CanvasRequestLayer:
+  """
+  Shared request layer for everything that talks to Canvas through canvasapi.
+  Each call waits if the rate limit bucket (X-Rate-Limit-Remaining) is low, limits how many requests are in flight
+  (shrinking that limit when Canvas throttles us), and retries throttled or transient failures with jittered exponential backoff.
+  Calls that create things are made with `idempotent=False`, and are only retried when we know Canvas never acted on them,
+  since e.g. a timed out create_question may well have created the question anyway.
+  It only needs a canvasapi.Canvas object, so pointing that at a local mock server exercises all of it.
+  Note: this only depends on canvasapi and requests so that both src/ and canvas_plugin/ can import it.
+  """
+  MAX_CONCURRENCY = 4
+  MAX_ATTEMPTS = 5
+  BASE_DELAY = 0.5                # seconds, doubled each retry
+  MAX_DELAY = 30
+
+  LOW_WATER_MARK = 100.0          # Start slowing down when the rate limit bucket gets this low
+  HIGH_WATER_MARK = 300.0         # Only grow concurrency while there's plenty left
+  REFILL_PER_SECOND = 10.0        # Roughly how quickly Canvas refills the bucket
+
+  # Client errors that retrying won't fix
+  NON_RETRYABLE = (
+    canvasapi.exceptions.BadRequest,
+    canvasapi.exceptions.InvalidAccessToken,
+    canvasapi.exceptions.Unauthorized,
+    canvasapi.exceptions.ResourceDoesNotExist,
+    canvasapi.exceptions.UnprocessableEntity,
+    canvasapi.exceptions.RequiredFieldMissing,
+  )
+
+  def __init__(self, canvas: canvasapi.Canvas|None = None, max_concurrency: int = MAX_CONCURRENCY, max_attempts: int = MAX_ATTEMPTS):
+    self.max_attempts = max_attempts
+    self.limiter = AdaptiveLimiter(max_concurrency)
+    self.metrics = RequestMetrics()
+    self.lock = threading.Lock()
+
+    self.remaining : float|None = None
+    self.retry_after : float = 0
+
+    # Whether the last response on this thread was Canvas refusing us because of rate limiting
+    self.last_response = threading.local()
+
+    if canvas is not None:
+      self.attach(canvas)
+
+  def attach(self, canvas: canvasapi.Canvas):
+    # Every canvasapi object shares the Canvas object's requester, so hooking its session lets us see all responses.
+    # That session is private to canvasapi, so say what broke if a new version moves it.
+    try:
+      hooks = canvas._Canvas__requester._session.hooks
+    except AttributeError as e:
+      raise RuntimeError(
+        f"Can't watch canvas responses for rate limiting: canvasapi {getattr(canvasapi, '__version__', '(unknown version)')} "
+        f"no longer keeps its requests session at Canvas._Canvas__requester._session"
+      ) from e
+    hooks["response"].append(self.on_response)
+
+  def set_max_concurrency(self, max_concurrency: int):
+    self.limiter.set_max_concurrency(max_concurrency)
+
+  @staticmethod
+  def is_throttled_response(response) -> bool:
+    # canvasapi only raises RateLimitExceeded for the 403 Canvas uses, and a plain CanvasException for a 429
+    if response.status_code == 429:
+      return True
+    return response.status_code == 403 and b"Rate Limit Exceeded" in response.content
+
+  def on_response(self, response, *args, **kwargs):
+    # Hooks run on the thread that made the request
+    self.last_response.throttled = self.is_throttled_response(response)
+    with self.lock:
+      if "X-Rate-Limit-Remaining" in response.headers:
+        self.remaining = float(response.headers["X-Rate-Limit-Remaining"])
+        if self.metrics.lowest_remaining is None or self.remaining < self.metrics.lowest_remaining:
+          self.metrics.lowest_remaining = self.remaining
+      if "Retry-After" in response.headers:
+        self.retry_after = max(self.retry_after, time.time() + float(response.headers["Retry-After"]))
+
+  def get_throttle_delay(self) -> float:
+    with self.lock:
+      delay = max(0.0, self.retry_after - time.time())
+      if self.remaining is not None and self.remaining < self.LOW_WATER_MARK:
+        delay = max(delay, (self.LOW_WATER_MARK - self.remaining) / self.REFILL_PER_SECOND)
+      return delay
+
+  def wait_for_capacity(self):
+    delay = self.get_throttle_delay()
+    if delay > 0:
+      log.debug(f"Rate limit low ({self.remaining}), waiting {delay:0.2f}s")
+      with self.lock:
+        self.metrics.throttle_waits += 1
+        self.metrics.throttle_wait_time += delay
+      time.sleep(delay)
+
+  def get_backoff(self, attempt: int) -> float:
+    # "Full jitter" so that retrying workers spread themselves out
+    return random.uniform(0, min(self.MAX_DELAY, self.BASE_DELAY * (2 ** attempt)))
+
+  @staticmethod
+  def failed_to_connect(exception: Exception) -> bool:
+    # The request never reached Canvas, so it can't have done anything
+    if isinstance(exception, requests.exceptions.ConnectTimeout):
+      return True
+    if isinstance(exception, requests.exceptions.ConnectionError) and exception.args:
+      reason = getattr(exception.args[0], "reason", None)
+      return isinstance(reason, urllib3.exceptions.NewConnectionError)
+    return False
+
+  def is_retryable(self, exception: Exception, idempotent: bool = True, throttled: bool = False) -> bool:
+    if throttled or self.failed_to_connect(exception):
+      return True
+    if not idempotent:
+      # Anything else might have happened on Canvas' end, and retrying would do it twice
+      return False
+    if isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+      return True
+    if isinstance(exception, canvasapi.exceptions.CanvasException):
+      return not isinstance(exception, self.NON_RETRYABLE)
+    return False
+
+  def call(self, function: Callable[..., T], *args, idempotent: bool = True, **kwargs) -> T:
+    """
+    Calls a canvasapi function (e.g. `layer.call(quiz.create_question, question=..., idempotent=False)`) with throttling and retries.
+    Pass `idempotent=False` for anything that creates something, so that it isn't retried unless it definitely didn't happen.
+    Paginated results are lazy in canvasapi, so wrap them so the pages are fetched in here, e.g. `layer.call(lambda: list(course.get_assignments()))`.
+    """
+    for attempt in range(self.max_attempts):
+      self.wait_for_capacity()
+      self.limiter.acquire()
+      self.last_response.throttled = False
+      start_time = time.perf_counter()
+      try:
+        result = function(*args, **kwargs)
+        error = None
+      except Exception as e:
+        error = e
+      finally:
+        self.limiter.release()
+        with self.lock:
+          self.metrics.requests += 1
+          self.metrics.request_time += time.perf_counter() - start_time
+
+      if error is None:
+        with self.lock:
+          plenty_left = (self.remaining is None or self.remaining > self.HIGH_WATER_MARK)
+        if plenty_left:
+          self.limiter.increase()
+        return result
+
+      throttled = self.last_response.throttled or isinstance(error, canvasapi.exceptions.RateLimitExceeded)
+      if throttled:
+        with self.lock:
+          self.metrics.throttled += 1
+        self.limiter.decrease()
+
+      if not self.is_retryable(error, idempotent, throttled) or attempt + 1 == self.max_attempts:
+        with self.lock:
+          self.metrics.failures += 1
+        raise error
+
+      backoff = self.get_backoff(attempt)
+      log.warning(f"Canvas request failed ({error}), retrying in {backoff:0.2f}s ({attempt+1} / {self.max_attempts})")
+      with self.lock:
+        self.metrics.retries += 1
+      time.sleep(backoff)
+
+  def describe(self):
+    self.metrics.describe()
@@ -0,0 +1,509 @@
+#!env python
+from __future__ import annotations
+
+import collections
+import dataclasses
+import fractions
+import itertools
+import math
+import operator
+import random
+from typing import List, Dict, Set, Tuple, Sequence
+
+from question import Question
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+class InfeasibleConstraints(ValueError):
+  """Raised when no selection of questions can satisfy an exam's constraints.  The message says which ones conflict."""
+  pass
+
+
+@dataclasses.dataclass
+class Range:
+  min : float = 0
+  max : float = float('inf')
+
+  @classmethod
+  def from_yaml(cls, value) -> Range:
+    # Either an exact value or a dictionary with "min" and/or "max"
+    if value is None:
+      return cls()
+    if isinstance(value, dict):
+      return cls(value.get("min", 0), value.get("max", float('inf')))
+    return cls(value, value)
+
+  def __contains__(self, value):
+    return self.min <= value <= self.max
+
+  def __str__(self):
+    if self.min == self.max:
+      return f"exactly {self.min:g}"
+    if self.max == float('inf'):
+      return f"at least {self.min:g}"
+    return f"between {self.min:g} and {self.max:g}"
+
+
+@dataclasses.dataclass
+class ExamConstraints:
+  """
+  What a valid exam looks like.  Loaded from the "constraints" section of an exam yaml, e.g.
+
+    constraints:
+      total points: 100             # or {min: 95, max: 105}
+      questions: {min: 10, max: 20}
+      topics:
+        memory:
+          points: {min: 20, max: 40}
+          questions: {max: 6}
+      at most one of:
+        - [paging table question, memory access]
+      fairness: 0.25                # how much less likely a question is to be reused in each additional version
+      same points per topic: true   # every version gets the same number of points from each topic
+  """
+  total_points : Range = dataclasses.field(default_factory=Range)
+  num_questions : Range = dataclasses.field(default_factory=Range)
+  topic_points : Dict[Question.Topic, Range] = dataclasses.field(default_factory=dict)
+  topic_questions : Dict[Question.Topic, Range] = dataclasses.field(default_factory=dict)
+  at_most_one_of : List[List[str]] = dataclasses.field(default_factory=list)
+  fairness : float = 0.25
+  same_points_per_topic : bool = True
+
+  @classmethod
+  def from_yaml(cls, constraints_dict: Dict) -> ExamConstraints:
+    constraints = cls(
+      total_points=Range.from_yaml(constraints_dict.get("total points", None)),
+      num_questions=Range.from_yaml(constraints_dict.get("questions", None)),
+      at_most_one_of=[list(group) for group in constraints_dict.get("at most one of", [])],
+      fairness=constraints_dict.get("fairness", 0.25),
+      same_points_per_topic=constraints_dict.get("same points per topic", True),
+    )
+    for topic_name, topic_dict in constraints_dict.get("topics", {}).items():
+      topic = Question.Topic.from_string(topic_name)
+      constraints.topic_points[topic] = Range.from_yaml(topic_dict.get("points", None))
+      if "questions" in topic_dict:
+        constraints.topic_questions[topic] = Range.from_yaml(topic_dict["questions"])
+    return constraints
+
+
+class ExamComposer:
+  """
+  Picks questions satisfying an ExamConstraints, uniformly at random among all valid selections
+  (or weighted away from questions already used, when composing several versions).
+
+  Questions are split into units: one for each topic with constraints, and one for everything else.
+  Within a unit a DP over the questions (interchangeable questions are taken together, C(m, k) ways to take k of m)
+  counts the ways to reach each (points, questions).  States outside the topic's ranges are dropped, and the units are
+  then combined by a second DP over (total points, total questions).
+  "At most one of" groups that share questions are handled together, as a cluster whose options are every subset of its
+  questions taking at most one from each of its groups.  A cluster inside a unit is a step of that unit's DP, while
+  clusters spanning units are solved once for each of their options.
+  Sampling walks back through the tables choosing each step in proportion to the number of selections it leads to.
+  Points are scaled to integers so fractional values work.
+  """
+
+  def __init__(self, questions: Sequence[Question], constraints: ExamConstraints):
+    self.questions = list(questions)
+    self.constraints = constraints
+
+    values = [fractions.Fraction(q.points_value).limit_denominator(1000) for q in self.questions]
+    self.scale = math.lcm(*[v.denominator for v in values]) if values else 1
+    self.units_of = {id(q) : int(v * self.scale) for q, v in zip(self.questions, values)}
+
+    self.exclusive_groups : List[List[Question]] = []
+    for names in constraints.at_most_one_of:
+      members = [q for q in self.questions if q.name in names]
+      missing = set(names) - set(q.name for q in members)
+      if missing:
+        log.warning(f"\"at most one of\" refers to questions that aren't in the exam: {sorted(missing)}")
+      if len(members) > 1:
+        self.exclusive_groups.append(members)
+    self.exclusive_clusters = self.get_exclusive_clusters(self.exclusive_groups)
+
+    self.topics = sorted(
+      set(q.kind for q in self.questions) | set(constraints.topic_points) | set(constraints.topic_questions),
+      key=lambda t: t.value
+    )
+
+  @staticmethod
+  def get_exclusive_clusters(groups: List[List[Question]]) -> List[List[Tuple[Question, ...]]]:
+    """
+    Joins "at most one of" groups that share questions into clusters, and returns the options for each cluster:
+    every subset of its questions (including none) that takes at most one question from each of its groups.
+    Each group is still its own constraint, so e.g. [a, b] and [b, c] allow {a, c}.
+    """
+    clusters : List[List[List[Question]]] = []
+    for group in groups:
+      ids = set(id(q) for q in group)
+      overlapping = [cluster for cluster in clusters if any(id(q) in ids for g in cluster for q in g)]
+      for cluster in overlapping:
+        clusters.remove(cluster)
+      clusters.append([g for cluster in overlapping for g in cluster] + [group])
+
+    options = []
+    for cluster in clusters:
+      members = list({id(q) : q for group in cluster for q in group}.values())
+      groups_of = {id(q) : [set(map(id, group)) for group in cluster if q in group] for q in members}
+      cluster_options = []
+      def extend(i, picked):
+        if i == len(members):
+          cluster_options.append(tuple(picked))
+          return
+        extend(i + 1, picked)
+        q = members[i]
+        if not any(id(p) in group for group in groups_of[id(q)] for p in picked):
+          extend(i + 1, picked + [q])
+      extend(0, [])
+      options.append(cluster_options)
+    return options
+
+  def to_units(self, points_range: Range) -> Tuple[int, float]:
+    low = math.ceil(points_range.min * self.scale - 1e-9)
+    high = points_range.max if points_range.max == float('inf') else math.floor(points_range.max * self.scale + 1e-9)
+    return max(low, 0), high
+
+  def to_points(self, units) -> float:
+    return units / self.scale
+
+  @staticmethod
+  def weighted_choice(options: List[Tuple[object, float]], rng: random.Random):
+    # Exact for integer weights (i.e. counts), which can be far too big for floats
+    total = sum(weight for _, weight in options)
+    if all(isinstance(weight, int) for _, weight in options):
+      choice = rng.randrange(total)
+    else:
+      choice = rng.random() * total
+    for option, weight in options:
+      if choice < weight:
+        return option
+      choice -= weight
+    return options[-1][0]
+
+  def get_ranges(self, topic_points: Dict[Question.Topic, float]|None):
+    """(points, questions) bounds in scaled units for every topic with constraints, capped by the exam-wide limits."""
+    max_total_points = self.to_units(self.constraints.total_points)[1]
+    max_total_questions = self.constraints.num_questions.max
+    ranges = {}
+    for topic in self.topics:
+      if topic_points is not None:
+        points = self.to_units(Range(topic_points.get(topic, 0), topic_points.get(topic, 0)))
+      elif topic in self.constraints.topic_points or topic in self.constraints.topic_questions:
+        points = self.to_units(self.constraints.topic_points.get(topic, Range()))
+      else:
+        continue
+      questions = self.constraints.topic_questions.get(topic, Range())
+      ranges[topic] = (
+        (points[0], min(points[1], max_total_points)),
+        (questions.min, min(questions.max, max_total_questions))
+      )
+    return ranges
+
+  def get_units(self, ranges) -> List[List[Question.Topic|None]]:
+    """Topics with constraints are each solved on their own and everything else is solved together (the None unit, last)."""
+    return [[topic] for topic in self.topics if topic in ranges] + [[None] + [topic for topic in self.topics if topic not in ranges]]
+
+  def build_unit(self, unit: List[Question.Topic|None], ranges, weights: Dict[int, float], skip: Set[int]):
+    """
+    Runs the DP for one unit, leaving out the questions in `skip`.
+    States are (points, questions) for the whole unit followed by points and questions for its topic if it is constrained
+    (questions are only counted if something limits them, which keeps the tables small).
+    Returns the dimensions of the state, the choices for each step, and the table after each step.
+    """
+    dims = [
+      (None, "points", (0, self.to_units(self.constraints.total_points)[1])),
+      (None, "questions", (0, self.constraints.num_questions.max))
+    ]
+    for topic in unit:
+      if topic in ranges:
+        dims.append((topic, "points", ranges[topic][0]))
+        if topic in self.constraints.topic_questions:
+          dims.append((topic, "questions", ranges[topic][1]))
+    limits = [high for *_, (low, high) in dims]
+    in_unit = [q for q in self.questions if q.kind in unit and id(q) not in skip]
+
+    # Each step is a list of ((questions, how many of them to take), multiplicity, state change) choices
+    steps = []
+    in_groups = set()
+    for cluster_options in self.exclusive_clusters:
+      members = [q for option in cluster_options for q in option]
+      if any(id(q) in skip for q in members) or members[0].kind not in unit:
+        continue
+      in_groups.update(id(q) for q in members)
+      steps.append([
+        (
+          (option, len(option)),
+          math.prod(weights[id(q)] for q in option),
+          tuple(map(sum, zip((0,) * len(dims), *[self.get_change(dims, q) for q in option])))
+        )
+        for option in cluster_options
+      ])
+
+    # Interchangeable questions (same change to the state and same weight) are taken together
+    interchangeable = collections.defaultdict(list)
+    for q in in_unit:
+      if id(q) not in in_groups:
+        interchangeable[(self.get_change(dims, q), weights[id(q)])].append(q)
+    for (change, weight), group in interchangeable.items():
+      max_k = min([len(group)] + [limit // c for c, limit in zip(change, limits) if c > 0 and limit != float('inf')])
+      choices = []
+      for k in range(int(max_k) + 1):
+        multiplicity = math.comb(len(group), k) * (weight ** k if weight != 1 else 1)
+        choices.append(((tuple(group), k), multiplicity, tuple(c * k for c in change)))
+      steps.append(choices)
+
+    tables = [{(0,) * len(dims) : 1}]
+    for step, choices in enumerate(steps):
+      # Taking more of a set of interchangeable questions only ever grows the state, so we can stop at the first that's too big
+      monotonic = (step >= len(steps) - len(interchangeable))
+      table = collections.defaultdict(int)
+      for state, ways in tables[-1].items():
+        for _, multiplicity, change in choices:
+          new_state = tuple(map(operator.add, state, change))
+          if any(map(operator.gt, new_state, limits)):
+            if monotonic:
+              break
+            continue
+          if multiplicity:
+            table[new_state] += ways * multiplicity
+      tables.append(dict(table))
+    return dims, steps, tables
+
+  def get_change(self, dims, question: Question) -> Tuple[int, ...]:
+    """How adding `question` changes a unit's state."""
+    count_questions = (self.constraints.num_questions != Range())
+    change = []
+    for topic, kind, _ in dims:
+      if topic is not None and topic != question.kind:
+        change.append(0)
+      elif kind == "points":
+        change.append(self.units_of[id(question)])
+      else:
+        change.append(1 if (topic is not None or count_questions) else 0)
+    return tuple(change)
+
+  @staticmethod
+  def get_final(dims, table, offset) -> Dict[Tuple[int, ...], int]:
+    """The states (shifted by `offset`, from questions decided elsewhere) that are within every range."""
+    final = {}
+    for state, ways in table.items():
+      state = tuple(s + o for s, o in zip(state, offset))
+      if all(low <= s <= high for s, (*_, (low, high)) in zip(state, dims)):
+        final[state] = ways
+    return final
+
+  def combine(self, finals) -> List[Dict[Tuple[int, int], int]]:
+    """DP over (total points, total questions) across the units."""
+    max_points = self.to_units(self.constraints.total_points)[1]
+    combined = [{(0, 0) : 1}]
+    for final in finals:
+      collapsed = collections.defaultdict(int)
+      for state, ways in final.items():
+        collapsed[state[:2]] += ways
+      table = collections.defaultdict(int)
+      for (points, questions), ways in combined[-1].items():
+        for (unit_points, unit_questions), unit_ways in collapsed.items():
+          if points + unit_points > max_points or questions + unit_questions > self.constraints.num_questions.max:
+            continue
+          table[(points + unit_points, questions + unit_questions)] += ways * unit_ways
+      combined.append(dict(table))
+    return combined
+
+  def get_totals(self, combined, last_final) -> List[Tuple[Tuple[int, int], int]]:
+    """
+    Number of ways to finish each (points, questions) reached by the other units using the last (largest) unit.
+    Rather than another DP step, this sums the last unit's matching states using 2D prefix sums.
+    """
+    min_points, max_points = self.to_units(self.constraints.total_points)
+    min_questions, max_questions = self.constraints.num_questions.min, self.constraints.num_questions.max
+
+    collapsed = collections.defaultdict(int)
+    for state, ways in last_final.items():
+      collapsed[state[:2]] += ways
+    size_points = max(p for p, _ in collapsed) + 1
+    size_questions = max(q for _, q in collapsed) + 1
+    # prefix[p][q] is the number of ways with fewer than p points and fewer than q questions
+    prefix = [[0] * (size_questions + 1) for _ in range(size_points + 1)]
+    for p in range(size_points):
+      row_total = 0
+      for q in range(size_questions):
+        row_total += collapsed.get((p, q), 0)
+        prefix[p + 1][q + 1] = prefix[p][q + 1] + row_total
+
+    def count(low_points, high_points, low_questions, high_questions):
+      low_points, low_questions = max(low_points, 0), max(int(math.ceil(low_questions)), 0)
+      high_points, high_questions = min(high_points, size_points - 1), min(high_questions, size_questions - 1)
+      if low_points > high_points or low_questions > high_questions:
+        return 0
+      high_points, high_questions = int(high_points) + 1, int(high_questions) + 1
+      return (
+        prefix[high_points][high_questions] - prefix[low_points][high_questions]
+        - prefix[high_points][low_questions] + prefix[low_points][low_questions]
+      )
+
+    totals = []
+    for (points, questions), ways in combined[-1].items():
+      ways *= count(min_points - points, max_points - points, min_questions - questions, max_questions - questions)
+      if ways:
+        totals.append(((points, questions), ways))
+    return totals
+
+  def explain(self, units, ranges, finals) -> str:
+    for unit, final in zip(units, finals):
+      if len(final) == 0:
+        reasons = []
+        for topic in unit:
+          if topic not in ranges:
+            continue
+          in_topic = [q for q in self.questions if q.kind == topic]
+          (min_points, max_points), (min_questions, max_questions) = ranges[topic]
+          requirement = f"{topic.name.lower()} needs {Range(self.to_points(min_points), self.to_points(max_points))} points"
+          if topic in self.constraints.topic_questions:
+            requirement += f" from {Range(min_questions, max_questions)} questions"
+          reasons.append(
+            f"{requirement}, but has {len(in_topic)} questions worth "
+            f"{sorted(collections.Counter(q.points_value for q in in_topic).items())} (points, count)"
+          )
+        return "; ".join(reasons)
+
+    combined = self.combine(finals)
+    requirement = f"total points must be {self.constraints.total_points}"
+    if self.constraints.num_questions != Range():
+      requirement += f" with {self.constraints.num_questions} questions"
+    if len(combined[-1]) == 0:
+      return f"{requirement}, but the topic requirements alone need more"
+    achievable_points = sorted(set(self.to_points(p) for (p, q) in combined[-1].keys()))
+    below = [p for p in achievable_points if p < self.constraints.total_points.min]
+    above = [p for p in achievable_points if p > self.constraints.total_points.max]
+    if len(below) == 0 and len(above) == 0:
+      return f"{requirement}, but no total in range can be reached with that many questions"
+    if len(above) == 0:
+      return f"{requirement}, but at most {below[-1]:g} points can be reached"
+    if len(below) == 0:
+      return f"{requirement}, but at least {above[0]:g} points are needed"
+    return f"{requirement}, but the closest totals that can be reached are {below[-1]:g} and {above[0]:g}"
+
+  def compose(
+      self,
+      rng: random.Random|None = None,
+      weights: Dict[int, float]|None = None,
+      topic_points: Dict[Question.Topic, float]|None = None
+  ) -> List[Question]:
+    """
+    Returns a random selection of questions meeting the constraints, raising InfeasibleConstraints if there isn't one.
+    `weights` (keyed by id(question)) make some questions less likely, and `topic_points` pins the points for every topic.
+    """
+    if rng is None:
+      rng = random
+    if weights is None:
+      weights = collections.defaultdict(lambda: 1)
+    ranges = self.get_ranges(topic_points)
+    units = self.get_units(ranges)
+    unit_of = {topic : i for i, unit in enumerate(units) for topic in unit}
+
+    # "at most one of" clusters spanning units are decided up front: we try each of their options
+    cross_clusters = [
+      cluster_options for cluster_options in self.exclusive_clusters
+      if len(set(unit_of[q.kind] for option in cluster_options for q in option)) > 1
+    ]
+    skip = set(id(q) for cluster_options in cross_clusters for option in cluster_options for q in option)
+    solved_units = [self.build_unit(unit, ranges, weights, skip) for unit in units]
+
+    def solve(forced):
+      finals = []
+      for i, (dims, steps, tables) in enumerate(solved_units):
+        offset = [0] * len(dims)
+        for q in forced:
+          if unit_of[q.kind] == i:
+            offset = [o + c for o, c in zip(offset, self.get_change(dims, q))]
+        finals.append(self.get_final(dims, tables[-1], offset))
+      if any(len(final) == 0 for final in finals):
+        return finals, None, []
+      combined = self.combine(finals[:-1])
+      return finals, combined, self.get_totals(combined, finals[-1])
+
+    options = []
+    first_failure = None
+    for forced in itertools.product(*cross_clusters):
+      forced = [q for option in forced for q in option]
+      finals, combined, totals = solve(forced)
+      if len(totals) == 0:
+        if first_failure is None:
+          first_failure = finals
+        continue
+      ways = sum(w for _, w in totals)
+      for q in forced:
+        ways *= weights[id(q)]
+      if ways:
+        options.append((forced, ways))
+
+    if len(options) == 0:
+      reason = self.explain(units, ranges, first_failure)
+      if cross_clusters:
+        reason += " (whichever of the \"at most one of\" questions are used)"
+      raise InfeasibleConstraints(f"No valid selection of questions: {reason}")
+
+    # Walk back through the units, then through each unit's steps
+    forced = self.weighted_choice(options, rng)
+    finals, combined, totals = solve(forced)
+    picked = list(forced)
+    points, questions = self.weighted_choice(totals, rng)
+
+    min_points, max_points = self.to_units(self.constraints.total_points)
+    state = self.weighted_choice([
+      (state, ways) for state, ways in finals[-1].items()
+      if min_points <= points + state[0] <= max_points and (questions + state[1]) in self.constraints.num_questions
+    ], rng)
+    picked.extend(self.sample_steps(solved_units[-1], state, forced, unit_of, len(units) - 1, rng))
+
+    for i in reversed(range(len(solved_units) - 1)):
+      state = self.weighted_choice([
+        (state, ways * combined[i][(points - state[0], questions - state[1])])
+        for state, ways in finals[i].items()
+        if (points - state[0], questions - state[1]) in combined[i]
+      ], rng)
+      points, questions = points - state[0], questions - state[1]
+      picked.extend(self.sample_steps(solved_units[i], state, forced, unit_of, i, rng))
+    return picked
+
+  def sample_steps(self, solved_unit, state, forced, unit_of, unit_index, rng) -> List[Question]:
+    """Walks back through a unit's DP from its final `state`, picking the questions for each step."""
+    dims, steps, tables = solved_unit
+    for q in forced:
+      if unit_of[q.kind] == unit_index:
+        state = tuple(s - c for s, c in zip(state, self.get_change(dims, q)))
+
+    picked = []
+    for step in reversed(range(len(steps))):
+      step_options = []
+      for choice, multiplicity, change in steps[step]:
+        previous = tuple(s - c for s, c in zip(state, change))
+        if previous in tables[step] and multiplicity:
+          step_options.append(((choice, previous), multiplicity * tables[step][previous]))
+      (group, k), state = self.weighted_choice(step_options, rng)
+      picked.extend(rng.sample(list(group), k))
+    return picked
+
+  def compose_versions(self, num_versions: int, rng: random.Random|None = None) -> List[List[Question]]:
+    """
+    Composes several versions of an exam.  Each time a question is used it becomes `fairness` times as likely to be picked again,
+    and (with "same points per topic") every version gets the same points per topic as the first.
+    """
+    if rng is None:
+      rng = random
+    uses = collections.Counter()
+    versions = []
+    topic_points = None
+    for _ in range(num_versions):
+      weights = {id(q) : (self.constraints.fairness ** uses[id(q)] if uses[id(q)] else 1) for q in self.questions}
+      selection = self.compose(rng, weights, topic_points)
+      versions.append(selection)
+      uses.update(id(q) for q in selection)
+      if self.constraints.same_points_per_topic and topic_points is None:
+        topic_points = collections.defaultdict(float)
+        for q in selection:
+          topic_points[q.kind] += q.points_value
+    return versions
@@ -0,0 +1,166 @@
+#!env python
+from __future__ import annotations
+
+import collections
+import concurrent.futures
+import math
+import random
+from typing import Any, Collection, Dict, Iterator, List, NamedTuple, Tuple, TYPE_CHECKING
+
+from misc import OutputFormat
+from question import Question, QuestionRegistry
+from renderers import RendererRegistry, CachingRenderer, RenderCache
+
+if TYPE_CHECKING:
+  import canvasapi.course, canvasapi.quiz
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+GENERATION_CHUNK_SIZE = 8
+
+
+# Per-process state for workers, set up by init_worker
+_worker_renderer = None
+_worker_questions : Dict[str, Question] = {}
+
+
+def init_worker(renderer_options, render_cache_dir):
+  global _worker_renderer
+  _worker_renderer = CachingRenderer(RendererRegistry.create_from_options(renderer_options), RenderCache(cache_dir=render_cache_dir))
+
+
+class Variation(NamedTuple):
+  seed : int|None
+  fingerprint : str
+  rendered : Any            # a dict ready for canvas or a block of LaTeX, or None if it was a known duplicate
+
+
+def render_variation(
+    question: Question,
+    output_format: OutputFormat,
+    seed: int|None,
+    course: canvasapi.course.Course|None = None,
+    canvas_quiz: canvasapi.quiz.Quiz|None = None,
+    skip: Collection[str] = ()
+) -> Variation:
+  """A single variation of `question`, only rendered if its fingerprint isn't in `skip`."""
+  fingerprint = question.refresh(seed=seed)
+  if fingerprint in skip:
+    return Variation(seed, fingerprint, None)
+  if output_format == OutputFormat.CANVAS:
+    return Variation(seed, fingerprint, question.render__canvas(course, canvas_quiz))
+  return Variation(seed, fingerprint, question.render__latex())
+
+
+def generate_in_worker(registry_spec: Tuple[str, Dict], output_format: OutputFormat, seeds: List[int], skip: Collection[str]) -> List[Variation]:
+  # Rebuilding a question can be expensive, so keep them around for later work on the same question
+  key = repr(registry_spec)
+  if key not in _worker_questions:
+    question_type, kwargs = registry_spec
+    _worker_questions[key] = QuestionRegistry.create(question_type, **kwargs)
+    _worker_questions[key].renderer = _worker_renderer
+  question = _worker_questions[key]
+  return [render_variation(question, output_format, seed, skip=skip) for seed in seeds]
+
+
+class GenerationScheduler:
+  """
+  Farms variation generation (instantiate, the is_interesting loop and rendering) out to a pool of processes.
+  Work goes out as (question, seeds) units and results come back in seed order, so the output is the same no
+  matter how many jobs there are.  Deduplication is left to the caller, which sees every variation in order.
+  Questions the workers can't rebuild (not made through the registry, or needing canvas to generate) are
+  generated in this process instead.
+  """
+  def __init__(self, jobs: int, renderer_options=None, render_cache_dir: str|None = None, chunk_size: int = GENERATION_CHUNK_SIZE):
+    self.jobs = jobs
+    self.chunk_size = chunk_size
+    self.executor = None
+    if jobs > 1:
+      self.executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=init_worker,
+        initargs=(renderer_options, render_cache_dir)
+      )
+    # Used to seed questions without an exam seed, since the workers need a seed for everything they generate
+    self.fallback_seed = random.getrandbits(64)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+
+  def close(self):
+    if self.executor is not None:
+      self.executor.shutdown(cancel_futures=True)
+      self.executor = None
+
+  def can_farm_out(self, question: Question, output_format: OutputFormat) -> bool:
+    if self.executor is None or question.registry_spec is None:
+      return False
+    return not (output_format == OutputFormat.CANVAS and question.NEEDS_CANVAS_TO_GENERATE)
+
+  def take_seeds(self, question: Question, count: int) -> List[int]:
+    if question.exam_seed is None:
+      question.exam_seed = (self.fallback_seed, id(question))
+    return [question.next_seed() for _ in range(count)]
+
+  def generate_variations(
+      self,
+      question: Question,
+      output_format: OutputFormat,
+      course: canvasapi.course.Course|None = None,
+      canvas_quiz: canvasapi.quiz.Quiz|None = None,
+      expected_count: int|None = None,
+      skip: Collection[str] = ()
+  ) -> Iterator[Variation]:
+    """
+    Yields variations of `question` in seed order, for as long as the caller keeps asking.
+    Workers run ahead of the caller, and `expected_count` (how many the caller will probably take) sizes their work.
+    Variations whose fingerprints are in `skip` aren't rendered.  The caller can keep adding to it as it goes,
+    although workers only see what was in it when their work was handed out.
+    """
+    if not self.can_farm_out(question, output_format):
+      while True:
+        yield render_variation(question, output_format, question.next_seed(), course, canvas_quiz, skip)
+
+    chunk_size = self.chunk_size
+    if expected_count is not None:
+      chunk_size = max(1, min(chunk_size, math.ceil(expected_count / self.jobs)))
+
+    start_index = question.variation_index
+    num_yielded = 0
+    pending : collections.deque[concurrent.futures.Future] = collections.deque()
+    try:
+      while True:
+        while len(pending) < 2 * self.jobs:
+          pending.append(self.executor.submit(
+            generate_in_worker,
+            question.registry_spec,
+            output_format,
+            self.take_seeds(question, chunk_size),
+            frozenset(skip)
+          ))
+        for variation in pending.popleft().result():
+          num_yielded += 1
+          yield variation
+    finally:
+      for future in pending:
+        future.cancel()
+      # Only count what the caller actually took, so later variations don't depend on how far ahead we ran
+      question.variation_index = start_index + num_yielded
+
+  def generate_each(self, questions: List[Question], output_format: OutputFormat) -> List[Variation]:
+    """The next variation of each question, in the same order as `questions`."""
+    futures = {}
+    for i, question in enumerate(questions):
+      if self.can_farm_out(question, output_format):
+        futures[i] = self.executor.submit(generate_in_worker, question.registry_spec, output_format, self.take_seeds(question, 1), ())
+    return [
+      (futures[i].result()[0] if i in futures else render_variation(question, output_format, question.next_seed()))
+      for i, question in enumerate(questions)
+    ]
@@ -0,0 +1,363 @@
+#!env python
+from __future__ import annotations
+
+import concurrent.futures
+import dataclasses
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+LATEX_JOBS = os.cpu_count() or 1
+LATEX_TIMEOUT = 30
+LATEX_FORMAT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "exam_randomization", "latex-formats")
+
+# Each engine is the list of commands to run, in order, on "{tex}"
+LATEX_ENGINES = {
+  "latexmk" : [
+    ["latexmk", "-pdf", "-interaction=nonstopmode", "-halt-on-error", "{tex}"],
+  ],
+  # pdflatex doesn't know when it needs a second pass, so always do one
+  "pdflatex" : [
+    ["pdflatex", "-interaction=nonstopmode", "-halt-on-error", "{tex}"],
+    ["pdflatex", "-interaction=nonstopmode", "-halt-on-error", "{tex}"],
+  ],
+}
+
+# What to add (after the program name) to each engine's commands to have pdflatex start from a precompiled format
+LATEX_FORMAT_ARGS = {
+  "latexmk" : ["-pdflatex=pdflatex -fmt={fmt} %O %S"],
+  "pdflatex" : ["-fmt={fmt}"],
+}
+
+# mylatexformat stops dumping the preamble here (or at \begin{document}), and whatever follows runs on every compile
+END_OF_DUMP = r"\csname endofdump\endcsname"
+
+# Written to the log at the start of each document in a combined document, followed by its name and first page
+COMBINED_MARKER = "combined-document"
+
+
+@dataclasses.dataclass
+class CompileResult:
+  name : str
+  pdf_path : str|None = None
+  log_path : str|None = None
+  elapsed : float = 0         # seconds, across every attempt
+  attempts : int = 0
+  timed_out : bool = False
+  returncode : int|None = None
+  used_format : bool = False  # whether it was compiled against a precompiled preamble
+  cached : bool = False       # whether it came from the build cache rather than being compiled
+
+  @property
+  def ok(self) -> bool:
+    return self.pdf_path is not None
+
+
+class LatexBuildFarm:
+  """
+  Compiles LaTeX documents several at a time.
+  Each document is built in its own temporary directory so that concurrent builds can't trample each other's
+  auxiliary files, and only the pdf and log are copied to `output_dir` (along with the source, if it failed).
+  A build that times out is retried (once by default), since that is usually a loaded machine rather than bad LaTeX.
+  
+  With `precompile_preamble`, the preamble of each document (which is mostly loading packages, and the same for every
+  version of an exam) is dumped once into a format file with mylatexformat, cached in `format_dir` by a hash of the
+  preamble, and documents are compiled starting from it.
+  
+  With a `cache` (a build_cache.BuildCache), documents whose source hasn't changed since they were last compiled
+  are copied from it instead.
+  """
+  def __init__(
+      self,
+      jobs: int = LATEX_JOBS,
+      output_dir: str = "out",
+      timeout: float = LATEX_TIMEOUT,
+      retries: int = 1,
+      engine: str = "latexmk",
+      source_dir: str|None = None,
+      precompile_preamble: bool = False,
+      format_dir: str = LATEX_FORMAT_DIR,
+      cache=None
+  ):
+    self.output_dir = os.path.abspath(output_dir)
+    # Documents may refer to files (e.g. images) relative to where we were run from, so let latex look there too
+    self.env = dict(os.environ)
+    self.env["TEXINPUTS"] = os.pathsep.join([os.path.abspath(source_dir or os.getcwd()), self.env.get("TEXINPUTS", "")])
+    # Don't wrap log lines, so that we can read things back out of them
+    self.env.setdefault("max_print_line", "10000")
+    self.timeout = timeout
+    self.retries = retries
+    self.engine = engine
+    self.commands = LATEX_ENGINES[engine]
+    self.format_args = LATEX_FORMAT_ARGS[engine]
+    self.precompile_preamble = precompile_preamble
+    self.format_dir = os.path.abspath(format_dir)
+    # Format name for each preamble hash, or None if we couldn't build one
+    self.formats : Dict[str, str|None] = {}
+    self.format_lock = threading.Lock()
+    self.tex_version : str|None = None
+    self.cache = cache
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="latex")
+    self.futures : List[concurrent.futures.Future] = []
+    self.start_time = time.perf_counter()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+
+  def close(self):
+    self.executor.shutdown(wait=True)
+
+  @staticmethod
+  def get_safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") or "exam"
+
+  def submit(self, name: str, tex_source: str) -> concurrent.futures.Future[CompileResult]:
+    """Queues `tex_source` to be compiled into `name`.pdf in the output directory."""
+    future = self.executor.submit(self.compile, self.get_safe_name(name), tex_source)
+    self.futures.append(future)
+    return future
+
+  def wait(self) -> List[CompileResult]:
+    """Waits for everything submitted so far, returning the results in the order they were submitted."""
+    results = [future.result() for future in self.futures]
+    self.futures = []
+    return results
+
+  def compile(self, name: str, tex_source: str) -> CompileResult:
+    result = CompileResult(name)
+    os.makedirs(self.output_dir, exist_ok=True)
+    if self.cache is not None:
+      pdf_path = os.path.join(self.output_dir, f"{name}.pdf")
+      log_path = os.path.join(self.output_dir, f"{name}.log")
+      if self.cache.get_pdf(name, tex_source, self.engine, pdf_path, log_path):
+        result.pdf_path, result.log_path, result.cached = pdf_path, log_path, True
+        return result
+    with tempfile.TemporaryDirectory(prefix="latex-") as build_dir:
+      tex_path = os.path.join(build_dir, f"{name}.tex")
+      with open(tex_path, "w") as fid:
+        fid.write(tex_source)
+
+      format_name = self.get_format(tex_source) if self.precompile_preamble else None
+      if format_name is not None:
+        os.symlink(os.path.join(self.format_dir, f"{format_name}.fmt"), os.path.join(build_dir, f"{format_name}.fmt"))
+      
+      output = ""
+      while result.attempts <= self.retries:
+        result.attempts += 1
+        attempt_start = time.perf_counter()
+        result.timed_out, result.returncode, output = self.run_commands(tex_path, build_dir, format_name)
+        result.elapsed += time.perf_counter() - attempt_start
+        if format_name is not None and not result.timed_out and result.returncode != 0:
+          # Most likely the format, e.g. it was made by a different TeX install, so try again the slow way
+          log.warning(f"Compiling {name} against its precompiled preamble failed, compiling it from scratch")
+          format_name = None
+          result.attempts -= 1
+          continue
+        if not result.timed_out:
+          break
+        log.warning(f"Compiling {name} timed out after {self.timeout}s (attempt {result.attempts})")
+      result.used_format = format_name is not None
+
+      # Prefer latex's own log, but fall back to whatever the commands printed
+      result.log_path = os.path.join(self.output_dir, f"{name}.log")
+      if os.path.exists(os.path.join(build_dir, f"{name}.log")):
+        shutil.copy(os.path.join(build_dir, f"{name}.log"), result.log_path)
+      else:
+        with open(result.log_path, "w") as fid:
+          fid.write(output)
+
+      pdf_path = os.path.join(build_dir, f"{name}.pdf")
+      if not result.timed_out and result.returncode == 0 and os.path.exists(pdf_path):
+        result.pdf_path = os.path.join(self.output_dir, f"{name}.pdf")
+        shutil.copy(pdf_path, result.pdf_path)
+        if self.cache is not None:
+          self.cache.put_pdf(tex_source, self.engine, result.pdf_path, result.log_path)
+      else:
+        shutil.copy(tex_path, os.path.join(self.output_dir, f"{name}.tex"))
+        log.error(f"Failed to compile {name}, see {result.log_path}")
+    return result
+
+  def run_commands(self, tex_path: str, build_dir: str, format_name: str|None = None) -> tuple[bool, int|None, str]:
+    """Runs the engine's commands in `build_dir`, returning (timed out, return code, output)."""
+    deadline = time.perf_counter() + self.timeout
+    output = []
+    for command in self.commands:
+      if format_name is not None:
+        command = command[:1] + self.format_args + command[1:]
+      try:
+        proc = subprocess.run(
+          [part.format(tex=os.path.basename(tex_path), fmt=format_name) for part in command],
+          cwd=build_dir,
+          env=self.env,
+          stdin=subprocess.DEVNULL,
+          stdout=subprocess.PIPE,
+          stderr=subprocess.STDOUT,
+          timeout=max(0, deadline - time.perf_counter())
+        )
+      except subprocess.TimeoutExpired as e:
+        output.append((e.stdout or b"").decode(errors="replace"))
+        return True, None, ''.join(output)
+      output.append(proc.stdout.decode(errors="replace"))
+      if proc.returncode != 0:
+        return False, proc.returncode, ''.join(output)
+    return False, 0, ''.join(output)
+
+  @staticmethod
+  def get_preamble(tex_source: str) -> str|None:
+    """The part of a document that mylatexformat would dump into a format."""
+    end = tex_source.find(END_OF_DUMP)
+    if end == -1:
+      end = tex_source.find(r"\begin{document}")
+    return None if end == -1 else tex_source[:end]
+
+  def get_tex_version(self) -> str|None:
+    if self.tex_version is None:
+      try:
+        proc = subprocess.run(["pdftex", "--version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=self.timeout)
+        self.tex_version = proc.stdout.decode(errors="replace").splitlines()[0]
+      except (OSError, subprocess.TimeoutExpired, IndexError) as e:
+        log.warning(f"Couldn't find pdftex to precompile preambles with ({e})")
+        self.tex_version = ""
+    return self.tex_version or None
+
+  def get_format(self, tex_source: str) -> str|None:
+    """Name of the precompiled format for the document's preamble, building it if we don't have it yet."""
+    preamble = self.get_preamble(tex_source)
+    tex_version = self.get_tex_version()
+    if preamble is None or tex_version is None:
+      return None
+    format_name = "preamble-" + hashlib.sha256(f"{tex_version}\0{preamble}".encode("utf-8")).hexdigest()[:16]
+    # Only the first document with a new preamble builds it, and the rest wait for it
+    with self.format_lock:
+      if format_name not in self.formats:
+        if os.path.exists(os.path.join(self.format_dir, f"{format_name}.fmt")) or self.build_format(format_name, preamble):
+          self.formats[format_name] = format_name
+        else:
+          self.formats[format_name] = None
+    return self.formats[format_name]
+
+  def build_format(self, format_name: str, preamble: str) -> bool:
+    start_time = time.perf_counter()
+    os.makedirs(self.format_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="latex-format-") as build_dir:
+      with open(os.path.join(build_dir, f"{format_name}.tex"), "w") as fid:
+        fid.write(preamble + "\n\\begin{document}\n\\end{document}\n")
+      try:
+        proc = subprocess.run(
+          [
+            "pdftex", "-ini", "-interaction=nonstopmode", "-halt-on-error", f"-jobname={format_name}",
+            "&pdflatex", "mylatexformat.ltx", f"{format_name}.tex"
+          ],
+          cwd=build_dir,
+          env=self.env,
+          stdin=subprocess.DEVNULL,
+          stdout=subprocess.PIPE,
+          stderr=subprocess.STDOUT,
+          timeout=self.timeout
+        )
+      except subprocess.TimeoutExpired:
+        log.warning(f"Precompiling preamble {format_name} timed out, compiling without it")
+        return False
+      if proc.returncode != 0 or not os.path.exists(os.path.join(build_dir, f"{format_name}.fmt")):
+        log.warning(f"Couldn't precompile preamble {format_name} (is mylatexformat installed?), compiling without it")
+        log.debug(proc.stdout.decode(errors="replace")[-2000:])
+        return False
+      # Other runs may be reading formats from here, so only ever put finished ones in place
+      shutil.copy(os.path.join(build_dir, f"{format_name}.fmt"), os.path.join(self.format_dir, f"{format_name}.fmt.tmp"))
+      os.replace(os.path.join(self.format_dir, f"{format_name}.fmt.tmp"), os.path.join(self.format_dir, f"{format_name}.fmt"))
+    log.info(f"Precompiled preamble {format_name} in {time.perf_counter() - start_time:0.1f}s")
+    return True
+
+  def describe(self, results: List[CompileResult]):
+    for result in results:
+      log.info(
+        f"{result.name}: {'ok' if result.ok else 'FAILED'} in {result.elapsed:0.1f}s"
+        + (" from the build cache" if result.cached else "")
+        + (f" ({result.attempts} attempts)" if result.attempts > 1 else "")
+        + (" from a precompiled preamble" if result.used_format else "")
+      )
+    if len(results) > 0:
+      wall_time = time.perf_counter() - self.start_time
+      compile_time = sum(result.elapsed for result in results)
+      log.info(
+        f"Compiled {sum(result.ok for result in results)} / {len(results)} documents in {wall_time:0.1f}s "
+        f"({compile_time:0.1f}s of compiling, {compile_time / len(results):0.1f}s per document)"
+      )
+
+
+def combine_documents(documents: List[Tuple[str, str]], reset: str = "") -> str:
+  """
+  Puts documents that share a preamble into a single document, so they can be compiled in one go instead of
+  loading the same packages and fonts for each of them.  Each starts on a fresh page, numbered from 1, with its
+  name in the header, and `reset` (e.g. zeroing counters the documents use) is run before each.
+  Once compiled, split_document gets the separate pdfs back.
+  """
+  preamble = None
+  lines = []
+  for name, tex_source in documents:
+    begin = tex_source.find(r"\begin{document}")
+    end = tex_source.rfind(r"\end{document}")
+    if begin == -1 or end == -1:
+      raise ValueError(f"{name} isn't a complete LaTeX document")
+    if preamble is None:
+      preamble = tex_source[:begin]
+    elif tex_source[:begin] != preamble:
+      raise ValueError(f"{name} has a different preamble from {documents[0][0]}, so they can't be combined")
+    lines.extend([
+      r"\clearpage",
+      r"\def\documentname{\detokenize{" + name + "}}",
+      r"\setcounter{page}{1}",
+      reset,
+      # Everything before this has been shipped out by the \clearpage, so this is the page it starts on
+      r"\typeout{" + COMBINED_MARKER + ":" + name + r":\the\ReadonlyShipoutCounter}",
+      tex_source[begin + len(r"\begin{document}"):end],
+    ])
+  if preamble is None:
+    raise ValueError("There are no documents to combine")
+  return "\n".join([
+    preamble + r"\begin{document}",
+    r"\makeatletter",
+    r"\def\@oddhead{\hfil\footnotesize\ttfamily\documentname}",
+    r"\let\@evenhead\@oddhead",
+    r"\makeatother",
+    *lines,
+    r"\end{document}",
+  ])
+
+
+def split_document(result: CompileResult) -> Dict[str, str]:
+  """Splits the pdf of a document from combine_documents into a pdf per document, next to it, returning their paths by name."""
+  with open(result.log_path, errors="replace") as fid:
+    first_pages = {
+      match.group(1): int(match.group(2))
+      for match in re.finditer(rf"^{COMBINED_MARKER}:(.*):(\d+)$", fid.read(), flags=re.MULTILINE)
+    }
+  # Only splitting needs pypdf, so don't make every build import it
+  import pypdf
+  
+  reader = pypdf.PdfReader(result.pdf_path)
+  ends = list(first_pages.values())[1:] + [len(reader.pages)]
+  paths = {}
+  for (name, start), end in zip(first_pages.items(), ends):
+    writer = pypdf.PdfWriter()
+    for page in reader.pages[start:end]:
+      writer.add_page(page)
+    paths[name] = os.path.join(os.path.dirname(result.pdf_path), f"{name}.pdf")
+    writer.write(paths[name])
+  log.info(f"Split {result.name} into {len(paths)} documents")
+  return paths
@@ -2,18 +2,14 @@
 from __future__ import annotations
 
 import datetime
+import functools
 import inspect
 import pprint
-import random
 import re
 import typing
 
-import canvasapi.course
-import canvasapi.quiz
-
 import yaml
 from typing import List, Dict, Any, Tuple
-import jinja2
 
 import logging
 
@@ -21,6 +17,9 @@ from misc import OutputFormat
 from question import Question, QuestionRegistry, Answer, TableGenerator
 from .exam_generation_functions import QuickFunctions
 
+if typing.TYPE_CHECKING:
+  import canvasapi.course, canvasapi.quiz
+
 logging.basicConfig()
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
@@ -34,6 +33,7 @@ class Question_legacy(Question):
     self.text = text
     
     if self._jinja_env is None:
+      import jinja2
       self._jinja_env = jinja2.Environment(
         loader=jinja2.FileSystemLoader("templates"),
         block_start_string='<BLOCK>',
@@ -47,24 +47,36 @@ class Question_legacy(Question):
       for func in functions:
         self._jinja_env.globals[func.__name__] = getattr(QuickFunctions, func.__name__)
   
-  def get_body_lines(self, output_format: OutputFormat, *args, **kwargs) -> List[str]:
+  def get_template_functions(self) -> Dict[str, Any]:
+    # The same helpers as the environment globals, but drawing from this question's rng
+    return {
+      name : (functools.partial(method, rng=self.rng) if "rng" in inspect.signature(method).parameters else method)
+      for name, method in inspect.getmembers(QuickFunctions, lambda m: inspect.ismethod(m))
+    }
+  
+  def instantiate(self, *args, **kwargs):
+    super().instantiate(*args, **kwargs)
+    # The template draws its random values as it renders, so render it here to pin down the variation
+    self.rendered_text = self._jinja_env.from_string(self.text).render(**self.get_template_functions())
+  
+  def get_body_lines(self, output_format: OutputFormat|None = None, *args, **kwargs) -> List[str]:
     lines = []
     if output_format == OutputFormat.LATEX:
       lines.extend([
-        self._jinja_env.from_string(self.text.replace("[answer]", "\\answerblank{3}")).render() #.replace('[', '{[').replace(']', ']}')
+        self.rendered_text.replace("[answer]", "\\answerblank{3}")
       ])
       if self.extra_attrs.get("clear_page", False):
         lines.append(r"\vspace{10cm}")
-    elif output_format == OutputFormat.CANVAS:
+    else:
       lines.extend([
-        self._jinja_env.from_string(self.text).render().replace(r"\answerblank{3}", "[answer]"),
+        self.rendered_text.replace(r"\answerblank{3}", "[answer]"),
       ])
     
     return lines
   
-  def get__canvas(self, course: canvasapi.course.Course, quiz : canvasapi.quiz.Quiz, *args, **kwargs):
+  def render__canvas(self, course: canvasapi.course.Course, quiz : canvasapi.quiz.Quiz, *args, **kwargs):
     
-    question_text, explanation_text, answers = self.generate(OutputFormat.CANVAS, *args, **kwargs)
+    question_text, explanation_text, answers = self.render(OutputFormat.CANVAS, *args, **kwargs)
     def replace_answers(input_str):
       counter = 1
       replacements = []
@@ -79,7 +91,7 @@ class Question_legacy(Question):
     answers = [
       {
         "blank_id" : a,
-        "answer_text" : str(random.random()) # make it so there is always an answer
+        "answer_text" : str(self.rng.random()) # make it so there is always an answer
       }
       for a in occurances
     ]
@@ -192,6 +204,9 @@ class FromText(Question):
     self.answers = []
     self.possible_variations = 1
   
+  def get_parameter_key(self):
+    return (self.text,)
+  
   def get_body_lines(self, *args, **kwargs) -> List[str|TableGenerator]:
     return [self.text]
   
@@ -209,11 +224,13 @@ class FromGenerator(FromText):
     def attach_function_to_object(obj, function_code, function_name='get_body_lines'):
       log.debug(f"\ndef {function_name}(self):\n" + "\n".join(f"    {line}" for line in function_code.splitlines()))
       
-      # Define the function dynamically using exec
-      exec(f"def {function_name}(self):\n" + "\n".join(f"    {line}" for line in function_code.splitlines()), globals(), locals())
+      # Define the function dynamically using exec.
+      # Generators use `random`, which we point at this question's rng so that they are reproducible too
+      namespace = {**globals(), "random": obj.rng}
+      exec(f"def {function_name}(self):\n" + "\n".join(f"    {line}" for line in function_code.splitlines()), namespace)
       
       # Get the function and bind it to the object
-      function = locals()[function_name]
+      function = namespace[function_name]
       setattr(obj, function_name, function.__get__(obj))
     
     self.generator_text = generator
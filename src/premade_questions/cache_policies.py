@@ -0,0 +1,420 @@
+#!env python
+from __future__ import annotations
+
+import abc
+import collections
+import dataclasses
+import functools
+import heapq
+import math
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+class Trace:
+  """
+  A request trace, along with preprocessing that several policies can share.
+  Pass the same Trace to every policy run over it so the work is only done once.
+  """
+  def __init__(self, requests: Sequence[Hashable]):
+    self.requests = list(requests)
+
+  @functools.cached_property
+  def next_use(self) -> List[float]:
+    """next_use[i] is the position of the next request for the same thing as request i (or inf if there isn't one)"""
+    next_use = [math.inf] * len(self.requests)
+    upcoming : Dict[Hashable, int] = {}
+    for i in reversed(range(len(self.requests))):
+      next_use[i] = upcoming.get(self.requests[i], math.inf)
+      upcoming[self.requests[i]] = i
+    return next_use
+
+  def __len__(self):
+    return len(self.requests)
+
+  def __getitem__(self, i):
+    return self.requests[i]
+
+  def __iter__(self):
+    return iter(self.requests)
+
+
+class CachePolicyRegistry:
+  _registry = {}
+
+  @classmethod
+  def register(cls, policy_name=None):
+    def decorator(subclass):
+      name = policy_name.lower() if policy_name else subclass.NAME.lower()
+      cls._registry[name] = subclass
+      return subclass
+    return decorator
+
+  @classmethod
+  def create(cls, policy_name, cache_size: int, all_requests: Sequence[Hashable]|None = None) -> CachePolicy:
+    if policy_name.lower() not in cls._registry:
+      raise ValueError(f"Unknown cache policy: {policy_name}")
+    return cls._registry[policy_name.lower()](cache_size, all_requests)
+
+  @classmethod
+  def names(cls) -> List[str]:
+    return [policy.NAME for policy in cls._registry.values()]
+
+
+class CachePolicy(abc.ABC):
+  """
+  A cache of a fixed number of entries that decides what to evict on a miss.
+  Every access is O(1) (or O(log cache_size) for Belady), so traces of 10^5+ requests are fine.
+  """
+  NAME = None
+
+  def __init__(self, cache_size: int, all_requests: Sequence[Hashable]|None = None):
+    if cache_size < 1:
+      raise ValueError(f"Cache size must be at least 1 (got {cache_size})")
+    self.cache_size = cache_size
+    self.all_requests = all_requests
+    self.position = 0   # how many requests we have seen
+
+  def access(self, request) -> Tuple[bool, Hashable|None]:
+    """Looks up `request`, bringing it into the cache on a miss. Returns (was_hit, evicted)."""
+    was_hit = self.lookup(request)
+    evicted = None
+    if not was_hit:
+      if len(self) >= self.cache_size:
+        evicted = self.evict()
+      self.insert(request)
+    self.position += 1
+    return was_hit, evicted
+
+  @abc.abstractmethod
+  def lookup(self, request) -> bool:
+    """Returns whether `request` is cached, updating whatever bookkeeping a hit needs."""
+    pass
+
+  @abc.abstractmethod
+  def evict(self) -> Hashable:
+    pass
+
+  @abc.abstractmethod
+  def insert(self, request):
+    pass
+
+  @abc.abstractmethod
+  def contents(self) -> List[Hashable]:
+    """The cached entries, in the order they would next be evicted."""
+    pass
+
+  @abc.abstractmethod
+  def __len__(self):
+    pass
+
+  def __contains__(self, request):
+    return request in self.contents()
+
+  def simulate(self, requests: Sequence[Hashable]) -> int:
+    """Runs every request through the cache and returns the number of hits."""
+    return sum(self.access(request)[0] for request in requests)
+
+
+@CachePolicyRegistry.register()
+class FIFO(CachePolicy):
+  NAME = "FIFO"
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.entries : collections.OrderedDict = collections.OrderedDict()
+
+  def lookup(self, request) -> bool:
+    return request in self.entries
+
+  def evict(self) -> Hashable:
+    return self.entries.popitem(last=False)[0]
+
+  def insert(self, request):
+    self.entries[request] = None
+
+  def contents(self) -> List[Hashable]:
+    return list(self.entries)
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, request):
+    return request in self.entries
+
+
+@CachePolicyRegistry.register()
+class LRU(FIFO):
+  NAME = "LRU"
+
+  def lookup(self, request) -> bool:
+    if request in self.entries:
+      self.entries.move_to_end(request)
+      return True
+    return False
+
+
+@CachePolicyRegistry.register()
+class Belady(CachePolicy):
+  """
+  Evicts whatever will be used furthest in the future, which means it needs the whole request trace up front.
+  We precompute where each request is next used, and keep a heap keyed on that so eviction is O(log cache_size).
+  Entries that are never used again are evicted smallest first.
+  """
+  NAME = "Belady"
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    if self.all_requests is None:
+      raise ValueError("Belady needs the full list of requests ahead of time")
+    if not isinstance(self.all_requests, Trace):
+      self.all_requests = Trace(self.all_requests)
+    self.next_use = self.all_requests.next_use
+
+    self.entries : Dict[Hashable, float] = {}   # entry -> position it will next be used
+    self.heap : List[Tuple[float, Hashable]] = []  # (-next use, entry), including stale entries we skip lazily
+
+  def update_next_use(self, request):
+    if self.position >= len(self.all_requests) or self.all_requests[self.position] != request:
+      raise ValueError(f"Request {request} does not match the trace at position {self.position}")
+    self.entries[request] = self.next_use[self.position]
+    heapq.heappush(self.heap, (-self.entries[request], request))
+
+    # Hits leave stale entries behind, so rebuild every so often to keep the heap small
+    if len(self.heap) > 4 * self.cache_size + 64:
+      self.heap = [(-next_use, entry) for (entry, next_use) in self.entries.items()]
+      heapq.heapify(self.heap)
+
+  def lookup(self, request) -> bool:
+    if request in self.entries:
+      self.update_next_use(request)
+      return True
+    return False
+
+  def evict(self) -> Hashable:
+    while True:
+      negative_next_use, entry = heapq.heappop(self.heap)
+      if self.entries.get(entry) == -negative_next_use:
+        del self.entries[entry]
+        return entry
+
+  def insert(self, request):
+    self.update_next_use(request)
+
+  def contents(self) -> List[Hashable]:
+    return sorted(self.entries, key=(lambda e: (-self.entries[e], e)))
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, request):
+    return request in self.entries
+
+
+@CachePolicyRegistry.register()
+class LFU(CachePolicy):
+  """
+  Evicts the least frequently used entry, breaking ties by least recently used.
+  Frequencies only count accesses since the entry was last brought into the cache.
+  """
+  NAME = "LFU"
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.frequency : Dict[Hashable, int] = {}
+    # For each frequency, the entries with that frequency in least-recently-used order
+    self.buckets : Dict[int, collections.OrderedDict] = collections.defaultdict(collections.OrderedDict)
+    self.min_frequency = 0
+
+  def lookup(self, request) -> bool:
+    if request not in self.frequency:
+      return False
+    frequency = self.frequency[request]
+    del self.buckets[frequency][request]
+    if not self.buckets[frequency]:
+      del self.buckets[frequency]
+      if self.min_frequency == frequency:
+        self.min_frequency = frequency + 1
+    self.frequency[request] = frequency + 1
+    self.buckets[frequency + 1][request] = None
+    return True
+
+  def evict(self) -> Hashable:
+    entry, _ = self.buckets[self.min_frequency].popitem(last=False)
+    if not self.buckets[self.min_frequency]:
+      del self.buckets[self.min_frequency]
+    del self.frequency[entry]
+    return entry
+
+  def insert(self, request):
+    self.frequency[request] = 1
+    self.buckets[1][request] = None
+    self.min_frequency = 1
+
+  def contents(self) -> List[Hashable]:
+    return [entry for frequency in sorted(self.buckets) for entry in self.buckets[frequency]]
+
+  def __len__(self):
+    return len(self.frequency)
+
+  def __contains__(self, request):
+    return request in self.frequency
+
+
+@CachePolicyRegistry.register()
+class Clock(CachePolicy):
+  """
+  Second-chance approximation of LRU.
+  Every access sets an entry's use bit, and on a miss the hand sweeps around clearing use bits until it finds an
+  entry whose bit is already clear, which gets evicted.
+  """
+  NAME = "Clock"
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.frames : List[Hashable] = []
+    self.use_bits : List[bool] = []
+    self.slots : Dict[Hashable, int] = {}
+    self.hand = 0
+
+  def lookup(self, request) -> bool:
+    if request in self.slots:
+      self.use_bits[self.slots[request]] = True
+      return True
+    return False
+
+  def evict(self) -> Hashable:
+    while self.use_bits[self.hand]:
+      self.use_bits[self.hand] = False
+      self.hand = (self.hand + 1) % len(self.frames)
+    entry = self.frames[self.hand]
+    del self.slots[entry]
+    return entry
+
+  def insert(self, request):
+    if len(self.frames) < self.cache_size:
+      self.slots[request] = len(self.frames)
+      self.frames.append(request)
+      self.use_bits.append(True)
+      return
+    # Take over the frame the hand stopped on during eviction
+    self.frames[self.hand] = request
+    self.use_bits[self.hand] = True
+    self.slots[request] = self.hand
+    self.hand = (self.hand + 1) % len(self.frames)
+
+  def contents(self) -> List[Hashable]:
+    # In the order the hand will reach them
+    return self.frames[self.hand:] + self.frames[:self.hand]
+
+  def __len__(self):
+    return len(self.slots)
+
+  def __contains__(self, request):
+    return request in self.slots
+
+
+@CachePolicyRegistry.register()
+class TwoQ(CachePolicy):
+  """
+  The simplified 2Q policy (Johnson & Shasha).
+  New entries go into a small FIFO queue, and only entries that are requested again after falling out of it
+  (which we remember in a "ghost" queue of recent evictions) are promoted to the main LRU queue.
+  This keeps one-off scans from flushing out the entries that are actually being reused.
+  """
+  NAME = "TwoQ"
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.probation_size = max(1, self.cache_size // 4)
+    self.ghost_size = max(1, self.cache_size // 2)
+    self.probation : collections.OrderedDict = collections.OrderedDict()  # FIFO of entries seen once
+    self.ghosts : collections.OrderedDict = collections.OrderedDict()     # recently evicted from probation, not cached
+    self.main : collections.OrderedDict = collections.OrderedDict()       # LRU of entries seen more than once
+    self.returning = False    # whether the request being inserted was a ghost
+
+  def lookup(self, request) -> bool:
+    if request in self.main:
+      self.main.move_to_end(request)
+      return True
+    if request in self.probation:
+      return True
+    # Check the ghosts now, since making room for this request might push it out of them
+    self.returning = self.ghosts.pop(request, False) is None
+    return False
+
+  def evict(self) -> Hashable:
+    if len(self.probation) > self.probation_size or not self.main:
+      entry, _ = self.probation.popitem(last=False)
+      self.ghosts[entry] = None
+      if len(self.ghosts) > self.ghost_size:
+        self.ghosts.popitem(last=False)
+      return entry
+    return self.main.popitem(last=False)[0]
+
+  def insert(self, request):
+    if self.returning:
+      self.main[request] = None
+    else:
+      self.probation[request] = None
+
+  def contents(self) -> List[Hashable]:
+    return list(self.probation) + list(self.main)
+
+  def __len__(self):
+    return len(self.probation) + len(self.main)
+
+  def __contains__(self, request):
+    return request in self.main or request in self.probation
+
+
+@dataclasses.dataclass
+class PolicyRun:
+  hits : List[bool] = dataclasses.field(default_factory=list)
+  evictions : List[Hashable|None] = dataclasses.field(default_factory=list)
+  contents : List[List[Hashable]]|None = None   # cache contents after each request, if asked for
+
+  @property
+  def num_hits(self) -> int:
+    return sum(self.hits)
+
+
+def compare_policies(
+    policy_names: Sequence[str],
+    cache_size: int,
+    requests: Sequence[Hashable],
+    record_contents: Sequence[str] = ()
+) -> Dict[str, PolicyRun]:
+  """
+  Runs the same trace through several policies in a single pass, sharing the trace preprocessing between them.
+  Cache contents after every request are only kept for the policies in `record_contents`.
+  """
+  trace = requests if isinstance(requests, Trace) else Trace(requests)
+  policies = {name : CachePolicyRegistry.create(name, cache_size, trace) for name in policy_names}
+  runs = {name : PolicyRun(contents=([] if name in record_contents else None)) for name in policy_names}
+  for request in trace:
+    for name, policy in policies.items():
+      was_hit, evicted = policy.access(request)
+      runs[name].hits.append(was_hit)
+      runs[name].evictions.append(evicted)
+      if runs[name].contents is not None:
+        runs[name].contents.append(policy.contents())
+  return runs
+
+
+def distinguishable_policies(runs: Dict[str, PolicyRun]) -> List[str]:
+  """The policies whose sequence of evictions differs from every other policy's."""
+  eviction_counts = collections.Counter(tuple(run.evictions) for run in runs.values())
+  return [name for name, run in runs.items() if eviction_counts[tuple(run.evictions)] == 1]
+
+
+def hit_rate(policy_name, cache_size: int, requests: Sequence[Hashable]) -> float:
+  """Percentage of `requests` that hit in a cache of `cache_size` entries, counting compulsory misses."""
+  if len(requests) == 0:
+    return 0.0
+  policy = CachePolicyRegistry.create(policy_name, cache_size, requests)
+  return 100 * policy.simulate(requests) / len(requests)
@@ -12,40 +12,40 @@ class QuickFunctions:
     return ' '.join([input_str[i:i+every] for i in range(0, len(input_str), every)])
   
   @classmethod
-  def random_binary_number(cls, num_bits):
+  def random_binary_number(cls, num_bits, rng=random):
     # return random.randrange(0, int(math.pow(2, num_bits)))
-    return '0b ' + cls.add_spaces_to_str(cls.random_binary_bits(num_bits))
+    return '0b ' + cls.add_spaces_to_str(cls.random_binary_bits(num_bits, rng=rng))
   
   @classmethod
-  def random_binary_bits(cls, num_bits):
-    return ''.join(random.choices("01", k=num_bits))
+  def random_binary_bits(cls, num_bits, rng=random):
+    return ''.join(rng.choices("01", k=num_bits))
   @classmethod
-  def random_hex_number(cls, num_digits):
-    return '0x' + cls.random_hex_digits(num_digits)
+  def random_hex_number(cls, num_digits, rng=random):
+    return '0x' + cls.random_hex_digits(num_digits, rng=rng)
   
   @classmethod
-  def random_hex_digits(cls, num_digits, prevent_zero=False):
-    result = ''.join(random.choices("0123456789abcdef".upper(), k=num_digits))
+  def random_hex_digits(cls, num_digits, prevent_zero=False, rng=random):
+    result = ''.join(rng.choices("0123456789abcdef".upper(), k=num_digits))
     if prevent_zero:
       while result == '0':
-        result = ''.join(random.choices("0123456789abcdef".upper(), k=num_digits))
+        result = ''.join(rng.choices("0123456789abcdef".upper(), k=num_digits))
     return result
   
   @classmethod
-  def pick_replacement_algo(cls):
-    return cls.pick_a_choice(["LRU", "FIFO", "Belady"])
+  def pick_replacement_algo(cls, rng=random):
+    return cls.pick_a_choice(["LRU", "FIFO", "Belady"], rng=rng)
   
   @classmethod
-  def pick_a_choice(cls, list_of_choices):
-    return str(random.choice(list_of_choices))
+  def pick_a_choice(cls, list_of_choices, rng=random):
+    return str(rng.choice(list_of_choices))
     
   @classmethod
-  def shuffle_list(cls, list_to_shuffle):
-    return '\n'.join(random.sample(list_to_shuffle, len(list_to_shuffle)))
+  def shuffle_list(cls, list_to_shuffle, rng=random):
+    return '\n'.join(rng.sample(list_to_shuffle, len(list_to_shuffle)))
   
   @classmethod
-  def number_in_range(cls, lower_bound, upper_bound):
-    return random.randrange(lower_bound, upper_bound)
+  def number_in_range(cls, lower_bound, upper_bound, rng=random):
+    return rng.randrange(lower_bound, upper_bound)
   
   @classmethod
   def print_as_hex(cls, in_number, pad_to_length=0, show_prefix=True, add_spaces=False):
@@ -66,7 +66,7 @@ class QuickFunctions:
     return out_str
 
   @classmethod
-  def generate_BNF_reversepolish(cls, num_to_generate=10, max_length = 20):
+  def generate_BNF_reversepolish(cls, num_to_generate=10, max_length = 20, rng=random):
     class BNF:
       class GeneratedString:
         def __init__(self, starting_string : str):
@@ -108,7 +108,7 @@ class QuickFunctions:
         while (not self.is_complete(generated_str)):
           for rule in self.productions.keys():
             for _ in range(generated_str.count(rule)):
-              generated_str.replace(rule, random.choice(self.productions[rule]), 1)
+              generated_str.replace(rule, rng.choice(self.productions[rule]), 1)
               if len(generated_str.versions) > max_depth:
                 return ""
         return generated_str
@@ -158,8 +158,9 @@ class QuickFunctions:
       if "" in strings:
         strings.remove("")
     
+    # Sort first, since set order changes from run to run and we want the shuffle to only depend on rng
     return sorted(
-      strings,
-      key=(lambda _: random.random())
+      sorted(strings),
+      key=(lambda _: rng.random())
     )[:num_to_generate]
     
\ No newline at end of file
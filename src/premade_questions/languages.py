@@ -24,7 +24,7 @@ class BNF:
       self.start_symbol = start_symbol if start_symbol is not None else symbols[0]
       self.symbols = symbols
   
-    def generate(self, include_spaces=False, early_exit=False, early_exit_min_iterations=5):
+    def generate(self, include_spaces=False, early_exit=False, early_exit_min_iterations=5, rng=random):
       curr_symbols : List[BNF.Symbol] = [self.start_symbol]
       prev_symbols: List[BNF.Symbol] = curr_symbols
       
@@ -37,7 +37,7 @@ class BNF:
         # Walk through the current symbols and build a new list of symbols from it
         next_symbols : List[BNF.Symbol] = []
         for symbol in curr_symbols:
-          next_symbols.extend(symbol.expand())
+          next_symbols.extend(symbol.expand(rng))
         curr_symbols = next_symbols
         
         iteration_count += 1
@@ -89,10 +89,10 @@ class BNF:
     def add_production(self, production: BNF.Production):
       self.productions.append(production)
     
-    def expand(self) -> List[BNF.Symbol]:
+    def expand(self, rng=random) -> List[BNF.Symbol]:
       if self.kind == BNF.Symbol.Kind.Terminal:
         return [self]
-      return random.choice(self.productions).production
+      return rng.choice(self.productions).production
   
   class Production:
     def __init__(self, production_line, nonterminal_symbols: Dict[str, BNF.Symbol]):
@@ -152,7 +152,7 @@ class LanguageQuestion(Question):
     if grammar_str is not None:
       self.grammar_str = grammar_str
     else:
-      which_grammar = random.choice(range(3))
+      which_grammar = self.rng.choice(range(3))
       
       if which_grammar == 0:
         # todo: make a few different kinds of grammars that could be picked
@@ -229,7 +229,7 @@ class LanguageQuestion(Question):
     self.answers.append(
       Answer(
         f"answer_good",
-        self.grammar_good.generate(self.include_spaces),
+        self.grammar_good.generate(self.include_spaces, rng=self.rng),
         Answer.AnswerKind.MULTIPLE_ANSWER,
         correct=True
       )
@@ -238,7 +238,7 @@ class LanguageQuestion(Question):
     self.answers.append(
       Answer(
         f"answer_bad",
-        self.grammar_bad.generate(self.include_spaces),
+        self.grammar_bad.generate(self.include_spaces, rng=self.rng),
         Answer.AnswerKind.MULTIPLE_ANSWER,
         correct=False
       )
@@ -246,7 +246,7 @@ class LanguageQuestion(Question):
     self.answers.append(
       Answer(
         f"answer_bad_early",
-        self.grammar_bad.generate(self.include_spaces, early_exit=True),
+        self.grammar_bad.generate(self.include_spaces, early_exit=True, rng=self.rng),
         Answer.AnswerKind.MULTIPLE_ANSWER,
         correct=False
       )
@@ -256,9 +256,9 @@ class LanguageQuestion(Question):
     num_tries = 0
     while len(self.answers) < 10 and num_tries < self.MAX_TRIES:
       
-      correct = random.choice([True, False])
+      correct = self.rng.choice([True, False])
       if not correct:
-        early_exit = random.choice([True, False])
+        early_exit = self.rng.choice([True, False])
       else:
         early_exit = False
       new_answer = Answer(
@@ -267,7 +267,7 @@ class LanguageQuestion(Question):
           self.grammar_good
           if correct or early_exit
           else self.grammar_bad
-        ).generate(self.include_spaces, early_exit=early_exit),
+        ).generate(self.include_spaces, early_exit=early_exit, rng=self.rng),
         Answer.AnswerKind.MULTIPLE_ANSWER,
         correct=correct
       )
@@ -276,6 +276,10 @@ class LanguageQuestion(Question):
         answer_text_set.add(new_answer.value)
       num_tries += 1
   
+  def get_parameter_key(self):
+    # Canvas shuffles the options, so their order doesn't matter
+    return (self.grammar_str_good, tuple(sorted((answer.value, answer.correct) for answer in self.answers)))
+  
   def get_body_lines(self, *args, **kwargs) -> List[str]:
     lines = []
     lines.extend([
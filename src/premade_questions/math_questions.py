@@ -1,7 +1,6 @@
 #!env python
 import logging
 import math
-import random
 from typing import List
 
 from question import Question, QuestionRegistry, Answer
@@ -25,11 +24,13 @@ class BitsAndBytes(MathQuestion):
   
   def __init__(self, *args, **kwargs):
     super().__init__(*args, **kwargs)
+    # Either direction for every number of bits
+    self.possible_variations = 2 * (self.MAX_BITS - self.MIN_BITS + 1)
     self.instantiate()
   
   def instantiate(self, *args, **kwargs):
-    self.from_binary = 0 == random.randint(0,1)
-    self.num_bits = random.randint(self.MIN_BITS, self.MAX_BITS)
+    self.from_binary = 0 == self.rng.randint(0,1)
+    self.num_bits = self.rng.randint(self.MIN_BITS, self.MAX_BITS)
     self.num_bytes = int(math.pow(2, self.num_bits))
     
     if self.from_binary:
@@ -37,6 +38,9 @@ class BitsAndBytes(MathQuestion):
     else:
       self.answers = [Answer("num_bits", self.num_bits, Answer.AnswerKind.BLANK)]
   
+  def get_parameter_key(self):
+    return (self.from_binary, self.num_bits)
+  
   def get_body_lines(self, *args, **kwargs) -> List[str]:
     lines = []
     
@@ -83,12 +87,13 @@ class HexAndBinary(MathQuestion):
   
   def __init__(self, *args, **kwargs):
     super().__init__(*args, **kwargs)
+    self.possible_variations = 2 * sum(16**number_of_hexits for number_of_hexits in range(self.MIN_HEXITS, self.MAX_HEXITS + 1))
     self.instantiate()
   
   def instantiate(self, *args, **kwargs):
-    self.from_binary = random.choice([True, False])
-    self.number_of_hexits = random.randint(1, 8)
-    self.value = random.randint(1, 16**self.number_of_hexits)
+    self.from_binary = self.rng.choice([True, False])
+    self.number_of_hexits = self.rng.randint(self.MIN_HEXITS, self.MAX_HEXITS)
+    self.value = self.rng.randint(1, 16**self.number_of_hexits)
     
     self.hex_val = f"0x{self.value:0{self.number_of_hexits}X}"
     self.binary_val = f"0b{self.value:0{4*self.number_of_hexits}b}"
@@ -98,6 +103,9 @@ class HexAndBinary(MathQuestion):
     else:
       self.answers = [Answer("binary_val", self.binary_val, Answer.AnswerKind.BLANK)]
   
+  def get_parameter_key(self):
+    return (self.from_binary, self.number_of_hexits, self.value)
+  
   def get_body_lines(self, *args, **kwargs) -> List[str]:
     lines = [
       f"Given the number {self.hex_val if not self.from_binary else self.binary_val} please convert it to {'hex' if self.from_binary else 'binary'}.",
@@ -155,15 +163,15 @@ class AverageMemoryAccessTime(MathQuestion):
   
   def instantiate(self, *args, **kwargs):
     
-    orders_of_magnitude_different = random.randint(1,4)
-    self.hit_latency = random.randint(1,9)
-    self.miss_latency = int(random.randint(1, 9) * math.pow(10, orders_of_magnitude_different))
+    orders_of_magnitude_different = self.rng.randint(1,4)
+    self.hit_latency = self.rng.randint(1,9)
+    self.miss_latency = int(self.rng.randint(1, 9) * math.pow(10, orders_of_magnitude_different))
     
-    if random.random() > 0.5:
+    if self.rng.random() > 0.5:
       # Then let's make it very close to 99%
-      self.hit_rate = (99 + random.random()) / 100
+      self.hit_rate = (99 + self.rng.random()) / 100
     else:
-      self.hit_rate = random.random()
+      self.hit_rate = self.rng.random()
     self.hit_rate = round(self.hit_rate, 4)
     self.amat = self.hit_rate * self.hit_latency + (1 - self.hit_rate) * self.miss_latency
     
@@ -171,6 +179,10 @@ class AverageMemoryAccessTime(MathQuestion):
       Answer("amat", self.amat, Answer.AnswerKind.BLANK)
     ]
   
+  def get_parameter_key(self):
+    # Which rate we show, and the order of the lines, is only presentation
+    return (self.hit_latency, self.miss_latency, self.hit_rate)
+  
   def get_body_lines(self, *args, **kwargs) -> List[str]:
     lines = [
       "Please calculate the Average Memory Access Time given the below information.  Please round your answer to 2 decimal points.",
@@ -181,12 +193,12 @@ class AverageMemoryAccessTime(MathQuestion):
       f"- Hit Latency: {self.hit_latency} cycles",
       f"- Miss Latency: {self.miss_latency} cycles",
     ]
-    if random.random() > 0.5:
+    if self.rng.random() > 0.5:
       info_lines.append(f"- Hit Rate: {100 * self.hit_rate: 0.2f}%")
     else:
       info_lines.append(f"- Miss Rate: {100 * (1 - self.hit_rate): 0.2f}%")
     
-    lines.extend(random.sample(info_lines, len(info_lines)))
+    lines.extend(self.rng.sample(info_lines, len(info_lines)))
     lines.append("")
     
     lines.extend([
@@ -2,11 +2,11 @@
 from __future__ import annotations
 
 import enum
-from typing import List
+from typing import Dict, List
 
 from question import Question, Answer, TableGenerator, QuestionRegistry
+from premade_questions.cache_policies import CachePolicyRegistry, compare_policies, distinguishable_policies, hit_rate
 
-import random
 import math
 import collections
 
@@ -30,66 +30,33 @@ class CachingQuestion(MemoryQuestion):
     FIFO = enum.auto()
     LRU = enum.auto()
     Belady = enum.auto()
+    LFU = enum.auto()
+    Clock = enum.auto()
+    TwoQ = enum.auto()
     def __str__(self):
       return self.name
   
+  # The policies we ask about unless told otherwise
+  DEFAULT_POLICIES = [Kind.FIFO, Kind.LRU, Kind.Belady]
+  
+  # In differential mode, give up looking for a trace that stands out after this many candidates and start over
+  # (possibly with another policy), and after this many rounds of that settle for a trace that doesn't
+  MAX_DIFFERENTIAL_CANDIDATES = 1000
+  MAX_DIFFERENTIAL_ROUNDS = 3
+  # Candidate and accepted traces per policy in differential mode, across every CachingQuestion
+  differential_stats : collections.Counter = collections.Counter()
+  
   
   class Cache:
     def __init__(self, kind : CachingQuestion.Kind, cache_size: int, all_requests : List[int]=None):
       self.kind = kind
       self.cache_size = cache_size
       self.all_requests = all_requests
-      
-      self.cache_state = [] # queue.Queue(maxsize=cache_size)
-      self.last_used = collections.defaultdict(lambda: -math.inf)
-      self.frequency = collections.defaultdict(lambda: 0)
+      self.policy = CachePolicyRegistry.create(kind.name, cache_size, all_requests)
     
     def query_cache(self, request, request_number):
-      was_hit = request in self.cache_state
-      
-      evicted = None
-      if was_hit:
-        # hit!
-        pass
-      else:
-        # miss!
-        if len(self.cache_state) == self.cache_size:
-          # Then we are full and need to evict
-          evicted = self.cache_state[0]
-          self.cache_state = self.cache_state[1:]
-        
-        # Add to cache
-        self.cache_state.append(request)
-      
-      # update state variable
-      self.last_used[request] = request_number
-      self.frequency[request] += 1
-      
-      # update cache state
-      if self.kind == CachingQuestion.Kind.FIFO:
-        pass
-      elif self.kind == CachingQuestion.Kind.LRU:
-        self.cache_state = sorted(
-          self.cache_state,
-          key=(lambda e: self.last_used[e]),
-          reverse=False
-        )
-      # elif self.kind == CachingQuestion.Kind.LFU:
-      #   self.cache_state = sorted(
-      #     self.cache_state,
-      #     key=(lambda e: (self.frequency[e], e)),
-      #     reverse=False
-      #   )
-      elif self.kind == CachingQuestion.Kind.Belady:
-        upcoming_requests = self.all_requests[request_number+1:]
-        self.cache_state = sorted(
-          self.cache_state,
-          # key=(lambda e: (upcoming_requests.index(e), e) if e in upcoming_requests else (-math.inf, e)),
-          key=(lambda e: (upcoming_requests.index(e), -e) if e in upcoming_requests else (math.inf, -e)),
-          reverse=True
-        )
-      
-      return (was_hit, evicted, self.cache_state)
+      was_hit, evicted = self.policy.access(request)
+      return (was_hit, evicted, self.policy.contents())
   
   
   def __init__(self, *args, **kwargs):
@@ -97,19 +64,56 @@ class CachingQuestion(MemoryQuestion):
     self.num_elements = kwargs.get("num_elements", 5)
     self.cache_size = kwargs.get("cache_size", 3)
     self.num_requests = kwargs.get("num_requests", 10)
+    self.cache_policies = [
+      (self.Kind[kind] if isinstance(kind, str) else kind)
+      for kind in kwargs.get("cache_policies", self.DEFAULT_POLICIES)
+    ]
+    # In differential mode we only keep traces where the chosen policy evicts differently from every other policy
+    self.differential = kwargs.get("differential", False)
+    self.failed_differential_rounds = 0
+    self.compare_against = [
+      (self.Kind[kind] if isinstance(kind, str) else kind)
+      for kind in kwargs.get("compare_against", list(self.Kind))
+    ]
     
     self.instantiate()
   
   def instantiate(self, *args, **kwargs):
     self.answers = []
-    self.cache_policy = random.choice(list(self.Kind))
-    
-    self.requests = (
-        list(range(self.cache_size)) # Prime the cache with the compulsory misses
-        + random.choices(population=list(range(self.cache_size-1)), k=1) # Add in one request to an earlier  that will differentiate clearly between FIFO and LRU
-        + random.choices(population=list(range(self.cache_size, self.num_elements)), k=1) ## Add in the rest of the requests
-        + random.choices(population=list(range(self.num_elements)), k=(self.num_requests-2)) ## Add in the rest of the requests
-    )
+    self.cache_policy = self.rng.choice(self.cache_policies)
+    
+    self.candidate_traces = 0
+    self.distinguishes_policies = False
+    while True:
+      self.requests = (
+          list(range(self.cache_size)) # Prime the cache with the compulsory misses
+          + self.rng.choices(population=list(range(self.cache_size-1)), k=1) # Add in one request to an earlier  that will differentiate clearly between FIFO and LRU
+          + self.rng.choices(population=list(range(self.cache_size, self.num_elements)), k=1) ## Add in the rest of the requests
+          + self.rng.choices(population=list(range(self.num_elements)), k=(self.num_requests-2)) ## Add in the rest of the requests
+      )
+      if not self.differential:
+        break
+      
+      # Run every policy over the trace in one pass and see whether ours stands out
+      self.candidate_traces += 1
+      policy_names = {kind.name for kind in self.compare_against} | {self.cache_policy.name}
+      runs = compare_policies(sorted(policy_names), self.cache_size, self.requests)
+      accepted = self.cache_policy.name in distinguishable_policies(runs)
+      self.differential_stats[(self.cache_policy, "candidates")] += 1
+      self.differential_stats[(self.cache_policy, "accepted")] += int(accepted)
+      if accepted:
+        log.debug(f"Found a trace that distinguishes {self.cache_policy} after {self.candidate_traces} candidates")
+        self.distinguishes_policies = True
+        self.failed_differential_rounds = 0
+        break
+      if self.candidate_traces >= self.MAX_DIFFERENTIAL_CANDIDATES:
+        self.failed_differential_rounds += 1
+        log.warning(
+          f"No trace distinguished {self.cache_policy} from {', '.join(sorted(policy_names - {self.cache_policy.name}))} "
+          f"in {self.candidate_traces} tries (cache size {self.cache_size}), "
+          + ("using one that doesn't" if self.failed_differential_rounds >= self.MAX_DIFFERENTIAL_ROUNDS else "starting over")
+        )
+        break
     
     self.cache = CachingQuestion.Cache(self.cache_policy, self.cache_size, self.requests)
     
@@ -140,6 +144,9 @@ class CachingQuestion(MemoryQuestion):
       Answer("answer__hit_rate", f"{self.hit_rate:0.2f}", Answer.AnswerKind.BLANK)
     ])
   
+  def get_parameter_key(self):
+    return (self.cache_policy.name, self.cache_size, tuple(self.requests))
+  
   def get_body_lines(self, *args, **kwargs) -> List[str]:
     # return ["question"]
     lines = [
@@ -214,8 +221,121 @@ class CachingQuestion(MemoryQuestion):
     return lines
   
   def is_interesting(self) -> bool:
-    # todo: interesting is more likely based on whether I can differentiate between it and another algo, so maybe rerun with a different approach but same requests?
+    if self.differential:
+      # Settling for a trace that doesn't tell the policies apart only once we've failed to find one too many times
+      return self.distinguishes_policies or self.failed_differential_rounds >= self.MAX_DIFFERENTIAL_ROUNDS
     return (self.hit_rate / 100.0) < 0.5
+  
+  @classmethod
+  def acceptance_rates(cls) -> Dict[CachingQuestion.Kind, float]:
+    """Fraction of candidate traces kept in differential mode, for each policy we have asked about."""
+    return {
+      kind : cls.differential_stats[(kind, "accepted")] / cls.differential_stats[(kind, "candidates")]
+      for kind in cls.Kind
+      if cls.differential_stats[(kind, "candidates")] > 0
+    }
+  
+  @classmethod
+  def describe_differential_stats(cls):
+    for kind, rate in cls.acceptance_rates().items():
+      log.info(
+        f"{kind}: accepted {cls.differential_stats[(kind, 'accepted')]} of {cls.differential_stats[(kind, 'candidates')]} "
+        f"candidate traces ({100 * rate:0.1f}%, {1 / rate if rate > 0 else math.inf:0.1f} tried per question)"
+      )
+
+
+@QuestionRegistry.register()
+class CachingHitRateQuestion(MemoryQuestion):
+  """
+  Asks for the hit rate over a long trace (10^5 requests by default) that follows a simple pattern, so it has to be
+  reasoned about rather than worked through by hand.  Answers come from actually simulating the trace.
+  """
+  
+  class Pattern(enum.Enum):
+    LOOP = enum.auto()            # 0, 1, ..., n-1, 0, 1, ...
+    LOOP_WITH_HOT_PAGE = enum.auto()  # 0, 1, 0, 2, ..., 0, n-1, 0, 1, ...
+  
+  DEFAULT_POLICIES = [
+    CachingQuestion.Kind.FIFO,
+    CachingQuestion.Kind.LRU,
+    CachingQuestion.Kind.Belady,
+    CachingQuestion.Kind.Clock,
+  ]
+  
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.num_requests = kwargs.get("num_requests", 100_000)
+    self.min_cache_size = kwargs.get("min_cache_size", 4)
+    self.max_cache_size = kwargs.get("max_cache_size", 16)
+    self.cache_policies = [
+      (CachingQuestion.Kind[kind] if isinstance(kind, str) else kind)
+      for kind in kwargs.get("cache_policies", self.DEFAULT_POLICIES)
+    ]
+    self.possible_variations = len(set(self.cache_policies)) * len(self.Pattern) * sum(
+      2 * cache_size - max(2, cache_size - 1) + 1
+      for cache_size in range(self.min_cache_size, self.max_cache_size + 1)
+    )
+    
+    self.instantiate()
+  
+  def instantiate(self, *args, **kwargs):
+    self.answers = []
+    self.cache_policy = self.rng.choice(self.cache_policies)
+    self.pattern = self.rng.choice(list(self.Pattern))
+    self.cache_size = self.rng.randint(self.min_cache_size, self.max_cache_size)
+    # Mostly loops that don't quite fit, since that is where the policies differ
+    self.num_pages = self.rng.randint(max(2, self.cache_size - 1), 2 * self.cache_size)
+    
+    self.requests = self.make_trace(self.pattern, self.num_pages, self.num_requests)
+    self.num_hits = CachePolicyRegistry.create(self.cache_policy.name, self.cache_size, self.requests).simulate(self.requests)
+    self.hit_rate = 100 * self.num_hits / self.num_requests
+    
+    self.answers.extend([
+      Answer("answer__hit_rate", f"{self.hit_rate:0.2f}", Answer.AnswerKind.BLANK)
+    ])
+  
+  def get_parameter_key(self):
+    # The trace follows from the pattern, so there is no need to hash all of it
+    return (self.cache_policy.name, self.pattern.name, self.cache_size, self.num_pages, self.num_requests)
+  
+  @staticmethod
+  def make_trace(pattern: CachingHitRateQuestion.Pattern, num_pages: int, num_requests: int) -> List[int]:
+    if pattern == CachingHitRateQuestion.Pattern.LOOP:
+      loop = list(range(num_pages))
+    else:
+      loop = [page for other_page in range(1, num_pages) for page in (0, other_page)]
+    return [loop[i % len(loop)] for i in range(num_requests)]
+  
+  def describe_pattern(self) -> str:
+    if self.pattern == CachingHitRateQuestion.Pattern.LOOP:
+      return f"loops over pages 0 through {self.num_pages - 1} in order (i.e. 0, 1, ..., {self.num_pages - 1}, 0, 1, ...)"
+    return (
+      f"loops over pages 1 through {self.num_pages - 1} in order, but requests page 0 before each of them "
+      f"(i.e. 0, 1, 0, 2, ..., 0, {self.num_pages - 1}, 0, 1, ...)"
+    )
+  
+  def get_body_lines(self, *args, **kwargs) -> List[str]:
+    return [
+      f"Assume we are using a <b>{self.cache_policy}</b> caching policy and a cache size of <b>{self.cache_size}</b>, "
+      "and that the cache starts out empty.",
+      "",
+      f"A program makes {self.num_requests:,} page requests, and its request stream {self.describe_pattern()}.",
+      "",
+      "What is the hit rate, including compulsory misses, to two decimal places? [answer__hit_rate]%",
+    ]
+  
+  def get_explanation_lines(self, *args, **kwargs) -> List[str]:
+    distinct_pages = len(set(self.requests))
+    return [
+      f"Of the {self.num_requests:,} requests, {self.num_hits:,} were hits and {self.num_requests - self.num_hits:,} were misses, "
+      f"{distinct_pages} of which were compulsory misses the first time each page was requested.",
+      "",
+      f"Hit rate = {self.num_hits:,} / {self.num_requests:,} = <b>{self.hit_rate:0.2f}%</b>",
+      "",
+      "The trick is to work out what happens once the cache is warm: "
+      f"with {distinct_pages} pages and room for {self.cache_size}, look at which page {self.cache_policy} evicts "
+      "and how long it is until that page is needed again.",
+    ]
 
 
 class MemoryAccessQuestion(MemoryQuestion):
@@ -240,26 +360,28 @@ class Paging(MemoryAccessQuestion):
     
     self.instantiate()
   
+  # No get_parameter_key: the page table is drawn as the body is laid out, so Paging is fingerprinted from its body
+  
   def instantiate(self, *args, **kwargs):
     super().instantiate()
     
-    self.num_offset_bits = random.randint(self.MIN_OFFSET_BITS, self.MAX_OFFSET_BITS)
-    self.num_vpn_bits = random.randint(self.MIN_VPN_BITS, self.MAX_VPN_BITS)
-    self.num_pfn_bits = random.randint(max([self.MIN_PFN_BITS, self.num_vpn_bits]), self.MAX_PFN_BITS)
+    self.num_offset_bits = self.rng.randint(self.MIN_OFFSET_BITS, self.MAX_OFFSET_BITS)
+    self.num_vpn_bits = self.rng.randint(self.MIN_VPN_BITS, self.MAX_VPN_BITS)
+    self.num_pfn_bits = self.rng.randint(max([self.MIN_PFN_BITS, self.num_vpn_bits]), self.MAX_PFN_BITS)
     
-    self.virtual_address = random.randint(0, 2**(self.num_vpn_bits + self.num_offset_bits))
+    self.virtual_address = self.rng.randint(0, 2**(self.num_vpn_bits + self.num_offset_bits))
     
     # Calculate these two
     self.offset = self.virtual_address % (2**(self.num_offset_bits))
     self.vpn = self.virtual_address // (2**(self.num_offset_bits))
     
     # Generate this randomly
-    self.pfn = random.randint(0, 2**(self.num_pfn_bits))
+    self.pfn = self.rng.randint(0, 2**(self.num_pfn_bits))
     
     # Calculate this
     self.physical_address = self.pfn * (2**self.num_offset_bits) + self.offset
     
-    if random.choices([True, False], weights=[(self.PROBABILITY_OF_VALID), (1-self.PROBABILITY_OF_VALID)], k=1)[0]:
+    if self.rng.choices([True, False], weights=[(self.PROBABILITY_OF_VALID), (1-self.PROBABILITY_OF_VALID)], k=1)[0]:
       self.is_valid = True
       # Set our actual entry to be in the table and valid
       self.pte = self.pfn + (2**(self.num_pfn_bits))
@@ -310,8 +432,8 @@ class Paging(MemoryAccessQuestion):
     ])
     
     # Make values for Page Table
-    table_size = random.randint(5,10)
-    table_bottom = self.vpn - random.randint(0, table_size)
+    table_size = self.rng.randint(5,10)
+    table_bottom = self.vpn - self.rng.randint(0, table_size)
     if table_bottom < 0:
       table_bottom = 0
     table_top = min([table_bottom + table_size, 2**self.num_vpn_bits])
@@ -325,8 +447,8 @@ class Paging(MemoryAccessQuestion):
       if vpn == self.vpn: continue
       pte = page_table[self.vpn]
       while pte in page_table.values():
-        pte = random.randint(0, 2**self.num_pfn_bits-1)
-        if random.choices([True, False], weights=[(1-self.PROBABILITY_OF_VALID), self.PROBABILITY_OF_VALID], k=1)[0]:
+        pte = self.rng.randint(0, 2**self.num_pfn_bits-1)
+        if self.rng.choices([True, False], weights=[(1-self.PROBABILITY_OF_VALID), self.PROBABILITY_OF_VALID], k=1)[0]:
           # Randomly set it to be valid
           pte += (2**(self.num_pfn_bits))
       # Once we have a unique random entry, put it into the Page Table
@@ -3,7 +3,6 @@ from __future__ import annotations
 
 import logging
 import math
-import random
 from typing import List
 
 from misc import OutputFormat
@@ -25,6 +24,8 @@ class HardDriveAccessTime(IOQuestion):
   
   def __init__(self, *args, **kwargs):
     super().__init__(*args, **kwargs)
+    # rotation speeds * seek delays * transfer rates * number of reads * read sizes
+    self.possible_variations = 115 * 17 * 251 * 20 * 10
     
     self.instantiate()
   
@@ -32,11 +33,11 @@ class HardDriveAccessTime(IOQuestion):
     super().instantiate()
     
     
-    self.hard_drive_rotation_speed = 100 * random.randint(36, 150) # e.g. 3600rpm to 15000rpm
-    self.seek_delay = float(round(random.randrange(3, 20), 2))
-    self.transfer_rate = random.randint(50, 300)
-    self.number_of_reads = random.randint(1, 20)
-    self.size_of_reads = random.randint(1, 10)
+    self.hard_drive_rotation_speed = 100 * self.rng.randint(36, 150) # e.g. 3600rpm to 15000rpm
+    self.seek_delay = float(round(self.rng.randrange(3, 20), 2))
+    self.transfer_rate = self.rng.randint(50, 300)
+    self.number_of_reads = self.rng.randint(1, 20)
+    self.size_of_reads = self.rng.randint(1, 10)
     
     self.rotational_delay = (1 / self.hard_drive_rotation_speed) * (60 / 1) *  (1000 / 1) * (1/2)
     self.access_delay = self.rotational_delay + self.seek_delay
@@ -50,6 +51,9 @@ class HardDriveAccessTime(IOQuestion):
       Answer("answer__disk_access_delay", self.disk_access_delay, variable_kind=Answer.VariableKind.FLOAT),
     ])
   
+  def get_parameter_key(self):
+    return (self.hard_drive_rotation_speed, self.seek_delay, self.transfer_rate, self.number_of_reads, self.size_of_reads)
+  
   def get_body_lines(self, output_format : OutputFormat|None = None, *args, **kwargs) -> List[str]:
     lines = [
       "Given the information below, please calculate the following values.",
@@ -126,6 +130,8 @@ class INodeAccesses(IOQuestion):
   
   def __init__(self, output_format : OutputFormat|None = None, *args, **kwargs):
     super().__init__(*args, **kwargs)
+    # inode sizes * block sizes * inode numbers * inode table starts
+    self.possible_variations = 5 * 13 * 257 * 4
     
     self.instantiate()
   
@@ -133,11 +139,11 @@ class INodeAccesses(IOQuestion):
     super().instantiate()
     
     # Calculating this first to use blocksize as an even multiple of it
-    self.inode_size = 2**random.randint(6, 10)
+    self.inode_size = 2**self.rng.randint(6, 10)
     
-    self.block_size = self.inode_size * random.randint(8,20)
-    self.inode_number = random.randint(0,256)
-    self.inode_start_location = self.block_size * random.randint(2, 5)
+    self.block_size = self.inode_size * self.rng.randint(8,20)
+    self.inode_number = self.rng.randint(0,256)
+    self.inode_start_location = self.block_size * self.rng.randint(2, 5)
     
     self.inode_address = self.inode_start_location + self.inode_number * self.inode_size
     self.inode_block = self.inode_address // self.block_size
@@ -152,6 +158,9 @@ class INodeAccesses(IOQuestion):
       Answer("answer__inode_index_in_block", self.inode_index_in_block),
     ])
   
+  def get_parameter_key(self):
+    return (self.inode_size, self.block_size, self.inode_number, self.inode_start_location)
+  
   def get_body_lines(self, output_format : OutputFormat|None = None,  *args, **kwargs) -> List[str]:
     lines = [
       "Given the information below, please calculate the following values."
@@ -230,7 +239,7 @@ class VSFS_states(IOQuestion):
     super().instantiate()
     
     
-    fs = self.vsfs(4, 4)
+    fs = self.vsfs(4, 4, rng=self.rng)
     operations = fs.run_for_steps(3)
     
     self.start_state = operations[-1]["start_state"]
@@ -243,12 +252,15 @@ class VSFS_states(IOQuestion):
         operations
       )
     ))
-    random.shuffle(wrong_answers)
+    self.rng.shuffle(wrong_answers)
     
     self.answers.extend([
       Answer("answer__cmd",  f"{operations[-1]['cmd']}"),
     ])
   
+  def get_parameter_key(self):
+    return (self.start_state, self.end_state, self.answers[0].value)
+  
   def get_body_lines(self, *args, **kwargs) -> List[str]:
     lines = []
     
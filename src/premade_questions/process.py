@@ -4,19 +4,21 @@ from __future__ import annotations
 import collections
 import dataclasses
 import enum
+import heapq
+import itertools
 import logging
 import os
 import pprint
-import random
 import uuid
-from typing import List
-
-import canvasapi.course, canvasapi.quiz
-import matplotlib.pyplot as plt
+from typing import List, Tuple, TYPE_CHECKING
 
 from misc import OutputFormat
 from question import Question, Answer, QuestionRegistry
 
+if TYPE_CHECKING:
+  import canvasapi.course, canvasapi.quiz
+  import numpy as np
+
 logging.basicConfig()
 log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
@@ -31,6 +33,9 @@ class ProcessQuestion(Question):
 
 @QuestionRegistry.register()
 class SchedulingQuestion(ProcessQuestion):
+  # The explanation uploads the timeline image to the course
+  NEEDS_CANVAS_TO_GENERATE = True
+  
   class Kind(enum.Enum):
     FIFO = enum.auto()
     LIFO = enum.auto()
@@ -107,41 +112,45 @@ class SchedulingQuestion(ProcessQuestion):
     def has_started(self) -> bool:
       return self.response_time is None
   
-  def simulation(self, jobs_to_run: List[SchedulingQuestion.Job], selector, preemptable, time_quantum=None):
-    curr_time = 0
-    selected_job : SchedulingQuestion.Job | None = None
-    
+  def simulation(self, jobs_to_run: List[SchedulingQuestion.Job], selector, preemptable):
+    """
+    Event-driven simulation: time only advances to the next arrival or completion.
+    Round robin is simulated as processor sharing (i.e. an infinitely small time quantum), the rest pick jobs off a heap.
+    """
     self.timeline = collections.defaultdict(list)
-    self.timeline[curr_time].append("Simulation Start")
+    self.timeline[0].append("Simulation Start")
     for job in jobs_to_run:
       self.timeline[job.arrival].append(f"Job{job.job_id} arrived")
     
-    while len(jobs_to_run) > 0:
-      possible_time_slices = []
-      
-      # Get the jobs currently in the system
-      available_jobs = list(filter(
-        (lambda j: j.arrival <= curr_time),
-        jobs_to_run
-      ))
+    if self.SCHEDULER_KIND == SchedulingQuestion.Kind.RoundRobin:
+      self.simulate_processor_sharing(jobs_to_run)
+    else:
+      self.simulate_with_selector(jobs_to_run, selector, preemptable)
+  
+  def simulate_with_selector(self, jobs_to_run: List[SchedulingQuestion.Job], selector, preemptable):
+    curr_time = 0
+    
+    # Jobs that haven't arrived yet, and jobs in the system keyed by the selector.
+    # Selector keys only change for the job that just ran, so it is the only one that gets re-keyed.
+    future_jobs = [(job.arrival, job.job_id, job) for job in jobs_to_run]
+    heapq.heapify(future_jobs)
+    available_jobs = []
+    
+    while len(future_jobs) > 0 or len(available_jobs) > 0:
+      while len(future_jobs) > 0 and future_jobs[0][0] <= curr_time:
+        _, _, job = heapq.heappop(future_jobs)
+        heapq.heappush(available_jobs, (selector(job, curr_time), job.job_id, job))
       
-      # Get the jobs that will enter the system in the future
-      future_jobs : List[SchedulingQuestion.Job] = list(filter(
-        (lambda j: j.arrival > curr_time),
-        jobs_to_run
-      ))
+      possible_time_slices = []
+      selected_job : SchedulingQuestion.Job | None = None
       
       # Check whether there are jobs in the system already
       if len(available_jobs) > 0:
-        # Use the selector to identify what job we are going to run
-        selected_job : SchedulingQuestion.Job = min(
-          available_jobs,
-          key=(lambda j: selector(j, curr_time))
-        )
+        _, _, selected_job = heapq.heappop(available_jobs)
         if selected_job.has_started():
           self.timeline[curr_time].append(f"Starting Job{selected_job.job_id} (resp = {curr_time - selected_job.arrival:0.{self.ROUNDING_DIGITS}f}s)")
         # We start the job that we selected
-        selected_job.run(curr_time, (self.SCHEDULER_KIND == self.Kind.RoundRobin))
+        selected_job.run(curr_time)
         
         # We could run to the end of the job
         possible_time_slices.append(selected_job.time_remaining(curr_time))
@@ -150,58 +159,124 @@ class SchedulingQuestion(ProcessQuestion):
       if preemptable or len(possible_time_slices) == 0:
         # Then when a job enters we could stop the current task
         if len(future_jobs) != 0:
-          next_arrival : SchedulingQuestion.Job = min(
-            future_jobs,
-            key=(lambda j: j.arrival)
-          )
-          possible_time_slices.append( (next_arrival.arrival - curr_time))
-      
-      if time_quantum is not None:
-        possible_time_slices.append(time_quantum)
+          possible_time_slices.append(future_jobs[0][0] - curr_time)
       
-      ## Now we pick the minimum
-      try:
-        next_time_slice = min(possible_time_slices)
-      except ValueError:
-        log.error("No jobs available to schedule")
-        break
-      if self.SCHEDULER_KIND != SchedulingQuestion.Kind.RoundRobin:
-        if selected_job is not None:
-          self.timeline[curr_time].append(f"Running Job{selected_job.job_id} for {next_time_slice:0.{self.ROUNDING_DIGITS}f}s")
-        else:
-          self.timeline[curr_time].append(f"(No job running)")
+      next_time_slice = min(possible_time_slices)
+      if selected_job is not None:
+        self.timeline[curr_time].append(f"Running Job{selected_job.job_id} for {next_time_slice:0.{self.ROUNDING_DIGITS}f}s")
+      else:
+        self.timeline[curr_time].append(f"(No job running)")
       curr_time += next_time_slice
       
-      # We stop the job we selected, and potentially mark it as complete
+      # We stop the job we selected, and either mark it as complete or put it back
       if selected_job is not None:
-        selected_job.stop(curr_time, (self.SCHEDULER_KIND == self.Kind.RoundRobin))
+        selected_job.stop(curr_time)
         if selected_job.is_complete(curr_time):
           self.timeline[curr_time].append(f"Completed Job{selected_job.job_id} (TAT = {selected_job.turnaround_time:0.{self.ROUNDING_DIGITS}f}s)")
-      selected_job = None
-      
-      # Filter out completed jobs
-      jobs_to_run : List[SchedulingQuestion.Job] = list(filter(
-        (lambda j: not j.is_complete(curr_time)),
-        jobs_to_run
-      ))
-      if len(jobs_to_run) == 0:
-        break
-  
+        else:
+          heapq.heappush(available_jobs, (selector(selected_job, curr_time), selected_job.job_id, selected_job))
   
+  def simulate_processor_sharing(self, jobs_to_run: List[SchedulingQuestion.Job]):
+    # With n jobs in the system each one progresses at 1/n, so between events everything is linear and
+    # the next event is either an arrival or the job with the least work left finishing.
+    curr_time = 0
+    future_jobs = sorted(jobs_to_run, key=(lambda j: (j.arrival, j.job_id)))
+    running_jobs : List[SchedulingQuestion.Job] = []
+    work_remaining = {}
+    
+    while len(future_jobs) > 0 or len(running_jobs) > 0:
+      while len(future_jobs) > 0 and future_jobs[0].arrival <= curr_time:
+        job = future_jobs.pop(0)
+        self.timeline[curr_time].append(f"Starting Job{job.job_id} (resp = {curr_time - job.arrival:0.{self.ROUNDING_DIGITS}f}s)")
+        job.run(curr_time, is_rr=True)
+        running_jobs.append(job)
+        work_remaining[job.job_id] = job.duration
+      
+      if len(running_jobs) == 0:
+        curr_time = future_jobs[0].arrival
+        continue
+      
+      time_to_completion = min(work_remaining[job.job_id] for job in running_jobs) * len(running_jobs)
+      if len(future_jobs) > 0 and future_jobs[0].arrival - curr_time < time_to_completion:
+        next_time_slice = future_jobs[0].arrival - curr_time
+      else:
+        next_time_slice = time_to_completion
+      
+      for job in running_jobs:
+        work_remaining[job.job_id] -= next_time_slice / len(running_jobs)
+      curr_time += next_time_slice
+      
+      for job in list(running_jobs):
+        if work_remaining[job.job_id] > job.SCHEDULER_EPSILON:
+          continue
+        running_jobs.remove(job)
+        job.elapsed_time = job.duration
+        job.mark_end(curr_time)
+        job.unpause_time = None
+        job.last_run = curr_time
+        self.timeline[curr_time].append(f"Completed Job{job.job_id} (TAT = {job.turnaround_time:0.{self.ROUNDING_DIGITS}f}s)")
   
-  def __init__(self, num_jobs=3, *args, **kwargs):
+  def __init__(self, num_jobs=3, scheduler_kind=None, workload=None, results=None, *args, **kwargs):
+    """
+    :param scheduler_kind: Always use this scheduler (a Kind or its name) rather than picking one each time
+    :param workload: Always use these (arrival, duration) pairs rather than generating new ones
+    :param results: (response times, turnaround times) of `workload` under `scheduler_kind`, e.g. from simulate_batch,
+      so the first variation doesn't need simulating
+    """
     super().__init__(*args, **kwargs)
-    self.num_jobs = num_jobs
-    self.instantiate()
+    self.num_jobs = num_jobs if workload is None else len(workload)
+    if isinstance(scheduler_kind, str):
+      scheduler_kind = SchedulingQuestion.Kind[scheduler_kind]
+    self.fixed_scheduler_kind = scheduler_kind
+    self.fixed_workload = workload
+    self.timeline = None
+    if results is None:
+      self.instantiate()
+    else:
+      super().instantiate()
+      self.set_scheduler(scheduler_kind)
+      self.set_job_stats(workload, *results)
+      self.set_answers()
   
   def instantiate(self, scheduler_kind=None, *args, **kwargs):
     super().instantiate()
     self.job_stats = {}
     if scheduler_kind is None:
-      self.SCHEDULER_KIND = random.choice(list(SchedulingQuestion.Kind))
-    else:
-      self.SCHEDULER_KIND = scheduler_kind
+      scheduler_kind = self.fixed_scheduler_kind
+    if scheduler_kind is None:
+      scheduler_kind = self.rng.choice(list(SchedulingQuestion.Kind))
+    self.set_scheduler(scheduler_kind)
     
+    # Keep generating workloads for the same scheduler until one is interesting.
+    # Otherwise, we end up with the distribution of schedulers being inversely proportional to how good they are
+    while True:
+      if self.fixed_workload is not None:
+        workload = self.fixed_workload
+      else:
+        workload = [
+          (self.rng.randint(0, self.MAX_ARRIVAL_TIME), self.rng.randint(self.MIN_JOB_DURATION, self.MAX_JOB_DURATION))
+          for _ in range(self.num_jobs)
+        ]
+      jobs = [
+        SchedulingQuestion.Job(job_id, arrival, duration)
+        for job_id, (arrival, duration) in enumerate(workload)
+      ]
+      
+      self.simulation(jobs, self.SELECTOR, self.PREEMPTABLE)
+      self.set_job_stats(
+        workload,
+        [job.response_time for job in jobs],
+        [job.turnaround_time for job in jobs],
+        [job.state_change_times for job in jobs]
+      )
+      if self.is_interesting():
+        break
+      log.debug("Is not interesting, rerunning...")
+    
+    self.set_answers()
+  
+  def set_scheduler(self, scheduler_kind: SchedulingQuestion.Kind) -> None:
+    self.SCHEDULER_KIND = scheduler_kind
     log.debug(f"Using a {self.SCHEDULER_KIND} scheduler")
     
     # Default to FIFO an then change as necessary
@@ -225,35 +300,30 @@ class SchedulingQuestion(ProcessQuestion):
       self.SCHEDULER_NAME = "Round Robin"
       self.SELECTOR = (lambda j, curr_time: (j.last_run, j.job_id))
       self.PREEMPTABLE = True
-      self.TIME_QUANTUM = 1e-04
     else:
       # then we default to FIFO
       pass
-    
-    jobs = [
-      SchedulingQuestion.Job(
-        job_id,
-        random.randint(0, self.MAX_ARRIVAL_TIME),
-        random.randint(self.MIN_JOB_DURATION, self.MAX_JOB_DURATION)
-      )
-      for job_id in range(self.num_jobs)
-    ]
-    
-    self.simulation(jobs, self.SELECTOR, self.PREEMPTABLE, self.TIME_QUANTUM)
-    
+  
+  def set_job_stats(self, workload, response_times, turnaround_times, state_change_times=None) -> None:
+    """Records each job's results.  Without `state_change_times` they are filled in with the timeline, when first needed."""
     self.job_stats = {
       i : {
-        "arrival" : job.arrival,            # input
-        "duration" : job.duration,          # input
-        "Response" : job.response_time,     # output
-        "TAT" : job.turnaround_time,         # output
-        "state_changes" : [job.arrival] + job.state_change_times + [job.arrival + job.turnaround_time],
+        "arrival" : arrival,                    # input
+        "duration" : duration,                  # input
+        "Response" : response_times[i],         # output
+        "TAT" : turnaround_times[i],            # output
       }
-      for (i, job) in enumerate(jobs)
+      for i, (arrival, duration) in enumerate(workload)
     }
+    if state_change_times is not None:
+      for i, stats in self.job_stats.items():
+        stats["state_changes"] = [stats["arrival"]] + state_change_times[i] + [stats["arrival"] + stats["TAT"]]
+  
+  def set_answers(self) -> None:
+    num_jobs = len(self.job_stats)
     self.overall_stats = {
-      "Response" : sum([job.response_time for job in jobs]) / len(jobs),
-      "TAT" : sum([job.turnaround_time for job in jobs]) / len(jobs)
+      "Response" : sum([stats["Response"] for stats in self.job_stats.values()]) / num_jobs,
+      "TAT" : sum([stats["TAT"] for stats in self.job_stats.values()]) / num_jobs
     }
     
     # todo: make this less convoluted
@@ -267,15 +337,159 @@ class SchedulingQuestion(ProcessQuestion):
         Answer(f"answer__turnaround_time_job{job_id}", self.job_stats[job_id]["TAT"], variable_kind=Answer.VariableKind.FLOAT),
       ])
     self.answers.extend([
-      Answer("answer__average_response_time", sum([job.response_time for job in jobs]) / len(jobs), variable_kind=Answer.VariableKind.FLOAT),
-      Answer("answer__average_turnaround_time", sum([job.turnaround_time for job in jobs]) / len(jobs), variable_kind=Answer.VariableKind.FLOAT)
+      Answer("answer__average_response_time", self.overall_stats["Response"], variable_kind=Answer.VariableKind.FLOAT),
+      Answer("answer__average_turnaround_time", self.overall_stats["TAT"], variable_kind=Answer.VariableKind.FLOAT)
     ])
+  
+  def simulate_timeline(self) -> None:
+    """Questions made from batch results only have their stats, so the timeline is simulated the first time it's needed."""
+    if self.timeline is not None:
+      return
+    jobs = [
+      SchedulingQuestion.Job(job_id, self.job_stats[job_id]["arrival"], self.job_stats[job_id]["duration"])
+      for job_id in sorted(self.job_stats.keys())
+    ]
+    self.simulation(jobs, self.SELECTOR, self.PREEMPTABLE)
+    for job in jobs:
+      stats = self.job_stats[job.job_id]
+      stats["state_changes"] = [stats["arrival"]] + job.state_change_times + [stats["arrival"] + stats["TAT"]]
+  
+  def get_parameter_key(self):
+    return (
+      self.SCHEDULER_KIND.name,
+      tuple((self.job_stats[job_id]["arrival"], self.job_stats[job_id]["duration"]) for job_id in sorted(self.job_stats.keys()))
+    )
+  
+  @classmethod
+  def simulate_batch(cls, scheduler_kind: SchedulingQuestion.Kind, arrivals, durations) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Simulates many workloads at once.  Arrivals and durations are (workloads, jobs) arrays.
+    Each pass of the loop handles the next event (an arrival or a completion) for every workload, so there are at most 2*jobs passes.
+    Returns the (response, TAT) arrays, which match `simulation` for the same workloads.
+    """
+    # Only the batch paths need numpy, so loading the question doesn't pay for importing it
+    import numpy as np
+    
+    arrivals = np.asarray(arrivals, dtype=float)
+    durations = np.asarray(durations, dtype=float)
+    num_workloads, num_jobs = arrivals.shape
+    rows = np.arange(num_workloads)
+    epsilon = SchedulingQuestion.Job.SCHEDULER_EPSILON
+    
+    curr_time = np.zeros(num_workloads)
+    remaining = durations.copy()
+    start_time = np.full(arrivals.shape, np.nan)
+    end_time = np.full(arrivals.shape, np.nan)
+    done = np.zeros(arrivals.shape, dtype=bool)
+    
+    preemptable = (scheduler_kind != SchedulingQuestion.Kind.FIFO and scheduler_kind != SchedulingQuestion.Kind.ShortestDuration)
+    
+    while not done.all():
+      finished = done.all(axis=1)
+      arrived = (arrivals <= curr_time[:, None])
+      active = arrived & ~done
+      next_arrival = np.where(arrived, np.inf, arrivals).min(axis=1)
+      num_active = active.sum(axis=1)
+      
+      if scheduler_kind == SchedulingQuestion.Kind.RoundRobin:
+        # Processor sharing: every job in the system gets an equal share
+        to_completion = np.where(
+          num_active > 0,
+          np.where(active, remaining, np.inf).min(axis=1) * np.maximum(num_active, 1),
+          np.inf
+        )
+        time_slice = np.where(finished, 0, np.minimum(to_completion, next_arrival - curr_time))
+        start_time = np.where(active & np.isnan(start_time), curr_time[:, None], start_time)
+        remaining = remaining - np.where(active, (time_slice / np.maximum(num_active, 1))[:, None], 0)
+        curr_time = curr_time + time_slice
+        completed = active & (remaining <= epsilon)
+      else:
+        # Ties go to the lowest job id, which is what argmin does
+        if scheduler_kind == SchedulingQuestion.Kind.ShortestDuration:
+          key = durations
+        elif scheduler_kind == SchedulingQuestion.Kind.ShortestTimeRemaining:
+          key = remaining
+        elif scheduler_kind == SchedulingQuestion.Kind.LIFO:
+          key = -arrivals
+        else:
+          key = arrivals
+        has_job = (num_active > 0)
+        selected = np.where(active, key, np.inf).argmin(axis=1)
+        selected_rows = rows[has_job]
+        
+        first_run = has_job & np.isnan(start_time[rows, selected])
+        start_time[rows[first_run], selected[first_run]] = curr_time[first_run]
+        
+        run_time = np.where(has_job, remaining[rows, selected], np.inf)
+        if preemptable:
+          time_slice = np.minimum(run_time, next_arrival - curr_time)
+        else:
+          time_slice = np.where(has_job, run_time, next_arrival - curr_time)
+        time_slice = np.where(finished, 0, time_slice)
+        remaining[selected_rows, selected[has_job]] -= time_slice[has_job]
+        curr_time = curr_time + time_slice
+        completed = np.zeros(arrivals.shape, dtype=bool)
+        completed[selected_rows, selected[has_job]] = (remaining[selected_rows, selected[has_job]] <= epsilon)
+      
+      end_time = np.where(completed, curr_time[:, None], end_time)
+      done |= completed
     
-    # Special looping behavior for this problem to ensure it will regenerate using the same scheduler.
-    # Otherwise, we end up with the distribution of schedulers being inversely proportional to how good they are
-    if not self.is_interesting():
-      log.debug("Is not interesting, rerunning...")
-      self.instantiate(scheduler_kind=self.SCHEDULER_KIND)
+    return (start_time - arrivals + epsilon), (end_time - arrivals + epsilon)
+  
+  @classmethod
+  def generate_batch(
+      cls,
+      num_variations: int,
+      scheduler_kind: SchedulingQuestion.Kind|None = None,
+      num_jobs = 3,
+      rng: np.random.Generator|None = None,
+      **kwargs
+  ) -> List[SchedulingQuestion]:
+    """
+    Makes `num_variations` interesting questions, picking a scheduler for each (unless one is given).
+    Workloads are sampled and simulated in bulk and only the interesting ones are turned into questions, built from the
+    batch results rather than simulated again, which keep their scheduler and workload.  Extra arguments are passed on
+    to each question.
+    """
+    import numpy as np
+    
+    if rng is None:
+      rng = np.random.default_rng()
+    if isinstance(scheduler_kind, str):
+      scheduler_kind = SchedulingQuestion.Kind[scheduler_kind]
+    
+    if scheduler_kind is not None:
+      counts = {scheduler_kind : num_variations}
+    else:
+      kinds = list(SchedulingQuestion.Kind)
+      counts = collections.Counter(kinds[i] for i in rng.integers(0, len(kinds), num_variations))
+    
+    questions = []
+    for kind, count in counts.items():
+      made = 0
+      while made < count:
+        # Oversample so that one or two rounds are usually enough
+        batch_size = 2 * (count - made) + 16
+        arrivals = rng.integers(0, cls.MAX_ARRIVAL_TIME, size=(batch_size, num_jobs), endpoint=True)
+        durations = rng.integers(cls.MIN_JOB_DURATION, cls.MAX_JOB_DURATION, size=(batch_size, num_jobs), endpoint=True)
+        response, tat = cls.simulate_batch(kind, arrivals, durations)
+        interesting = (tat.sum(axis=1) >= durations.sum(axis=1) * 1.1)
+        
+        batch = zip(
+          arrivals[interesting].tolist(), durations[interesting].tolist(),
+          response[interesting].tolist(), tat[interesting].tolist()
+        )
+        for arrival_list, duration_list, response_list, tat_list in itertools.islice(batch, count - made):
+          questions.append(cls(
+            scheduler_kind=kind,
+            workload=list(zip(arrival_list, duration_list)),
+            results=(response_list, tat_list),
+            **kwargs
+          ))
+          made += 1
+    
+    rng.shuffle(questions)
+    return questions
   
   def get_body_lines(self, output_format: OutputFormat|None = None, *args, **kwargs) -> List[str]:
     
@@ -321,6 +535,7 @@ class SchedulingQuestion(ProcessQuestion):
       image_dir="imgs",
   ) -> List[str]:
     
+    self.simulate_timeline()
     explanation_lines = []
     
     explanation_lines.extend([
@@ -416,13 +631,20 @@ class SchedulingQuestion(ProcessQuestion):
     return explanation_lines
   
   def is_interesting(self) -> bool:
+    # A workload we were given is used as is, so there's no point in asking for another one
+    return self.fixed_workload is not None or self.workload_is_interesting()
+  
+  def workload_is_interesting(self) -> bool:
     duration_sum = sum([self.job_stats[job_id]['duration'] for job_id in self.job_stats.keys()])
     tat_sum = sum([self.job_stats[job_id]['TAT'] for job_id in self.job_stats.keys()])
     return (tat_sum >= duration_sum * 1.1)
   
   
   def make_image(self, image_dir="imgs"):
+    # pyplot takes a good while to import, so only pay for it when we actually draw something
+    import matplotlib.pyplot as plt
     
+    self.simulate_timeline()
     fig, ax = plt.subplots(1, 1)
     
     for x_loc in set([t for job_id in self.job_stats.keys() for t in self.job_stats[job_id]["state_changes"] ]):
@@ -2,21 +2,28 @@
 from __future__ import annotations
 
 import abc
+import ast
+import collections
 import dataclasses
 import datetime
 import enum
+import hashlib
 import importlib
 import itertools
+import json
 import pathlib
 import pkgutil
+import random
 import re
-import pypandoc
 import yaml
-from typing import List, Dict, Any, Tuple
-import canvasapi.course, canvasapi.quiz
-import pytablewriter
+from typing import List, Dict, Any, Tuple, TYPE_CHECKING
 
 from misc import OutputFormat, Answer
+from renderers import Renderer, RendererRegistry
+
+# canvasapi is slow to import and only needed here for annotations, so leave loading it to the code that talks to canvas
+if TYPE_CHECKING:
+  import canvasapi.course, canvasapi.quiz
 
 import logging
 logging.basicConfig()
@@ -24,10 +31,29 @@ log = logging.getLogger(__name__)
 log.setLevel(logging.DEBUG)
 
 
+# Every special character is a single character, so escaping is one str.translate rather than a regex per cell
+TEX_ESCAPES = str.maketrans({
+  '&': r'\&',
+  '%': r'\%',
+  '$': r'\$',
+  '#': r'\#',
+  '_': r'\_',
+  '{': r'\{',
+  '}': r'\}',
+  '~': r'\textasciitilde{}',
+  '^': r'\^{}',
+  '\\': r'\textbackslash{}',
+  '<': r'\textless{}',
+  '>': r'\textgreater{}',
+})
+
+
 @dataclasses.dataclass
 class TableGenerator:
   headers : List[str] = None
   value_matrix : List[List[str]] = None
+  # Lets big tables break across pages (repeating the header on each), which needs the longtable package
+  longtable : bool = False
   
   @staticmethod
   def tex_escape(text):
@@ -35,36 +61,45 @@ class TableGenerator:
         :param text: a plain text message
         :return: the message escaped to appear correctly in LaTeX
     """
-    conv = {
-      '&': r'\&',
-      '%': r'\%',
-      '$': r'\$',
-      '#': r'\#',
-      '_': r'\_',
-      '{': r'\{',
-      '}': r'\}',
-      '~': r'\textasciitilde{}',
-      '^': r'\^{}',
-      '\\': r'\textbackslash{}',
-      '<': r'\textless{}',
-      '>': r'\textgreater{}',
-    }
-    regex = re.compile('|'.join(re.escape(str(key)) for key in sorted(conv.keys(), key = lambda item: - len(item))))
-    return regex.sub(lambda match: conv[match.group()], text)
+    return text.translate(TEX_ESCAPES)
+  
+  @staticmethod
+  def html_cell(value) -> str:
+    return str(value).replace('\n', '<br>')
   
   def generate(self, output_format: OutputFormat) -> str:
     if output_format == OutputFormat.CANVAS:
-      table_writer = pytablewriter.HtmlTableWriter(
-        headers=self.headers,
-        value_matrix=self.value_matrix
-      )
-      table_writer.type_hints = ["str" for _ in range(len(self.value_matrix[0]))]
-      return table_writer.dumps()
+      # The same markup pytablewriter's HtmlTableWriter made, built directly
+      num_columns = max([len(self.headers or [])] + [len(line) for line in self.value_matrix])
+      table_lines = ["<table>"]
+      if self.headers:
+        table_lines.extend([
+          "    <thead>",
+          "        <tr>",
+          *[f"            <th>{self.html_cell(element)}</th>" for element in self.headers],
+          "        </tr>",
+          "    </thead>",
+        ])
+      table_lines.append("    <tbody>")
+      for line in self.value_matrix:
+        table_lines.append("        <tr>")
+        table_lines.extend(
+          f'            <td align="left">{self.html_cell(element)}</td>'
+          for element in list(line) + [""] * (num_columns - len(line))
+        )
+        table_lines.append("        </tr>")
+      table_lines.extend([
+        "    </tbody>",
+        "</table>",
+        ""
+      ])
+      return '\n'.join(table_lines)
     elif output_format == OutputFormat.LATEX:
+      environment = "longtable" if self.longtable else "tabular"
       table_lines = [
         # r"\begin{table}[h!]",
         # r"\centering",
-        r"\begin{tabular}{" + '|c' * len(self.value_matrix[0]) + '|}',
+        r"\begin{" + environment + "}{" + '|c' * len(self.value_matrix[0]) + '|}',
         r"\toprule",
       ]
       if self.headers is not None:
@@ -72,20 +107,32 @@ class TableGenerator:
           ' & '.join([self.tex_escape(element) for element in self.headers]) + r" \\",
           r"\midrule"
         ])
+      if self.longtable:
+        table_lines.append(r"\endhead")
       table_lines.extend([
         ' & '.join([self.tex_escape(element) for element in line]) + r" \\"
         for line in self.value_matrix
       ])
       table_lines.extend([
         r"\bottomrule",
-        r"\end{tabular}"
+        r"\end{" + environment + "}"
       ])
       return '\n'.join(table_lines)
 
 
 class QuestionRegistry:
+  """
+  Question classes by name.  Premade questions are only imported when one of them is first asked for, using a manifest
+  of which module registers which name, so that an exam that only uses FromText doesn't pay for importing matplotlib.
+  The manifest is made by reading (not importing) the premade modules, and cached next to them by a hash of each
+  module's source, so only edited modules ever need reading again.
+  """
   _registry = {}
   _scanned = False
+  _manifest : Dict[str, str]|None = None
+  
+  PREMADE_PACKAGE = "premade_questions"
+  MANIFEST_PATH = pathlib.Path(__file__).parent / PREMADE_PACKAGE / ".registry_manifest.json"
   
   @classmethod
   def register(cls, question_type=None):
@@ -99,24 +146,85 @@ class QuestionRegistry:
   @classmethod
   def create(cls, question_type, **kwargs):
     """Instantiate a registered subclass."""
-    # If we haven't already loaded our premades, do so now
-    if not cls._scanned:
+    # Import just the premade module that defines it, and if the manifest didn't know about it, all of them
+    if question_type.lower() not in cls._registry:
+      module_name = cls.get_manifest().get(question_type.lower())
+      if module_name is not None:
+        importlib.import_module(f"{cls.PREMADE_PACKAGE}.{module_name}")
+    if question_type.lower() not in cls._registry and not cls._scanned:
       cls.load_premade_questions()
     # Check to see if it's in the registry
     if question_type.lower() not in cls._registry:
       raise ValueError(f"Unknown question type: {question_type}")
     
-    return cls._registry[question_type.lower()](**kwargs)
+    new_question = cls._registry[question_type.lower()](**kwargs)
+    # Remember how to build it again, e.g. in a worker process
+    new_question.registry_spec = (question_type, kwargs)
+    return new_question
     
     
+  @classmethod
+  def get_manifest(cls) -> Dict[str, str]:
+    """Registered name -> premade module it is registered in, rereading any module that changed since last time."""
+    if cls._manifest is not None:
+      return cls._manifest
+    
+    try:
+      with open(cls.MANIFEST_PATH) as fid:
+        cached = json.load(fid)
+    except (OSError, ValueError):
+      cached = {}
+    
+    modules = {}
+    for _, module_name, _ in pkgutil.iter_modules([str(cls.MANIFEST_PATH.parent)]):
+      with open(cls.MANIFEST_PATH.parent / f"{module_name}.py", "rb") as fid:
+        source = fid.read()
+      source_hash = hashlib.sha256(source).hexdigest()
+      if cached.get(module_name, {}).get("hash") == source_hash:
+        modules[module_name] = cached[module_name]
+      else:
+        modules[module_name] = {"hash": source_hash, "questions": cls.find_registered(source)}
+    
+    if modules != cached:
+      try:
+        with open(cls.MANIFEST_PATH, "w") as fid:
+          json.dump(modules, fid, indent=2, sort_keys=True)
+      except OSError as e:
+        log.debug(f"Couldn't save the question registry manifest ({e}), it will be rebuilt next time")
+    
+    cls._manifest = {
+      question_type: module_name
+      for module_name, entry in modules.items()
+      for question_type in entry["questions"]
+    }
+    return cls._manifest
+  
+  @staticmethod
+  def find_registered(source: bytes) -> List[str]:
+    """Names that a module's source registers with @QuestionRegistry.register, found without importing it."""
+    names = []
+    for node in ast.walk(ast.parse(source)):
+      if not isinstance(node, ast.ClassDef):
+        continue
+      for decorator in node.decorator_list:
+        if (
+            isinstance(decorator, ast.Call)
+            and isinstance(decorator.func, ast.Attribute) and decorator.func.attr == "register"
+            and isinstance(decorator.func.value, ast.Name) and decorator.func.value.id == "QuestionRegistry"
+        ):
+          if len(decorator.args) > 0 and isinstance(decorator.args[0], ast.Constant) and isinstance(decorator.args[0].value, str):
+            names.append(decorator.args[0].value.lower())
+          else:
+            names.append(node.name.lower())
+    return names
+  
   @classmethod
   def load_premade_questions(cls):
-    package_name = "premade_questions"
-    package_path = pathlib.Path(__file__).parent / package_name
+    package_path = pathlib.Path(__file__).parent / cls.PREMADE_PACKAGE
     
     for _, module_name, _ in pkgutil.iter_modules([str(package_path)]):
       # Import the module
-      module = importlib.import_module(f"{package_name}.{module_name}")
+      module = importlib.import_module(f"{cls.PREMADE_PACKAGE}.{module_name}")
       
       # Find all classes in the module
       # for attr_name in dir(module):
@@ -124,6 +232,7 @@ class QuestionRegistry:
       #   if isinstance(attr, type) and issubclass(attr, Question) and attr is not Question:
       #
       #   #   cls.subclasses[attr_name] = attr
+    cls._scanned = True
 
 
 class Question(abc.ABC):
@@ -131,6 +240,12 @@ class Question(abc.ABC):
   A question base class that will be able to output questions to a variety of formats.
   """
   
+  # Questions that talk to canvas while generating (e.g. to upload images) can't be generated in worker processes
+  NEEDS_CANVAS_TO_GENERATE = False
+  
+  # Variations thrown away as duplicates before being rendered, by question class
+  duplicates_skipped : collections.Counter = collections.Counter()
+  
   class Topic(enum.Enum):
     PROCESS = enum.auto()
     MEMORY = enum.auto()
@@ -172,14 +287,58 @@ class Question(abc.ABC):
     
     self.answers = []
     self.possible_variations = float('inf')
+    
+    # Which markdown renderer to use, set per quiz.  None means the registry default (pandoc)
+    self.renderer : Renderer|None = None
+    
+    # All randomness should come from here, so that a variation can be rebuilt from just its seed.
+    # With an exam seed, each variation is seeded from (exam seed, name, variation index) -- see make_seed
+    self.rng = random.Random()
+    self.exam_seed = kwargs.get("exam_seed", None)
+    self.variation_index = 0
+    self.seed : int|None = None   # seed of the current variation, if it had one
+    
+    # (registered name, kwargs) if this was made through the QuestionRegistry, so it can be rebuilt elsewhere
+    self.registry_spec : Tuple[str, Dict]|None = None
+  
+  @staticmethod
+  def make_seed(exam_seed, question_name: str, variation_index: int) -> int:
+    """A 64-bit seed for one variation of one question on an exam."""
+    digest = hashlib.blake2b(f"{exam_seed}\0{question_name}\0{variation_index}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
   
-  def get__latex(self, *args, **kwargs):
-    question_text, explanation_text, answers = self.generate(OutputFormat.LATEX)
+  def set_seed(self, seed: int):
+    self.seed = seed
+    self.rng.seed(seed)
+  
+  def peek_seed(self) -> int|None:
+    """Seed the next variation will have, without using it up."""
+    if self.exam_seed is None:
+      return None
+    return self.make_seed(self.exam_seed, self.name, self.variation_index)
+  
+  def next_seed(self) -> int|None:
+    """Seed for the next variation, or None if we don't have an exam seed to derive it from."""
+    seed = self.peek_seed()
+    if seed is not None:
+      self.variation_index += 1
+    return seed
+  
+  def get__latex(self, *args, seed: int|None = None, **kwargs):
+    self.refresh(seed=seed)
+    return self.render__latex()
+  
+  def render__latex(self):
+    question_text, explanation_text, answers = self.render(OutputFormat.LATEX)
     return re.sub(r'\[answer.+]', r"\\answerblank{3}", question_text)
 
-  def get__canvas(self, course: canvasapi.course.Course, quiz : canvasapi.quiz.Quiz, *args, **kwargs):
+  def get__canvas(self, course: canvasapi.course.Course, quiz : canvasapi.quiz.Quiz, *args, seed: int|None = None, **kwargs):
+    self.refresh(seed=seed)
+    return self.render__canvas(course, quiz, *args, **kwargs)
+  
+  def render__canvas(self, course: canvasapi.course.Course, quiz : canvasapi.quiz.Quiz, *args, **kwargs):
     
-    question_text, explanation_text, answers = self.generate(OutputFormat.CANVAS, course=course, quiz=quiz)
+    question_text, explanation_text, answers = self.render(OutputFormat.CANVAS, course=course, quiz=quiz)
     
     question_type, answers = self.get_answers(*args, **kwargs)
     return {
@@ -223,7 +382,8 @@ class Question(abc.ABC):
       sorted_keys: List[str] = None,
       add_header_space: bool = False,
       hide_keys: bool = False,
-      html_out = False
+      html_out = False,
+      longtable: bool = False
   ) -> List[str|TableGenerator]:
     
     if sorted_keys is None:
@@ -237,7 +397,9 @@ class Question(abc.ABC):
         value_matrix=[
           ([key] if not hide_keys else []) + [str(d) for d in table_data[key]]
           for key in sorted_keys
-        ])
+        ],
+        longtable=longtable
+      )
     ]
   
   @classmethod
@@ -250,43 +412,54 @@ class Question(abc.ABC):
     pass
   
   @staticmethod
-  def convert_from_lines_to_text(lines, output_format: OutputFormat):
+  def convert_from_lines_to_text(lines, output_format: OutputFormat, renderer: Renderer|None = None):
+    return Question.convert_many_from_lines_to_text([lines], output_format, renderer)[0]
+  
+  @staticmethod
+  def convert_many_from_lines_to_text(list_of_lines, output_format: OutputFormat, renderer: Renderer|None = None) -> List[str]:
+    """
+    Converts several sets of lines at once, so that all of their markdown goes to the renderer as a single batch.
+    """
+    if renderer is None:
+      renderer = RendererRegistry.get_default()
     
-    parts = []
-    curr_part = ""
-    for line in lines:
-      if isinstance(line, TableGenerator):
-        
-        parts.append(
-          pypandoc.convert_text(
-            curr_part,
-            ('html' if output_format == OutputFormat.CANVAS else 'latex'),
-            format='md', extra_args=["-M2GB", "+RTS", "-K64m", "-RTS"]
-          )
-        )
-        curr_part = ""
-        parts.append('\n' + line.generate(output_format) + '\n')
-      else:
-        if output_format == OutputFormat.LATEX:
-          line = re.sub(r'\[answer\S+]', r"\\answerblank{3}", line)
-        curr_part += line + '\n'
+    # Split everything into markdown chunks (stored as indices into the batch) and already-rendered tables
+    markdown_chunks = []
+    documents = []
+    for lines in list_of_lines:
+      parts = []
+      curr_part = ""
+      for line in lines:
+        if isinstance(line, TableGenerator):
+          parts.append(len(markdown_chunks))
+          markdown_chunks.append(curr_part)
+          curr_part = ""
+          parts.append('\n' + line.generate(output_format) + '\n')
+        else:
+          if output_format == OutputFormat.LATEX:
+            line = re.sub(r'\[answer\S+]', r"\\answerblank{3}", line)
+          curr_part += line + '\n'
+      parts.append(len(markdown_chunks))
+      markdown_chunks.append(curr_part)
+      documents.append(parts)
     
-    parts.append(
-      pypandoc.convert_text(
-        curr_part,
-        ('html' if output_format == OutputFormat.CANVAS else 'latex'),
-        format='md', extra_args=["-M2GB", "+RTS", "-K64m", "-RTS"]
-      )
-    )
-    body = '\n'.join(parts)
-    if output_format == OutputFormat.LATEX:
-      body = re.sub(r'\[answer\S+]', r"\\answerblank{3}", body)
-    return body
+    rendered_chunks = renderer.convert_batch([(chunk, output_format) for chunk in markdown_chunks])
+    
+    bodies = []
+    for parts in documents:
+      body = '\n'.join([
+        (rendered_chunks[part] if isinstance(part, int) else part)
+        for part in parts
+      ])
+      if output_format == OutputFormat.LATEX:
+        body = re.sub(r'\[answer\S+]', r"\\answerblank{3}", body)
+      bodies.append(body)
+    return bodies
   
   def get_body(self, output_format:OutputFormat):
     # lines should be in markdown
     lines = self.get_body_lines()
-    return self.convert_from_lines_to_text(lines, output_format)
+    return self.convert_from_lines_to_text(lines, output_format, self.renderer)
     
   def get_explanation_lines(self, *args, **kwargs) -> List[str]:
     log.warning("get_explanation using default implementation!  Consider implementing!")
@@ -295,7 +468,7 @@ class Question(abc.ABC):
   def get_explanation(self, output_format:OutputFormat, *args, **kwargs):
     # lines should be in markdown
     lines = self.get_explanation_lines(*args, **kwargs)
-    return self.convert_from_lines_to_text(lines, output_format)
+    return self.convert_from_lines_to_text(lines, output_format, self.renderer)
   
   def get_answers(self, *args, **kwargs) -> Tuple[Answer.AnswerKind, List[Dict[str,Any]]]:
     # log.warning("get_answers using default implementation!  Consider implementing!")
@@ -308,20 +481,89 @@ class Question(abc.ABC):
     """
     self.answers = []
 
-  def generate(self, output_format: OutputFormat, *args, **kwargs):
+  def refresh(self, *args, seed: int|None = None, **kwargs) -> str:
+    """Makes a new variation, without rendering anything, and returns its fingerprint."""
+    # Seed first so that the whole variation (including any retries for interestingness) follows from the seed
+    if seed is None:
+      seed = self.next_seed()
+    if seed is not None:
+      self.set_seed(seed)
+    
     # Renew the problem as appropriate
     self.instantiate()
     while (not self.is_interesting()):
       log.debug("Still not interesting...")
       self.instantiate()
     
+    return self.get_fingerprint()
+  
+  def get_parameter_key(self) -> Tuple|None:
+    """
+    Cheap canonical key for the current variation (e.g. the values instantiate picked), so that two variations
+    with the same key are the same question.  Questions without one are fingerprinted from their unrendered body.
+    """
+    return None
+  
+  def get_fingerprint_parts(self) -> List:
+    """What pins down the current variation: the parameter key if there is one, else the unrendered body and the answers."""
+    parameter_key = self.get_parameter_key()
+    if parameter_key is not None:
+      # Questions in a quiz share a set of fingerprints, so keep different classes with similar parameters apart
+      return [self.__class__.__name__, parameter_key]
+    return [*self.get_body_lines(), *((answer.key, answer.value) for answer in self.answers)]
+  
+  def get_fingerprint(self) -> str:
+    """
+    128-bit digest of the current variation, taken before rendering so that duplicates can be thrown away
+    without paying for pandoc.
+    """
+    # Some questions draw more random values as they lay out their body, so put the rng back for render to redo it
+    rng_state = self.rng.getstate()
+    digest = hashlib.blake2b(digest_size=16)
+    for part in self.get_fingerprint_parts():
+      digest.update(self.canonical_repr(part).encode("utf-8"))
+      digest.update(b"\0")
+    self.rng.setstate(rng_state)
+    return digest.hexdigest()
+  
+  @classmethod
+  def canonical_repr(cls, value) -> str:
+    """repr, except that sets are sorted, since their order changes with the hash seed of each run."""
+    if isinstance(value, (set, frozenset)):
+      return "{" + ", ".join(sorted(cls.canonical_repr(v) for v in value)) + "}"
+    if isinstance(value, dict):
+      return "{" + ", ".join(f"{cls.canonical_repr(k)}: {cls.canonical_repr(v)}" for k, v in value.items()) + "}"
+    if isinstance(value, (list, tuple)):
+      return type(value).__name__ + "(" + ", ".join(cls.canonical_repr(v) for v in value) + ")"
+    return repr(value)
+  
+  def record_duplicate(self):
+    self.duplicates_skipped[self.__class__.__name__] += 1
+  
+  @classmethod
+  def describe_duplicates(cls):
+    if cls.duplicates_skipped:
+      log.info("Duplicates skipped before rendering: " + ", ".join(f"{name}: {count}" for name, count in cls.duplicates_skipped.most_common()))
+  
+  def generate(self, output_format: OutputFormat, *args, seed: int|None = None, **kwargs):
+    self.refresh(seed=seed)
+    return self.render(output_format, *args, **kwargs)
+  
+  def render(self, output_format: OutputFormat, *args, **kwargs):
+    """Renders the current variation, returning its body, explanation and answers."""
     question_body = self.get_header(output_format)
     question_explanation = ""
     
     # Generation body and explanation based on the output format
     if output_format == OutputFormat.CANVAS:
-      question_body += self.get_body(output_format)
-      question_explanation = pypandoc.convert_text(self.get_explanation(output_format, *args, **kwargs), 'html', format='md', extra_args=["-M2GB", "+RTS", "-K64m", "-RTS"])
+      # Render the body and explanation together so the renderer gets a single batch
+      renderer = self.renderer if self.renderer is not None else RendererRegistry.get_default()
+      body, question_explanation = self.convert_many_from_lines_to_text(
+        [self.get_body_lines(), self.get_explanation_lines(*args, **kwargs)],
+        output_format,
+        renderer
+      )
+      question_body += body
     elif output_format == OutputFormat.LATEX:
       question_body += self.get_body(output_format)
     question_body += self.get_footer(output_format)
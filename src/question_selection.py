@@ -0,0 +1,151 @@
+#!env python
+from __future__ import annotations
+
+import collections
+import fractions
+import math
+import random
+from typing import List, Dict, Sequence, TypeVar
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+T = TypeVar("T")
+
+
+class PointTotalSolver:
+  """
+  Picks a uniformly random subset of questions whose points add up to a target.
+  Questions are grouped by point value, and a DP over those groups counts how many subsets reach each total
+  (picking k of the m questions worth v points can be done C(m, k) ways).
+  We then walk back through the table choosing how many to take from each group in proportion to the number of
+  subsets that choice leads to, which makes every matching subset equally likely.
+  Work is O(groups * target * largest group), so a pool of hundreds of questions is fine.
+  """
+
+  def __init__(self, questions: Sequence[T], max_denominator: int = 1000):
+    self.questions = list(questions)
+
+    # Point values may be fractional (e.g. 2.5), so scale everything up to integers
+    values = [fractions.Fraction(q.points_value).limit_denominator(max_denominator) for q in self.questions]
+    self.scale = math.lcm(*[v.denominator for v in values]) if values else 1
+
+    self.groups : Dict[int, List[T]] = collections.defaultdict(list)
+    for question, value in zip(self.questions, values):
+      if value < 0:
+        raise ValueError(f"Cannot select questions with negative points ({question.points_value})")
+      self.groups[int(value * self.scale)].append(question)
+    self.values = sorted(self.groups.keys())
+
+    self.target = None
+    self.ways = None
+
+  def to_units(self, points) -> int|None:
+    units = fractions.Fraction(points).limit_denominator(1000 * self.scale) * self.scale
+    if units.denominator != 1 or units < 0:
+      return None
+    return int(units)
+
+  def build_table(self, target: int):
+    # ways[i][s] is the number of subsets of the first i point groups that add up to s
+    ways = [[0] * (target + 1)]
+    ways[0][0] = 1
+    for value in self.values:
+      previous = ways[-1]
+      count = len(self.groups[value])
+      current = [0] * (target + 1)
+      for total in range(target + 1):
+        if previous[total] == 0:
+          continue
+        for k in range(count + 1):
+          new_total = total + k * value
+          if new_total > target:
+            break
+          current[new_total] += math.comb(count, k) * previous[total]
+      ways.append(current)
+    self.target = target
+    self.ways = ways
+
+  def count_solutions(self, points) -> int:
+    """Number of distinct subsets adding up to exactly `points`."""
+    target = self.to_units(points)
+    if target is None:
+      return 0
+    if self.target is None or self.target < target:
+      self.build_table(target)
+    return self.ways[-1][target]
+
+  def sample(self, points, rng: random.Random|None = None) -> List[T]|None:
+    """Returns a uniformly random subset adding up to exactly `points`, or None if there isn't one."""
+    if rng is None:
+      rng = random
+    num_solutions = self.count_solutions(points)
+    if num_solutions == 0:
+      return None
+
+    picked = []
+    remaining = self.to_units(points)
+    for i in reversed(range(len(self.values))):
+      value = self.values[i]
+      group = self.groups[value]
+      # Choose how many to take from this group, weighted by how many subsets each choice leaves possible
+      choice = rng.randrange(self.ways[i + 1][remaining])
+      for k in range(len(group) + 1):
+        if k * value > remaining:
+          break
+        weight = math.comb(len(group), k) * self.ways[i][remaining - k * value]
+        if choice < weight:
+          break
+        choice -= weight
+      picked.extend(rng.sample(group, k))
+      remaining -= k * value
+    return picked
+
+
+def select_questions(
+    questions: Sequence[T],
+    total_points,
+    exam_outline: List[Dict]|None = None,
+    rng: random.Random|None = None,
+    max_attempts: int = 100
+) -> List[T]:
+  """
+  Picks questions adding up to `total_points`.
+  Each entry in the exam outline picks "num_to_pick" questions matching its "filters" first, and the rest of the
+  points are filled in with a uniformly random subset of whatever is left.
+  If the outline's picks leave a total that can't be made up, we redraw them (up to `max_attempts` times).
+  If nothing works we fall back to just the outline's picks, as the old combination search did, and warn about it.
+  """
+  if rng is None:
+    rng = random
+
+  for attempt in range(max_attempts):
+    questions_picked = []
+    possible_questions = list(questions)
+
+    for requirements in (exam_outline or []):
+      appropriate_questions = [
+        q for q in possible_questions
+        if all(getattr(q, attr_name) == attr_val for (attr_name, attr_val) in requirements["filters"].items())
+      ]
+      picked = rng.sample(appropriate_questions, min(requirements["num_to_pick"], len(appropriate_questions)))
+      questions_picked.extend(picked)
+      possible_questions = [q for q in possible_questions if q not in picked]
+
+    num_points_left = total_points - sum(q.points_value for q in questions_picked)
+    remaining_set = PointTotalSolver(possible_questions).sample(num_points_left, rng)
+    if remaining_set is not None:
+      return questions_picked + remaining_set
+
+    if not exam_outline:
+      # Nothing else we could redraw
+      break
+    log.debug(f"Outline picks left {num_points_left} points that can't be made up, redrawing ({attempt+1} / {max_attempts})")
+
+  log.warning(
+    f"No set of questions adds up to {total_points} points, "
+    f"using only the outline's picks ({sum(q.points_value for q in questions_picked)} points)"
+  )
+  return questions_picked
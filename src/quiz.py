@@ -1,22 +1,33 @@
 #!env python
 from __future__ import annotations
 
+import sys
+# This has to start before anything else is imported, so it can't wait for the arguments to be parsed
+if "--profile-startup" in sys.argv or "--profile_startup" in sys.argv:
+  import startup_profile
+  startup_profile.start()
+
 import argparse
 import collections
-import itertools
+import concurrent.futures
 import logging
 import os.path
 import random
 import shutil
-import subprocess
-import tempfile
 from typing import List, Dict
 
 import yaml
 
-import canvas_interface
+import question_selection
+from build_cache import BuildCache
+from exam_constraints import ExamComposer, ExamConstraints
+from generation import GenerationScheduler, render_variation
+from latex_build import LatexBuildFarm, CompileResult, LATEX_JOBS
 from misc import OutputFormat
 from question import Question, QuestionRegistry
+from renderers import RendererRegistry, CachingRenderer, RenderCache
+from upload_journal import UploadJournal
+from variation_bank import VariationBank
 
 logging.basicConfig()
 log = logging.getLogger(__name__)
@@ -35,6 +46,30 @@ class Quiz:
     self.instructions = kwargs.get("instructions", "")
     self.question_sort_order = None
     self.practice = practice
+    self.num_pdfs = 0
+    # Fingerprints of banked variations already used in one of our pdfs, so each pdf draws different ones
+    self.used_variations : Dict[tuple, set] = collections.defaultdict(set)
+    self.constraints : ExamConstraints|None = kwargs.get("constraints", None)
+    
+    # With a seed, question selection and every question variation are reproducible
+    self.seed = kwargs.get("seed", None)
+    self.rng = random.Random(self.seed)
+    
+    # Markdown rendering backend shared by all of this quiz's questions.
+    # This can either be just the name of the renderer or a dictionary with a "name" and its options (e.g. "workers")
+    self.renderer_options = kwargs.get("renderer", None)
+    self.render_cache_dir = kwargs.get("render_cache_dir", None)
+    renderer = RendererRegistry.create_from_options(self.renderer_options)
+    # Rendering is deterministic, so always cache in memory, and on disk if we were given somewhere to put it
+    self.renderer = CachingRenderer(renderer, RenderCache(cache_dir=self.render_cache_dir))
+    occurrences = collections.Counter()
+    for question in self.possible_questions:
+      if isinstance(question, Question):
+        question.renderer = self.renderer
+        if self.seed is not None:
+          # Repeats of a question share a name, so tell them apart or they would all get the same variations
+          question.exam_seed = self.seed if occurrences[question.name] == 0 else (self.seed, occurrences[question.name])
+          occurrences[question.name] += 1
     
     # Plan: right now we just take in questions and then assume they have a score and a "generate" button
   
@@ -59,77 +94,83 @@ class Quiz:
     for topic in sort_order:
       log.info(f"{topic} : {sum(map(lambda q: q.points_value, filter(lambda q: q.kind == topic, self.questions)))} points")
     
+    self.renderer.describe()
+    
   def select_questions(self, total_points=None, exam_outline: List[Dict]=None):
     # The exam_outline object should contain a description of the kinds of questions that we want.
     # It will be a list of dictionaries that has "num questions" and then the appropriate filters.
     # We will walk through it and pick an appropriate set of questions, ensuring that we only select each once (unless we can pick more than once)
     # After we've gone through all the rules, we can backfill with whatever is left
 
+    if total_points is None and exam_outline is None and self.constraints is not None:
+      # Raises InfeasibleConstraints saying what can't be satisfied
+      self.questions = ExamComposer(self.possible_questions, self.constraints).compose(self.rng)
+      return
+    
     if total_points is None:
       self.questions = self.possible_questions
       return
     
-    questions_picked = set()
-    
-    possible_questions = set(self.possible_questions)
+    # Outline picks come first, then the remaining points are made up by a uniformly random subset of the rest
+    questions_picked = question_selection.select_questions(self.possible_questions, total_points, exam_outline, rng=self.rng)
+    if not questions_picked:
+      raise ValueError(f"Cannot pick any questions for {total_points} points from the {len(self.possible_questions)} available")
+    log.debug(f"Selected {len(questions_picked)} questions ({sum(map(lambda q: q.points_value, questions_picked))}points)")
+    self.questions = questions_picked
+  
+  def select_versions(self, num_versions) -> List[List[Question]]:
+    """Picks questions for several versions of the exam, spreading questions across versions as evenly as the constraints allow."""
+    if self.constraints is None:
+      return [self.questions for _ in range(num_versions)]
+    return ExamComposer(self.possible_questions, self.constraints).compose_versions(num_versions, self.rng)
+  
+  def get_latex(
+      self,
+      scheduler: GenerationScheduler|None = None,
+      bank: VariationBank|None = None,
+      cache: BuildCache|None = None
+  ) -> str:
+    text = self.get_header(OutputFormat.LATEX) + "\n\n"
+    questions = list(self)
+    question_blocks = [None for _ in questions]
     
-    if exam_outline is not None:
-      for requirements in exam_outline:
-        # Filter out to only get appropriate questions
-        log.debug(requirements["filters"])
-        appropriate_questions = list(filter(
-          lambda q: all([getattr(q, attr_name) == attr_val for (attr_name, attr_val) in requirements["filters"].items()]),
-          possible_questions
-        ))
-        
-        log.debug(f"{len(appropriate_questions)} appropriate questions")
-        
-        # Pick the appropriate number of questions
-        questions_picked.update(
-          random.sample(appropriate_questions, min(requirements["num_to_pick"], len(appropriate_questions)))
-        )
-        
-        # Remove any questions that were just picked so we don't pick them again
-        possible_questions = set(possible_questions).difference(set(questions_picked))
-        
-    log.debug(f"Selected due to filters: {len(questions_picked)} ({sum(map(lambda q: q.points_value, questions_picked))}points)")
+    # Take variations from the bank where we can, and only generate what it can't give us
+    if bank is not None:
+      for i, question in enumerate(questions):
+        key = bank.get_key(question, OutputFormat.LATEX)
+        if key is None:
+          continue
+        fingerprint, question_blocks[i] = next(bank.draw(question, OutputFormat.LATEX, self.used_variations[key]), (None, None))
+        if fingerprint is not None:
+          self.used_variations[key].add(fingerprint)
     
-    if total_points is not None:
-      # Figure out how many points we have left to select
-      num_points_left = total_points - sum(map(lambda q: q.points_value, questions_picked))
-      
-      
-      # To pick the remaining points, we want to take our remaining questions and select a subset that adds up to the required number of points
-  
-      # Find all combinations of objects that match the target value
-      log.debug("Finding all matching sets...")
-      matching_sets = []
-      for r in range(1, len(possible_questions) + 1):
-        for combo in itertools.combinations(possible_questions, r):
-          if sum(q.points_value for q in combo) == num_points_left:
-            matching_sets.append(combo)
-            if len(matching_sets) > 1000:
-              break
-        if len(matching_sets) > 1000:
-          break
-      
-      # Pick a random matching set
-      if matching_sets:
-        random_set = random.choice(matching_sets)
-      else:
-        log.error("Cannot find any matching sets")
-        random_set = []
+    # Then reuse whatever an earlier build already generated from the same seed
+    if cache is not None:
+      for i, question in enumerate(questions):
+        if question_blocks[i] is None:
+          question_blocks[i] = cache.get_block(question, question.peek_seed())
+          if question_blocks[i] is not None:
+            # Use up the seed, so the questions after it get the same variations as when it was generated
+            question.next_seed()
     
-      questions_picked.update(random_set)
+    to_generate = [i for i, block in enumerate(question_blocks) if block is None]
+    if scheduler is not None:
+      generated = scheduler.generate_each([questions[i] for i in to_generate], OutputFormat.LATEX)
     else:
-      # todo: I know this snippet is repeated.  Oh well.
-      questions_picked = self.possible_questions
-    self.questions = questions_picked
-  
-  def get_latex(self) -> str:
-    text = self.get_header(OutputFormat.LATEX) + "\n\n"
-    for question in self:
-      text += question.get__latex() + "\n\n"
+      generated = [render_variation(questions[i], OutputFormat.LATEX, questions[i].next_seed()) for i in to_generate]
+    for i, variation in zip(to_generate, generated):
+      question_blocks[i] = variation.rendered
+      if cache is not None:
+        cache.put_block(questions[i], variation.seed, variation.rendered)
+      if bank is not None:
+        # Bank it for next time, and make sure another pdf in this run doesn't draw it from the bank
+        key = bank.get_key(questions[i], OutputFormat.LATEX)
+        if key is not None:
+          bank.put(questions[i], OutputFormat.LATEX, variation.seed, variation.rendered, variation.fingerprint)
+          self.used_variations[key].add(variation.fingerprint)
+    
+    for question_block in question_blocks:
+      text += question_block + "\n\n"
     text += self.get_footer(OutputFormat.LATEX)
     return text
   
@@ -174,6 +215,8 @@ class Quiz:
         
         
         
+        # Everything above is shared between quizzes, so it can go in a precompiled preamble
+        r"\csname endofdump\endcsname",
         r"\title{" + self.name + r"}",
         
         r"\begin{document}",
@@ -208,7 +251,11 @@ class Quiz:
     self.question_sort_order = sort_order
 
   @classmethod
-  def from_yaml(cls, path_to_yaml) -> List[Quiz]:
+  def from_yaml(cls, path_to_yaml, seed=None, pick_all=False) -> List[Quiz]:
+    """
+    :param seed: overrides any "seed" in the yaml
+    :param pick_all: keep every option of a "pick" rather than choosing among them (e.g. to fill a variation bank)
+    """
     
     quizes_loaded : List[Quiz] = []
     
@@ -220,6 +267,13 @@ class Quiz:
       # Get general quiz information from the dictionary
       name = exam_dict.get("name", "Unnamed Exam")
       practice = exam_dict.get("practice", False)
+      renderer = exam_dict.get("renderer", None)
+      render_cache_dir = exam_dict.get("render cache", None)
+      constraints = exam_dict.get("constraints", None)
+      exam_seed = seed if seed is not None else exam_dict.get("seed", None)
+      rng = random.Random(exam_seed)
+      if constraints is not None:
+        constraints = ExamConstraints.from_yaml(constraints)
       sort_order = list(map(lambda t: Question.Topic.from_string(t), exam_dict.get("sort order", [])))
       sort_order = sort_order + list(filter(lambda t: t not in sort_order, Question.Topic))
       
@@ -250,9 +304,10 @@ class Quiz:
           if "pick" in q_data:
             num_to_pick = q_data["pick"]
             del q_data["pick"]
+            options = list(q_data.items())
             questions_for_exam.extend(
               make_question(name, data) for name, data in
-              random.sample(list(q_data.items()), num_to_pick)
+              (options if pick_all else rng.sample(options, num_to_pick))
             )
           else:
             questions_for_exam.extend([
@@ -261,42 +316,42 @@ class Quiz:
             ]
             )
           
-      quiz_from_yaml = Quiz(name, questions_for_exam, practice)
+      quiz_from_yaml = Quiz(
+        name,
+        questions_for_exam,
+        practice,
+        renderer=renderer,
+        render_cache_dir=render_cache_dir,
+        constraints=constraints,
+        seed=exam_seed
+      )
       quiz_from_yaml.set_sort_order(sort_order)
       quizes_loaded.append(quiz_from_yaml)
     return quizes_loaded
 
-  def generate_latex(self, remove_previous=False):
+  def generate_latex(
+      self,
+      remove_previous=False,
+      scheduler: GenerationScheduler|None = None,
+      bank: VariationBank|None = None,
+      farm: LatexBuildFarm|None = None,
+      cache: BuildCache|None = None
+  ) -> concurrent.futures.Future[CompileResult]:
+    """Builds a pdf of the quiz in out/, in the background if given a farm to compile it on."""
     
     if remove_previous:
       if os.path.exists('out'): shutil.rmtree('out')
     
-    tmp_tex = tempfile.NamedTemporaryFile('w')
+    latex = self.get_latex(scheduler, bank, cache)
+    with open("debug.tex", "w") as fid:
+      fid.write(latex)
     
-    tmp_tex.write(self.get_latex())
-    tmp_tex.flush()
-    tmp_tex.flush()
-    shutil.copy(f"{tmp_tex.name}", "debug.tex")
-    p = subprocess.Popen(
-      f"latexmk -pdf -output-directory={os.path.join(os.getcwd(), 'out')} {tmp_tex.name}",
-      shell=True,
-      stdout=subprocess.PIPE,
-      stderr=subprocess.PIPE)
-    try:
-      p.wait(30)
-    except subprocess.TimeoutExpired:
-      logging.error("Latex Compile timed out")
-      p.kill()
-      tmp_tex.close()
-      return
-    proc = subprocess.Popen(
-      f"latexmk -c {tmp_tex.name} -output-directory={os.path.join(os.getcwd(), 'out')}",
-      shell=True,
-      stdout=subprocess.PIPE,
-      stderr=subprocess.PIPE
-    )
-    proc.wait(timeout=30)
-    tmp_tex.close()
+    name = f"{self.name} {self.num_pdfs}"
+    self.num_pdfs += 1
+    if farm is not None:
+      return farm.submit(name, latex)
+    with LatexBuildFarm(jobs=1, cache=cache) as farm:
+      return farm.submit(name, latex)
     
   
 def parse_args():
@@ -308,6 +363,16 @@ def parse_args():
   parser.add_argument("--quiz_yaml", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "../example_files/exam.yaml"))
   parser.add_argument("--num_canvas", default=0, type=int)
   parser.add_argument("--num_pdfs", default=0, type=int)
+  parser.add_argument("--upload_concurrency", default=None, type=int, help="How many questions to upload to canvas at once (defaults to canvas_interface.UPLOAD_CONCURRENCY)")
+  parser.add_argument("--resume", action="store_true", help="Continue the last push of this quiz, only uploading what is missing")
+  parser.add_argument("--journal", default=None, help="Where to keep the upload journal (defaults to next to the quiz yaml)")
+  parser.add_argument("--jobs", default=1, type=int, help="How many processes to generate variations with")
+  parser.add_argument("--latex_jobs", default=LATEX_JOBS, type=int, help="How many pdfs to compile at once")
+  parser.add_argument("--precompile_preamble", action="store_true", help="Compile pdfs against a cached, precompiled preamble (needs mylatexformat)")
+  parser.add_argument("--seed", default=None, type=int, help="Exam seed, making question selection and every variation reproducible (overrides the yaml)")
+  parser.add_argument("--bank", nargs="?", const="", default=None, help="Draw variations from (and add new ones to) a variation bank, next to the quiz yaml unless a path is given")
+  parser.add_argument("--profile_startup", "--profile-startup", action="store_true", help="Report how long importing each module took, up to having loaded the quizzes")
+  parser.add_argument("--incremental", nargs="?", const="", default=None, help="Only regenerate questions and recompile pdfs that changed since the last build, caching them next to the quiz yaml unless a path is given")
   
   args = parser.parse_args()
   return args
@@ -316,22 +381,58 @@ def main():
   
   args = parse_args()
   
-  quizzes = Quiz.from_yaml(args.quiz_yaml)
+  quizzes = Quiz.from_yaml(args.quiz_yaml, seed=args.seed)
+  if args.profile_startup:
+    startup_profile.report()
+  bank = None
+  if args.bank is not None:
+    bank = VariationBank(args.bank or VariationBank.get_path_for_yaml(args.quiz_yaml))
+  cache = None
+  if args.incremental is not None:
+    cache = BuildCache(args.incremental or BuildCache.get_path_for_yaml(args.quiz_yaml))
   for quiz in quizzes:
     quiz.select_questions()
     
     for q in quiz:
       log.debug(q.kind)
     
-    for i in range(args.num_pdfs):
-      quiz.generate_latex(remove_previous=(i==0))
+    scheduler = GenerationScheduler(args.jobs, quiz.renderer_options, quiz.render_cache_dir)
+    
+    # With constraints every pdf gets its own version of the exam
+    versions = quiz.select_versions(args.num_pdfs) if quiz.constraints is not None else None
+    with LatexBuildFarm(jobs=args.latex_jobs, precompile_preamble=args.precompile_preamble, cache=cache) as farm:
+      for i in range(args.num_pdfs):
+        if versions is not None:
+          quiz.questions = versions[i]
+        quiz.generate_latex(remove_previous=(i==0), scheduler=scheduler, bank=bank, farm=farm, cache=cache)
+      farm.describe(farm.wait())
     
     if args.num_canvas > 0:
+      # Only canvas pushes need canvasapi and friends, so don't make pdf-only runs wait for them
+      import canvas_interface
       interface = canvas_interface.CanvasInterface(prod=args.prod, course_id=args.course_id)
-      interface.push_quiz_to_canvas(quiz, args.num_canvas, title=quiz.name, is_practice=quiz.practice)
+      journal = UploadJournal(args.journal or UploadJournal.get_path_for_yaml(args.quiz_yaml))
+      interface.push_quiz_to_canvas(
+        quiz,
+        args.num_canvas,
+        title=quiz.name,
+        is_practice=quiz.practice,
+        upload_concurrency=args.upload_concurrency or canvas_interface.UPLOAD_CONCURRENCY,
+        journal=journal,
+        resume=args.resume,
+        scheduler=scheduler,
+        bank=bank
+      )
+      journal.close()
     
+    scheduler.close()
     quiz.describe()
   
+  if cache is not None:
+    cache.describe()
+  if bank is not None:
+    bank.close()
+  
   
 
 if __name__ == "__main__":
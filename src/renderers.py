@@ -0,0 +1,693 @@
+#!env python
+from __future__ import annotations
+
+import abc
+import atexit
+import collections
+import concurrent.futures
+import hashlib
+import html
+import inspect
+import json
+import os
+import re
+import socket
+import subprocess
+import time
+import urllib.error
+import urllib.request
+from typing import List, Tuple
+
+
+from misc import OutputFormat
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+class RendererRegistry:
+  _registry = {}
+  _default = "pandoc"
+  _default_renderer = None
+
+  @classmethod
+  def register(cls, renderer_name=None):
+    def decorator(subclass):
+      name = renderer_name.lower() if renderer_name else subclass.NAME.lower()
+      cls._registry[name] = subclass
+      return subclass
+    return decorator
+
+  @classmethod
+  def create(cls, renderer_name=None, **kwargs) -> Renderer:
+    if renderer_name is None:
+      renderer_name = cls._default
+    if renderer_name.lower() not in cls._registry:
+      raise ValueError(f"Unknown renderer: {renderer_name}")
+    return cls._registry[renderer_name.lower()](**kwargs)
+
+  @classmethod
+  def create_from_options(cls, renderer_options=None) -> Renderer:
+    """`renderer_options` is either just the name of the renderer or a dictionary with a "name" and its options (e.g. "workers")"""
+    if isinstance(renderer_options, dict):
+      renderer_options = dict(renderer_options)
+      return cls.create(renderer_options.pop("name", None), **renderer_options)
+    return cls.create(renderer_options)
+
+  @classmethod
+  def get_default(cls) -> Renderer:
+    # The default renderer is shared, since most renderers are stateless (or expensive to start)
+    if cls._default_renderer is None:
+      cls._default_renderer = CachingRenderer(cls.create())
+    return cls._default_renderer
+
+
+class Renderer(abc.ABC):
+  """
+  Converts markdown fragments into the markup needed by a given output format.
+  """
+  NAME = None
+
+  # Hashing source is cheap, but there is no need to do it for every fragment
+  code_versions = {}
+
+  @abc.abstractmethod
+  def convert(self, text: str, output_format: OutputFormat) -> str:
+    pass
+
+  def convert_batch(self, fragments: List[Tuple[str, OutputFormat]]) -> List[str]:
+    """
+    Converts a batch of (markdown, output format) fragments, returning the results in the same order.
+    Renderers that can amortize startup or round-trip costs should override this.
+    """
+    return [self.convert(text, output_format) for (text, output_format) in fragments]
+
+  def get_version(self) -> str:
+    """
+    Identifies the output this renderer produces, so cached renders can be invalidated when it changes.
+    By default that is a hash of the source of the renderer's class (and the renderer classes it inherits from), so any
+    edit to how it renders means rendering afresh.
+    """
+    cls = type(self)
+    if cls not in Renderer.code_versions:
+      digest = hashlib.sha256()
+      for c in cls.__mro__:
+        if issubclass(c, Renderer):
+          digest.update(inspect.getsource(c).encode("utf-8"))
+      Renderer.code_versions[cls] = digest.hexdigest()[:16]
+    return f"{self.NAME}-{Renderer.code_versions[cls]}"
+
+  def describe(self):
+    pass
+
+  @staticmethod
+  def pandoc_format(output_format: OutputFormat) -> str:
+    return 'html' if output_format == OutputFormat.CANVAS else 'latex'
+
+
+@RendererRegistry.register()
+class PandocRenderer(Renderer):
+  """
+  Renders through a pandoc subprocess.  This is the reference output the other renderers try to match.
+  """
+  NAME = "pandoc"
+  EXTRA_ARGS = ["-M2GB", "+RTS", "-K64m", "-RTS"]
+
+  def get_version(self) -> str:
+    try:
+      import pypandoc
+      return f"pandoc-{pypandoc.get_pandoc_version()}"
+    except (ImportError, OSError):
+      # Nothing can be rendered without pandoc, so there is nothing cached to tell apart either
+      return "pandoc-unavailable"
+
+  def convert(self, text: str, output_format: OutputFormat) -> str:
+    import pypandoc
+    return pypandoc.convert_text(
+      text,
+      self.pandoc_format(output_format),
+      format='md', extra_args=self.EXTRA_ARGS
+    )
+
+
+@RendererRegistry.register()
+class PandocServerRenderer(Renderer):
+  """
+  Keeps a pool of long-lived `pandoc server` workers around and sends them batches of fragments over HTTP,
+  so converting a whole question (or many) costs one round-trip per worker instead of a fork per fragment.
+  Falls back to plain pandoc subprocesses if the workers can't be started.
+  """
+  NAME = "pandoc-server"
+  STARTUP_TIMEOUT = 10
+  REQUEST_TIMEOUT = 60
+
+  def __init__(self, workers: int = 2, pandoc_path: str = "pandoc", *args, **kwargs):
+    self.num_workers = workers
+    self.pandoc_path = pandoc_path
+    self.worker_processes : List[subprocess.Popen] = []
+    self.worker_urls : List[str] = []
+    self.executor : concurrent.futures.ThreadPoolExecutor|None = None
+    self.fallback : Renderer|None = None
+    self.batch_stats : List[Tuple[int, float]] = [] # (number of fragments, seconds)
+
+  def start(self):
+    if len(self.worker_urls) > 0 or self.fallback is not None:
+      return
+    try:
+      for _ in range(self.num_workers):
+        port = self.get_free_port()
+        process = subprocess.Popen(
+          [self.pandoc_path, "server", "--port", str(port), "+RTS", "-K64m", "-RTS"],
+          stdout=subprocess.DEVNULL,
+          stderr=subprocess.DEVNULL
+        )
+        self.worker_processes.append(process)
+        self.worker_urls.append(f"http://127.0.0.1:{port}")
+      for process, url in zip(self.worker_processes, self.worker_urls):
+        self.wait_for_worker(process, url)
+    except (OSError, TimeoutError) as e:
+      log.warning(f"Could not start pandoc server workers ({e}), falling back to pandoc subprocesses")
+      self.close()
+      self.fallback = PandocRenderer()
+      return
+    
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers)
+    atexit.register(self.close)
+    log.debug(f"Started {self.num_workers} pandoc server workers")
+
+  def close(self):
+    if self.executor is not None:
+      self.executor.shutdown(wait=False)
+      self.executor = None
+    for process in self.worker_processes:
+      process.terminate()
+    self.worker_processes = []
+    self.worker_urls = []
+
+  @staticmethod
+  def get_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+      s.bind(("127.0.0.1", 0))
+      return s.getsockname()[1]
+
+  def wait_for_worker(self, process: subprocess.Popen, url):
+    deadline = time.time() + self.STARTUP_TIMEOUT
+    while time.time() < deadline:
+      if process.poll() is not None:
+        # e.g. a pandoc older than 3.0, which doesn't have server mode
+        raise OSError(f"pandoc server exited with {process.returncode}")
+      try:
+        with urllib.request.urlopen(f"{url}/version", timeout=1):
+          return
+      except (urllib.error.URLError, ConnectionError):
+        time.sleep(0.05)
+    raise TimeoutError(f"pandoc server at {url} did not start")
+
+  def post_batch(self, url, fragments: List[Tuple[str, OutputFormat]]) -> List[str]:
+    request = urllib.request.Request(
+      f"{url}/batch",
+      data=json.dumps([
+        {"text": text, "from": "markdown", "to": self.pandoc_format(output_format)}
+        for (text, output_format) in fragments
+      ]).encode("utf-8"),
+      headers={"Content-Type": "application/json", "Accept": "application/json"}
+    )
+    with urllib.request.urlopen(request, timeout=self.REQUEST_TIMEOUT) as response:
+      results = json.loads(response.read().decode("utf-8"))
+    # Depending on the Accept header, results are either bare strings or {"output": ...} objects
+    return [r["output"] if isinstance(r, dict) else r for r in results]
+
+  def get_version(self) -> str:
+    # The server workers produce the same output as the pandoc binary they come from
+    import pypandoc
+    return f"pandoc-{pypandoc.get_pandoc_version()}"
+
+  def convert(self, text: str, output_format: OutputFormat) -> str:
+    return self.convert_batch([(text, output_format)])[0]
+
+  def convert_batch(self, fragments: List[Tuple[str, OutputFormat]]) -> List[str]:
+    self.start()
+    if self.fallback is not None:
+      return self.fallback.convert_batch(fragments)
+    if len(fragments) == 0:
+      return []
+    
+    start_time = time.perf_counter()
+    
+    # Split the batch into one contiguous chunk per worker so we can reassemble in order
+    chunk_size = -(-len(fragments) // len(self.worker_urls))
+    chunks = [fragments[i:i+chunk_size] for i in range(0, len(fragments), chunk_size)]
+    futures = [
+      self.executor.submit(self.post_batch, url, chunk)
+      for url, chunk in zip(self.worker_urls, chunks)
+    ]
+    results = []
+    for future in futures:
+      results.extend(future.result())
+    
+    elapsed = time.perf_counter() - start_time
+    self.batch_stats.append((len(fragments), elapsed))
+    log.debug(f"Rendered batch of {len(fragments)} fragments in {1000 * elapsed:0.1f}ms")
+    return results
+
+  def describe(self):
+    if len(self.batch_stats) == 0:
+      return
+    total_fragments = sum(n for (n, _) in self.batch_stats)
+    total_time = sum(t for (_, t) in self.batch_stats)
+    latencies = sorted(t for (_, t) in self.batch_stats)
+    log.info(
+      f"{self.NAME}: {len(self.batch_stats)} batches, {total_fragments} fragments, "
+      f"avg {total_fragments / len(self.batch_stats):0.1f} fragments/batch, "
+      f"median {1000 * latencies[len(latencies) // 2]:0.1f}ms/batch, "
+      f"max {1000 * latencies[-1]:0.1f}ms/batch, "
+      f"{1000 * total_time / total_fragments:0.2f}ms/fragment"
+    )
+
+
+@RendererRegistry.register()
+class MarkdownRenderer(Renderer):
+  """
+  In-process renderer for the subset of markdown that our premade questions use:
+  paragraphs, lists, code fences, inline code, emphasis, links/images, `$`/`$$` math, raw HTML and raw LaTeX commands.
+  Anything outside of that subset is handed off to the fallback renderer (pandoc by default).
+  """
+  NAME = "markdown"
+
+  # Constructs we don't try to handle ourselves
+  UNSUPPORTED = re.compile(
+    r"^\s*\|.*\|\s*$"               # pipe tables
+    r"|^\s{0,3}>"                   # block quotes
+    r"|^ {2,}([-*+]|\d+[.)])\s"     # nested lists
+    r"|^\s*(-{3,}|\*{3,}|_{3,})\s*$"  # horizontal rules
+    r"|^\[\^?[^\]]+\]:",            # reference links and footnotes
+    re.MULTILINE
+  )
+
+  FENCE = re.compile(r"^\s*(```|~~~)\s*([\w+-]*)\s*$")
+  HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+  BULLET_ITEM = re.compile(r"^\s?[-*+]\s+(.*)$")
+  ORDERED_ITEM = re.compile(r"^\s?\d+[.)]\s+(.*)$")
+  HTML_BLOCK = re.compile(
+    r"^\s*</?(ol|ul|li|hr|p|div|table|thead|tbody|tr|td|th|pre|blockquote|h[1-6]|br|img|center|figure)\b",
+    re.IGNORECASE
+  )
+
+  INLINE = re.compile(
+    r"(?P<code>`+)(?P<code_text>.+?)(?P=code)"
+    r"|\$\$(?P<display_math>.+?)\$\$"
+    r"|\$(?P<inline_math>[^\s$](?:[^$]*[^\s$])?)\$(?!\d)"
+    r"|(?P<image>!\[(?P<image_alt>[^\]]*)\]\((?P<image_src>[^)\s]+)\))"
+    r"|(?P<link>\[(?P<link_text>[^\]]+)\]\((?P<link_href>[^)\s]+)\))"
+    r"|(?P<html_tag></?[a-zA-Z][a-zA-Z0-9]*(?:\s+[^<>]*)?/?>)"
+    r"|(?P<tex_command>\\[a-zA-Z]+(?:\[[^\]]*\])?(?:\{[^{}]*\})*)"
+    r"|\\(?P<escaped>[!-/:-@\[-`{-~])"
+    r"|\*\*(?P<strong>[^\s*](?:.*?[^\s*])?)\*\*"
+    r"|\*(?P<emphasis>[^\s*](?:.*?[^\s*])?)\*",
+    re.DOTALL
+  )
+
+  LATEX_ESCAPES = {
+    '&': r'\&',
+    '%': r'\%',
+    '$': r'\$',
+    '#': r'\#',
+    '_': r'\_',
+    '{': r'\{',
+    '}': r'\}',
+    '~': r'\textasciitilde{}',
+    '^': r'\^{}',
+    '\\': r'\textbackslash{}',
+    '<': r'\textless{}',
+    '>': r'\textgreater{}',
+  }
+  LATEX_ESCAPE_REGEX = re.compile('|'.join(re.escape(key) for key in LATEX_ESCAPES.keys()))
+
+  # How inline HTML tags translate when we are writing LaTeX.  Unknown tags are dropped, as pandoc does.
+  LATEX_TAGS = {
+    "b": (r"\textbf{", "}"),
+    "strong": (r"\textbf{", "}"),
+    "i": (r"\emph{", "}"),
+    "em": (r"\emph{", "}"),
+    "tt": (r"\texttt{", "}"),
+    "code": (r"\texttt{", "}"),
+    "u": (r"\underline{", "}"),
+  }
+
+  def __init__(self, fallback: Renderer|None = None, *args, **kwargs):
+    self.fallback = fallback
+    self.version = None
+
+  def get_fallback(self) -> Renderer:
+    if self.fallback is None:
+      self.fallback = PandocRenderer()
+    return self.fallback
+
+  def get_version(self) -> str:
+    # Whatever we can't handle comes from the fallback, so a new version of it changes our output too
+    if self.version is None:
+      self.version = f"{super().get_version()}+{self.get_fallback().get_version()}"
+    return self.version
+
+  def convert(self, text: str, output_format: OutputFormat) -> str:
+    if self.UNSUPPORTED.search(text):
+      log.debug("Markdown uses unsupported syntax, falling back")
+      return self.get_fallback().convert(text, output_format)
+
+    rendered_blocks = []
+    for block in self.parse_blocks(text):
+      if output_format == OutputFormat.CANVAS:
+        rendered_blocks.append(self.render_block_html(block))
+      else:
+        rendered_blocks.append(self.render_block_latex(block))
+    return '\n'.join(rendered_blocks) + '\n'
+
+  ## Block level parsing
+  def parse_blocks(self, text: str) -> List[Tuple]:
+    blocks = []
+    lines = text.expandtabs(4).split('\n')
+
+    paragraph = []
+    def end_paragraph():
+      if len(paragraph) > 0:
+        blocks.append(("paragraph", '\n'.join(paragraph)))
+        paragraph.clear()
+
+    i = 0
+    while i < len(lines):
+      line = lines[i]
+
+      # Code fences can interrupt paragraphs
+      fence = self.FENCE.match(line)
+      if fence is not None:
+        end_paragraph()
+        code_lines = []
+        i += 1
+        while i < len(lines) and not lines[i].strip().startswith(fence.group(1)):
+          code_lines.append(lines[i])
+          i += 1
+        blocks.append(("code", '\n'.join(code_lines)))
+        i += 1
+        continue
+
+      if line.strip() == "":
+        end_paragraph()
+        i += 1
+        continue
+
+      # Everything else needs to start a new block (i.e. follow a blank line), same as pandoc
+      if len(paragraph) == 0:
+        heading = self.HEADING.match(line)
+        if heading is not None:
+          blocks.append(("heading", len(heading.group(1)), heading.group(2)))
+          i += 1
+          continue
+
+        if self.HTML_BLOCK.match(line):
+          html_lines = []
+          while i < len(lines) and lines[i].strip() != "":
+            html_lines.append(lines[i])
+            i += 1
+          blocks.append(("html", '\n'.join(html_lines)))
+          continue
+
+        for list_kind, item_regex in [("bullet", self.BULLET_ITEM), ("ordered", self.ORDERED_ITEM)]:
+          if item_regex.match(line):
+            items, i = self.parse_list(lines, i, item_regex)
+            blocks.append(("list", list_kind, items))
+            break
+        else:
+          paragraph.append(line.strip())
+          i += 1
+        continue
+
+      paragraph.append(line.strip())
+      i += 1
+    end_paragraph()
+    return blocks
+
+  def parse_list(self, lines: List[str], i: int, item_regex: re.Pattern) -> Tuple[List[str], int]:
+    items = []
+    while i < len(lines):
+      line = lines[i]
+      item = item_regex.match(line)
+      if item is not None:
+        items.append([item.group(1).strip()])
+      elif line.strip() == "":
+        # A blank line only continues the list if another item follows it
+        j = i
+        while j < len(lines) and lines[j].strip() == "":
+          j += 1
+        if j < len(lines) and item_regex.match(lines[j]):
+          i = j
+          continue
+        break
+      elif self.FENCE.match(line):
+        break
+      else:
+        # Lazy continuation of the previous item
+        items[-1].append(line.strip())
+      i += 1
+    return ['\n'.join(item) for item in items], i
+
+  ## HTML output
+  def render_block_html(self, block) -> str:
+    kind = block[0]
+    if kind == "paragraph":
+      return f"<p>{self.render_inline(block[1], OutputFormat.CANVAS)}</p>"
+    elif kind == "heading":
+      return f"<h{block[1]}>{self.render_inline(block[2], OutputFormat.CANVAS)}</h{block[1]}>"
+    elif kind == "code":
+      return f"<pre><code>{html.escape(block[1], quote=False)}</code></pre>"
+    elif kind == "html":
+      # Tags pass through untouched, but any markdown mixed in (e.g. images) still gets rendered
+      return self.render_inline(block[1], OutputFormat.CANVAS)
+    elif kind == "list":
+      tag = "ul" if block[1] == "bullet" else "ol"
+      return '\n'.join(
+        [f"<{tag}>"]
+        + [f"<li>{self.render_inline(item, OutputFormat.CANVAS)}</li>" for item in block[2]]
+        + [f"</{tag}>"]
+      )
+
+  ## LaTeX output
+  def render_block_latex(self, block) -> str:
+    kind = block[0]
+    if kind == "paragraph":
+      return self.render_inline(block[1], OutputFormat.LATEX) + '\n'
+    elif kind == "heading":
+      section = ["section", "subsection", "subsubsection", "paragraph", "subparagraph", "subparagraph"][block[1] - 1]
+      return f"\\{section}{{{self.render_inline(block[2], OutputFormat.LATEX)}}}\n"
+    elif kind == "code":
+      return '\n'.join([r"\begin{verbatim}", block[1], r"\end{verbatim}"]) + '\n'
+    elif kind == "html":
+      return self.render_html_block_latex(block[1]) + '\n'
+    elif kind == "list":
+      environment = "itemize" if block[1] == "bullet" else "enumerate"
+      return '\n'.join(
+        [f"\\begin{{{environment}}}", r"\tightlist"]
+        + [f"\\item\n  {self.render_inline(item, OutputFormat.LATEX)}" for item in block[2]]
+        + [f"\\end{{{environment}}}"]
+      ) + '\n'
+
+  def render_html_block_latex(self, text: str) -> str:
+    # Lists are the only block-level HTML we use that is worth translating
+    text = re.sub(r"<ul[^>]*>", r"\\begin{itemize}\n", text, flags=re.IGNORECASE)
+    text = re.sub(r"</ul>", r"\n\\end{itemize}", text, flags=re.IGNORECASE)
+    text = re.sub(r"<ol[^>]*>", r"\\begin{enumerate}\n", text, flags=re.IGNORECASE)
+    text = re.sub(r"</ol>", r"\n\\end{enumerate}", text, flags=re.IGNORECASE)
+    text = re.sub(r"<li[^>]*>", r"\\item ", text, flags=re.IGNORECASE)
+    text = re.sub(r"</li>", "\n", text, flags=re.IGNORECASE)
+
+    # Only render the text between the environments we just made
+    parts = re.split(r"(\\begin\{\w+\}|\\end\{\w+\}|\\item )", text)
+    return ''.join(
+      part if re.fullmatch(r"\\begin\{\w+\}|\\end\{\w+\}|\\item ", part) else self.render_inline(part, OutputFormat.LATEX)
+      for part in parts
+    )
+
+  ## Inline
+  def render_inline(self, text: str, output_format: OutputFormat) -> str:
+    if output_format == OutputFormat.CANVAS:
+      escape = (lambda s: html.escape(s, quote=False))
+    else:
+      escape = (lambda s: self.LATEX_ESCAPE_REGEX.sub(lambda m: self.LATEX_ESCAPES[m.group()], s))
+
+    parts = []
+    position = 0
+    for match in self.INLINE.finditer(text):
+      parts.append(escape(text[position:match.start()]))
+      parts.append(self.render_token(match, output_format, escape))
+      position = match.end()
+    parts.append(escape(text[position:]))
+    return ''.join(parts)
+
+  def render_token(self, match: re.Match, output_format: OutputFormat, escape) -> str:
+    is_html = (output_format == OutputFormat.CANVAS)
+
+    if match.group("code") is not None:
+      code_text = match.group("code_text").strip()
+      if is_html:
+        return f"<code>{escape(code_text)}</code>"
+      return r"\texttt{" + escape(code_text) + "}"
+
+    if match.group("display_math") is not None:
+      if is_html:
+        return f"<span class=\"math display\">\\[{escape(match.group('display_math'))}\\]</span>"
+      return f"\\[{match.group('display_math')}\\]"
+
+    if match.group("inline_math") is not None:
+      if is_html:
+        return f"<span class=\"math inline\">\\({escape(match.group('inline_math'))}\\)</span>"
+      return f"\\({match.group('inline_math')}\\)"
+
+    if match.group("image") is not None:
+      if is_html:
+        return f"<img src=\"{html.escape(match.group('image_src'))}\" alt=\"{html.escape(match.group('image_alt'))}\" />"
+      return r"\includegraphics{" + match.group("image_src") + "}"
+
+    if match.group("link") is not None:
+      link_text = self.render_inline(match.group("link_text"), output_format)
+      if is_html:
+        return f"<a href=\"{html.escape(match.group('link_href'))}\">{link_text}</a>"
+      return r"\href{" + match.group("link_href") + "}{" + link_text + "}"
+
+    if match.group("html_tag") is not None:
+      if is_html:
+        return match.group("html_tag")
+      tag = re.match(r"<(/?)([a-zA-Z0-9]+)", match.group("html_tag"))
+      is_closing, tag_name = (tag.group(1) == "/"), tag.group(2).lower()
+      if tag_name == "br":
+        return r"\\"
+      if tag_name in self.LATEX_TAGS:
+        return self.LATEX_TAGS[tag_name][1 if is_closing else 0]
+      return ""
+
+    if match.group("tex_command") is not None:
+      # Raw LaTeX passes through to LaTeX, and is dropped from HTML (as pandoc does)
+      return "" if is_html else match.group("tex_command")
+
+    if match.group("escaped") is not None:
+      return escape(match.group("escaped"))
+
+    if match.group("strong") is not None:
+      inner = self.render_inline(match.group("strong"), output_format)
+      return f"<strong>{inner}</strong>" if is_html else r"\textbf{" + inner + "}"
+
+    if match.group("emphasis") is not None:
+      inner = self.render_inline(match.group("emphasis"), output_format)
+      return f"<em>{inner}</em>" if is_html else r"\emph{" + inner + "}"
+
+    return escape(match.group())
+
+
+class RenderCache:
+  """
+  Content-addressed store of rendered fragments, keyed by a hash of (text, output format, renderer version).
+  Entries live in an in-memory LRU, and optionally in a directory on disk so they survive between runs.
+  """
+  def __init__(self, max_entries: int = 4096, cache_dir: str|None = None):
+    self.max_entries = max_entries
+    self.cache_dir = cache_dir
+    self.entries : collections.OrderedDict[str, str] = collections.OrderedDict()
+    
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+    
+    if self.cache_dir is not None:
+      os.makedirs(self.cache_dir, exist_ok=True)
+
+  @staticmethod
+  def make_key(text: str, output_format: OutputFormat, renderer_version: str) -> str:
+    return hashlib.sha256(
+      '\0'.join([renderer_version, output_format.name, text]).encode("utf-8")
+    ).hexdigest()
+
+  def get_path(self, key: str) -> str:
+    return os.path.join(self.cache_dir, key[:2], key)
+
+  def get(self, key: str) -> str|None:
+    if key in self.entries:
+      self.hits += 1
+      self.entries.move_to_end(key)
+      return self.entries[key]
+    if self.cache_dir is not None and os.path.exists(self.get_path(key)):
+      self.disk_hits += 1
+      with open(self.get_path(key), encoding="utf-8") as fid:
+        value = fid.read()
+      self.remember(key, value)
+      return value
+    self.misses += 1
+    return None
+
+  def put(self, key: str, value: str):
+    self.remember(key, value)
+    if self.cache_dir is not None:
+      path = self.get_path(key)
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      # Write to the side and rename so concurrent runs never see a partial entry
+      tmp_path = f"{path}.{os.getpid()}.tmp"
+      with open(tmp_path, 'w', encoding="utf-8") as fid:
+        fid.write(value)
+      os.replace(tmp_path, path)
+
+  def remember(self, key: str, value: str):
+    self.entries[key] = value
+    self.entries.move_to_end(key)
+    while len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False)
+
+  def describe(self):
+    lookups = self.hits + self.disk_hits + self.misses
+    if lookups == 0:
+      return
+    log.info(
+      f"Render cache: {self.hits} memory hits, {self.disk_hits} disk hits, {self.misses} misses "
+      f"({100 * (self.hits + self.disk_hits) / lookups:0.1f}% hit rate, {len(self.entries)} entries in memory)"
+    )
+
+
+class CachingRenderer(Renderer):
+  """
+  Sits in front of another renderer so identical fragments (instructions, boilerplate explanations, etc.) only get rendered once.
+  """
+  NAME = "cached"
+
+  def __init__(self, renderer: Renderer, cache: RenderCache|None = None, *args, **kwargs):
+    self.renderer = renderer
+    self.cache = cache if cache is not None else RenderCache()
+    self.renderer_version = None
+
+  def get_version(self) -> str:
+    if self.renderer_version is None:
+      self.renderer_version = self.renderer.get_version()
+    return self.renderer_version
+
+  def convert(self, text: str, output_format: OutputFormat) -> str:
+    return self.convert_batch([(text, output_format)])[0]
+
+  def convert_batch(self, fragments: List[Tuple[str, OutputFormat]]) -> List[str]:
+    keys = [self.cache.make_key(text, output_format, self.get_version()) for (text, output_format) in fragments]
+    results = [self.cache.get(key) for key in keys]
+    
+    # Only send what we haven't seen (once each) to the underlying renderer, still as a single batch
+    missing = {}
+    for i, (key, result) in enumerate(zip(keys, results)):
+      if result is None and key not in missing:
+        missing[key] = i
+    rendered = self.renderer.convert_batch([fragments[i] for i in missing.values()])
+    for key, value in zip(missing.keys(), rendered):
+      self.cache.put(key, value)
+    
+    rendered_by_key = dict(zip(missing.keys(), rendered))
+    return [
+      result if result is not None else rendered_by_key[key]
+      for (key, result) in zip(keys, results)
+    ]
+
+  def describe(self):
+    self.cache.describe()
+    self.renderer.describe()
@@ -0,0 +1,89 @@
+#!env python
+from __future__ import annotations
+
+import builtins
+import importlib
+import importlib.util
+import sys
+import time
+from typing import Dict, List
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+class ImportProfiler:
+  """
+  Times every module imported while it is running, like `python -X importtime` but from inside the program, so it
+  also sees what is only imported later on (e.g. question modules the registry imports as they are asked for).
+  Each module gets the time spent importing it on its own, and including everything it imported in turn.
+  """
+  def __init__(self):
+    self.self_times : Dict[str, float] = {}
+    self.cumulative_times : Dict[str, float] = {}
+    # Time spent in nested imports, for each import in progress
+    self.stack : List[float] = []
+    self.original_import = builtins.__import__
+    self.original_import_module = importlib.import_module
+    self.start_time = None
+
+  def start(self):
+    self.start_time = time.perf_counter()
+    builtins.__import__ = self.timed_import
+    importlib.import_module = self.timed_import_module
+
+  def stop(self):
+    builtins.__import__ = self.original_import
+    importlib.import_module = self.original_import_module
+
+  def timed(self, module_name: str, do_import):
+    # Only the first import of a module does any work
+    if module_name in sys.modules:
+      return do_import()
+    self.stack.append(0)
+    start = time.perf_counter()
+    try:
+      return do_import()
+    finally:
+      elapsed = time.perf_counter() - start
+      nested = self.stack.pop()
+      if self.stack:
+        self.stack[-1] += elapsed
+      self.cumulative_times[module_name] = elapsed
+      self.self_times[module_name] = elapsed - nested
+
+  def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+    module_name = name
+    if level > 0:
+      try:
+        module_name = importlib.util.resolve_name("." * level + name, (globals or {}).get("__package__"))
+      except (ImportError, ValueError):
+        pass
+    return self.timed(module_name, lambda: self.original_import(name, globals, locals, fromlist, level))
+
+  def timed_import_module(self, name, package=None):
+    module_name = importlib.util.resolve_name(name, package) if name.startswith(".") else name
+    return self.timed(module_name, lambda: self.original_import_module(name, package))
+
+  def report(self, top: int = 25):
+    total = time.perf_counter() - self.start_time
+    log.info(f"Startup: {total:0.3f}s, {len(self.self_times)} modules imported ({sum(self.self_times.values()):0.3f}s importing)")
+    log.info(f"  {'self':>8} {'cumulative':>11}  module")
+    for module_name in sorted(self.self_times, key=lambda m: -self.self_times[m])[:top]:
+      log.info(f"  {1000 * self.self_times[module_name]:6.1f}ms {1000 * self.cumulative_times[module_name]:9.1f}ms  {module_name}")
+
+
+profiler : ImportProfiler|None = None
+
+def start():
+  global profiler
+  if profiler is None:
+    profiler = ImportProfiler()
+    profiler.start()
+
+def report():
+  if profiler is not None:
+    profiler.stop()
+    profiler.report()
@@ -0,0 +1,109 @@
+#!env python
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Set
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+class UploadJournal:
+  """
+  Local record of what a push to canvas has already done, so that a rerun can pick up where the last one stopped.
+  It keeps the canvas quiz id for each (course, quiz title), the question group id for each question in that quiz,
+  and fingerprints of the variations that have been uploaded into each group.
+  Everything is written as soon as canvas confirms it, so the journal is accurate even if we die partway through.
+  """
+
+  SCHEMA = """
+    CREATE TABLE IF NOT EXISTS quizzes (
+      course_id INTEGER NOT NULL,
+      title TEXT NOT NULL,
+      quiz_id INTEGER NOT NULL,
+      created REAL NOT NULL,
+      PRIMARY KEY (course_id, title)
+    );
+    CREATE TABLE IF NOT EXISTS question_groups (
+      quiz_id INTEGER NOT NULL,
+      question_index INTEGER NOT NULL,
+      question_name TEXT NOT NULL,
+      group_id INTEGER NOT NULL,
+      complete INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (quiz_id, question_index, question_name)
+    );
+    CREATE TABLE IF NOT EXISTS variations (
+      group_id INTEGER NOT NULL,
+      fingerprint TEXT NOT NULL,
+      uploaded REAL NOT NULL,
+      PRIMARY KEY (group_id, fingerprint)
+    );
+  """
+
+  def __init__(self, path):
+    self.path = path
+    # Uploads finish on worker threads, so share one connection behind a lock
+    self.lock = threading.Lock()
+    self.connection = sqlite3.connect(path, check_same_thread=False)
+    with self.lock, self.connection:
+      self.connection.executescript(self.SCHEMA)
+
+  @staticmethod
+  def get_path_for_yaml(path_to_yaml) -> str:
+    return f"{os.path.splitext(path_to_yaml)[0]}.journal.sqlite"
+
+  def get_quiz_id(self, course_id: int, title: str) -> int|None:
+    with self.lock:
+      row = self.connection.execute(
+        "SELECT quiz_id FROM quizzes WHERE course_id = ? AND title = ?",
+        (course_id, title)
+      ).fetchone()
+    return None if row is None else row[0]
+
+  def record_quiz(self, course_id: int, title: str, quiz_id: int):
+    with self.lock, self.connection:
+      self.connection.execute(
+        "INSERT OR REPLACE INTO quizzes (course_id, title, quiz_id, created) VALUES (?, ?, ?, ?)",
+        (course_id, title, quiz_id, time.time())
+      )
+
+  def get_group(self, quiz_id: int, question_index: int, question_name: str) -> tuple[int, bool]|None:
+    """Returns the (group id, complete) of a question group we made before, if there is one."""
+    with self.lock:
+      row = self.connection.execute(
+        "SELECT group_id, complete FROM question_groups WHERE quiz_id = ? AND question_index = ? AND question_name = ?",
+        (quiz_id, question_index, question_name)
+      ).fetchone()
+    return None if row is None else (row[0], bool(row[1]))
+
+  def record_group(self, quiz_id: int, question_index: int, question_name: str, group_id: int):
+    with self.lock, self.connection:
+      self.connection.execute(
+        "INSERT OR REPLACE INTO question_groups (quiz_id, question_index, question_name, group_id) VALUES (?, ?, ?, ?)",
+        (quiz_id, question_index, question_name, group_id)
+      )
+
+  def mark_group_complete(self, group_id: int):
+    with self.lock, self.connection:
+      self.connection.execute("UPDATE question_groups SET complete = 1 WHERE group_id = ?", (group_id,))
+
+  def get_variations(self, group_id: int) -> Set[str]:
+    with self.lock:
+      rows = self.connection.execute("SELECT fingerprint FROM variations WHERE group_id = ?", (group_id,)).fetchall()
+    return set(row[0] for row in rows)
+
+  def record_variation(self, group_id: int, fingerprint: str):
+    with self.lock, self.connection:
+      self.connection.execute(
+        "INSERT OR IGNORE INTO variations (group_id, fingerprint, uploaded) VALUES (?, ?, ?)",
+        (group_id, fingerprint, time.time())
+      )
+
+  def close(self):
+    with self.lock:
+      self.connection.close()
@@ -0,0 +1,276 @@
+#!env python
+from __future__ import annotations
+
+import argparse
+import datetime
+import hashlib
+import inspect
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, Set, Tuple
+
+from generation import GenerationScheduler
+from misc import OutputFormat
+from question import Question
+from renderers import RendererRegistry
+from variation_space import VariationSpaceEstimate
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+class VariationBank:
+  """
+  Rendered variations kept between runs, so that pushing to canvas or building pdfs can take variations that were
+  generated earlier (e.g. overnight by the prewarm CLI below) instead of generating everything from scratch.
+  Variations are keyed by question class, a hash of the kwargs it was made with, a hash of the code that generates
+  it and the renderer version, so changing any of them means generating afresh.
+  Only one copy of each distinct variation is kept.
+  """
+
+  SCHEMA = """
+    CREATE TABLE IF NOT EXISTS variations (
+      question_class TEXT NOT NULL,
+      kwargs_hash TEXT NOT NULL,
+      code_version TEXT NOT NULL,
+      renderer_version TEXT NOT NULL,
+      output_format TEXT NOT NULL,
+      seed TEXT,
+      fingerprint TEXT NOT NULL,
+      body TEXT NOT NULL,
+      explanation TEXT NOT NULL,
+      answers TEXT NOT NULL,
+      created REAL NOT NULL,
+      UNIQUE (question_class, kwargs_hash, code_version, renderer_version, output_format, fingerprint)
+    );
+    CREATE INDEX IF NOT EXISTS variations_by_seed
+      ON variations (question_class, kwargs_hash, code_version, renderer_version, output_format, seed);
+  """
+
+  # Hashing source files is cheap, but there is no need to do it for every question
+  code_versions : Dict[type, str] = {}
+
+  def __init__(self, path):
+    self.path = path
+    # Uploads finish on worker threads, so share one connection behind a lock
+    self.lock = threading.Lock()
+    self.connection = sqlite3.connect(path, check_same_thread=False)
+    with self.lock, self.connection:
+      self.connection.executescript(self.SCHEMA)
+
+  @staticmethod
+  def get_path_for_yaml(path_to_yaml) -> str:
+    return f"{os.path.splitext(path_to_yaml)[0]}.bank.sqlite"
+
+  @classmethod
+  def get_code_version(cls, question_class: type) -> str:
+    """Hash of the source of every module the question class (and its parent question classes) is defined in."""
+    if question_class not in cls.code_versions:
+      source_files = sorted(set(
+        inspect.getsourcefile(c) for c in question_class.__mro__
+        if issubclass(c, Question)
+      ))
+      digest = hashlib.sha256()
+      for source_file in source_files:
+        with open(source_file, "rb") as fid:
+          digest.update(fid.read())
+      cls.code_versions[question_class] = digest.hexdigest()
+    return cls.code_versions[question_class]
+
+  @classmethod
+  def get_key(cls, question: Question, output_format: OutputFormat) -> Tuple[str, str, str, str, str]|None:
+    """Where variations of `question` live in the bank, or None if it can't be banked."""
+    # Without the kwargs we can't tell whether two questions would give the same variations
+    if question.registry_spec is None:
+      return None
+    # These upload things to canvas as they generate, which wouldn't exist in another course or quiz
+    if output_format == OutputFormat.CANVAS and question.NEEDS_CANVAS_TO_GENERATE:
+      return None
+    question_type, kwargs = question.registry_spec
+    # The name only changes the seeds, not which variations are possible
+    kwargs = {k: v for k, v in kwargs.items() if k != "name"}
+    kwargs_hash = hashlib.sha256(json.dumps(kwargs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    renderer = question.renderer if question.renderer is not None else RendererRegistry.get_default()
+    return (
+      question_type.lower(),
+      kwargs_hash,
+      cls.get_code_version(type(question)),
+      renderer.get_version(),
+      output_format.name
+    )
+
+  def count(self, question: Question, output_format: OutputFormat) -> int:
+    key = self.get_key(question, output_format)
+    if key is None:
+      return 0
+    with self.lock:
+      row = self.connection.execute(
+        "SELECT COUNT(*) FROM variations WHERE question_class = ? AND kwargs_hash = ? AND code_version = ? "
+        "AND renderer_version = ? AND output_format = ?",
+        key
+      ).fetchone()
+    return row[0]
+
+  def put(self, question: Question, output_format: OutputFormat, seed: int|None, variation, fingerprint: str) -> bool:
+    """Banks a variation, along with its fingerprint from Question.get_fingerprint, returning whether it was new."""
+    key = self.get_key(question, output_format)
+    if key is None:
+      return False
+    if output_format == OutputFormat.CANVAS:
+      body = variation["question_text"]
+      explanation = variation["neutral_comments_html"]
+      answers = json.dumps({"question_type": variation["question_type"], "answers": variation["answers"]}, default=str)
+    else:
+      body, explanation, answers = variation, "", "{}"
+    with self.lock, self.connection:
+      cursor = self.connection.execute(
+        "INSERT OR IGNORE INTO variations "
+        "(question_class, kwargs_hash, code_version, renderer_version, output_format, seed, fingerprint, body, explanation, answers, created) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (*key, None if seed is None else str(seed), fingerprint, body, explanation, answers, time.time())
+      )
+    return cursor.rowcount > 0
+
+  def get_fingerprints(self, question: Question, output_format: OutputFormat) -> Set[str]:
+    key = self.get_key(question, output_format)
+    if key is None:
+      return set()
+    with self.lock:
+      rows = self.connection.execute(
+        "SELECT fingerprint FROM variations WHERE question_class = ? AND kwargs_hash = ? AND code_version = ? "
+        "AND renderer_version = ? AND output_format = ?",
+        key
+      ).fetchall()
+    return set(row[0] for row in rows)
+
+  def get(self, question: Question, output_format: OutputFormat, seed: int):
+    """The banked variation made from `seed`, if there is one."""
+    key = self.get_key(question, output_format)
+    if key is None:
+      return None
+    with self.lock:
+      row = self.connection.execute(
+        "SELECT body, explanation, answers FROM variations WHERE question_class = ? AND kwargs_hash = ? "
+        "AND code_version = ? AND renderer_version = ? AND output_format = ? AND seed = ?",
+        (*key, str(seed))
+      ).fetchone()
+    return None if row is None else self.make_variation(question, output_format, *row)
+
+  def draw(self, question: Question, output_format: OutputFormat, exclude: Set[str]) -> Iterator[Tuple[str, object]]:
+    """
+    Yields (fingerprint, variation) for banked variations of `question` in the order they were banked,
+    skipping any whose fingerprint is in `exclude` (checked as we go, so callers can keep adding to it).
+    """
+    key = self.get_key(question, output_format)
+    if key is None:
+      return
+    with self.lock:
+      rows = self.connection.execute(
+        "SELECT fingerprint, body, explanation, answers FROM variations WHERE question_class = ? AND kwargs_hash = ? "
+        "AND code_version = ? AND renderer_version = ? AND output_format = ? ORDER BY rowid",
+        key
+      ).fetchall()
+    for fingerprint, body, explanation, answers in rows:
+      if fingerprint in exclude:
+        continue
+      yield fingerprint, self.make_variation(question, output_format, body, explanation, answers)
+
+  @staticmethod
+  def make_variation(question: Question, output_format: OutputFormat, body: str, explanation: str, answers: str):
+    """Turns a banked row back into what get__canvas or get__latex would have returned."""
+    if output_format != OutputFormat.CANVAS:
+      return body
+    answers = json.loads(answers)
+    return {
+      "question_name": f"{question.name} ({datetime.datetime.now().strftime('%m/%d/%y %H:%M:%S.%f')})",
+      "question_text": body,
+      "question_type": answers["question_type"],
+      "points_possible": question.points_value,
+      "answers": answers["answers"],
+      "neutral_comments_html": explanation
+    }
+
+  def close(self):
+    with self.lock:
+      self.connection.close()
+
+
+def prewarm(bank: VariationBank, questions, output_formats, num_variations: int, scheduler, max_attempts_factor: int = 10):
+  """Generates and banks variations until each distinct question has `num_variations` of each format."""
+  seen_keys = set()
+  for question in questions:
+    for output_format in output_formats:
+      key = bank.get_key(question, output_format)
+      if key is None:
+        log.info(f"Skipping {question.name} ({output_format.name}), it can't be banked")
+        continue
+      if key in seen_keys:
+        continue
+      seen_keys.add(key)
+
+      target = min(num_variations, question.possible_variations)
+      needed = target - bank.count(question, output_format)
+      if needed <= 0:
+        log.info(f"{question.name} ({output_format.name}) already has {target} variations banked")
+        continue
+
+      start_time = time.perf_counter()
+      added = 0
+      attempts = 0
+      # Don't bother rendering anything we already have
+      banked = bank.get_fingerprints(question, output_format)
+      variations = scheduler.generate_variations(question, output_format, expected_count=needed, skip=banked)
+      # Past a point we are mostly getting duplicates, so stop once there probably aren't any new ones left
+      variation_space = VariationSpaceEstimate(question.possible_variations)
+      while added < needed and attempts < max_attempts_factor * needed and not variation_space.is_exhausted():
+        variation = next(variations)
+        attempts += 1
+        variation_space.observe(variation.fingerprint)
+        if variation.fingerprint in banked:
+          question.record_duplicate()
+          continue
+        banked.add(variation.fingerprint)
+        bank.put(question, output_format, variation.seed, variation.rendered, variation.fingerprint)
+        added += 1
+      variations.close()
+      log.info(
+        f"{question.name} ({output_format.name}): banked {added} variations "
+        f"({attempts - added} duplicates) in {time.perf_counter() - start_time:0.1f}s"
+      )
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description="Fill the variation bank for every question in a quiz yaml ahead of time")
+  parser.add_argument("--quiz_yaml", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "../example_files/exam.yaml"))
+  parser.add_argument("--bank", default=None, help="Where to keep the variation bank (defaults to next to the quiz yaml)")
+  parser.add_argument("--num_variations", default=100, type=int, help="How many distinct variations to bank per question")
+  parser.add_argument("--formats", nargs="+", default=["canvas", "latex"], choices=["canvas", "latex"])
+  parser.add_argument("--jobs", default=1, type=int, help="How many processes to generate variations with")
+  parser.add_argument("--seed", default=None, type=int, help="Seed to generate from (defaults to a fresh one each run, so reruns find new variations)")
+  return parser.parse_args()
+
+
+def main():
+  # Imported here since quiz imports this module
+  from quiz import Quiz
+
+  args = parse_args()
+  output_formats = [OutputFormat.CANVAS if f == "canvas" else OutputFormat.LATEX for f in args.formats]
+  seed = args.seed if args.seed is not None else random.getrandbits(64)
+
+  bank = VariationBank(args.bank or VariationBank.get_path_for_yaml(args.quiz_yaml))
+  for quiz in Quiz.from_yaml(args.quiz_yaml, seed=seed, pick_all=True):
+    with GenerationScheduler(args.jobs, quiz.renderer_options, quiz.render_cache_dir) as scheduler:
+      prewarm(bank, quiz.possible_questions, output_formats, args.num_variations, scheduler)
+  Question.describe_duplicates()
+  bank.close()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,60 @@
+#!env python
+from __future__ import annotations
+
+import collections
+
+import logging
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.DEBUG)
+
+
+class VariationSpaceEstimate:
+  """
+  Keeps track of how many distinct variations a question has, so that we can stop asking for new ones once we
+  have probably seen them all.
+  Questions that know how many variations they have say so through `possible_variations`.  For everything else
+  we estimate it from the fingerprints of what has been generated so far, using the Chao1 capture-recapture estimator:
+  if we keep seeing variations for the second time and rarely see new ones, there can't be many left to find.
+  """
+
+  # Too few attempts and the estimate is mostly noise
+  MIN_ATTEMPTS = 20
+  # We call it exhausted once we expect fewer than this many variations we haven't seen
+  EXHAUSTED_BELOW = 0.1
+
+  def __init__(self, possible_variations: float = float('inf')):
+    self.possible_variations = possible_variations
+    self.times_seen : collections.Counter[str] = collections.Counter()
+    self.num_attempts = 0
+
+  def observe(self, fingerprint: str):
+    self.times_seen[fingerprint] += 1
+    self.num_attempts += 1
+
+  @property
+  def num_distinct(self) -> int:
+    return len(self.times_seen)
+
+  def estimate_unseen(self) -> float:
+    if self.num_distinct >= self.possible_variations:
+      return 0
+    # Variations seen exactly once and exactly twice
+    frequencies = collections.Counter(self.times_seen.values())
+    f1, f2 = frequencies[1], frequencies[2]
+    if f2 == 0:
+      unseen = f1 * (f1 - 1) / 2
+    else:
+      unseen = f1 * f1 / (2 * f2)
+    return min(unseen, self.possible_variations - self.num_distinct)
+
+  def estimate(self) -> float:
+    """Estimated number of distinct variations in total."""
+    return self.num_distinct + self.estimate_unseen()
+
+  def is_exhausted(self) -> bool:
+    if self.num_distinct >= self.possible_variations:
+      return True
+    if self.num_attempts < self.MIN_ATTEMPTS:
+      return False
+    return self.estimate_unseen() < self.EXHAUSTED_BELOW
@@ -0,0 +1,54 @@
+from build_cache import BuildCache
+from question import QuestionRegistry
+from renderers import MarkdownRenderer
+
+GENERATOR = 'return f"Pick {random.randint(0, 10**6)}"'
+
+
+def make_question(generator=GENERATOR):
+  question = QuestionRegistry.create("FromGenerator", name="generated", points_value=1, generator=generator)
+  question.renderer = MarkdownRenderer()
+  return question
+
+
+def test_blocks_need_a_seed():
+  assert BuildCache.get_block_key(make_question(), None) is None
+
+
+def test_block_key_depends_on_the_question_and_seed():
+  key = BuildCache.get_block_key(make_question(), 1)
+  assert key == BuildCache.get_block_key(make_question(), 1)
+  assert key != BuildCache.get_block_key(make_question(), 2)
+  assert key != BuildCache.get_block_key(make_question(generator='return "fixed"'), 1)
+
+
+def test_blocks_are_reused_between_builds(tmp_path):
+  question = make_question()
+  first = BuildCache(str(tmp_path))
+  assert first.get_block(question, 1) is None
+  first.put_block(question, 1, "block")
+
+  second = BuildCache(str(tmp_path))
+  assert second.get_block(question, 1) == "block"
+  assert second.get_block(question, 2) is None
+  assert second.stats["blocks reused"] == 1
+  assert second.regenerated == {"generated": 1}
+
+
+def test_pdfs_are_keyed_by_source_and_engine(tmp_path):
+  cache = BuildCache(str(tmp_path / "cache"))
+  pdf_path, log_path = tmp_path / "a.pdf", tmp_path / "a.log"
+  pdf_path.write_bytes(b"%PDF")
+  log_path.write_text("log")
+
+  assert not cache.get_pdf("a", "source", "pdflatex", str(pdf_path), str(log_path))
+  cache.put_pdf("source", "pdflatex", str(pdf_path), str(log_path))
+
+  out_pdf, out_log = tmp_path / "b.pdf", tmp_path / "b.log"
+  assert cache.get_pdf("b", "source", "pdflatex", str(out_pdf), str(out_log))
+  assert out_pdf.read_bytes() == b"%PDF"
+  assert out_log.read_text() == "log"
+  assert not cache.get_pdf("c", "source!", "pdflatex", str(out_pdf), str(out_log))
+  assert not cache.get_pdf("d", "source", "xelatex", str(out_pdf), str(out_log))
+  assert cache.recompiled == ["a", "c", "d"]
+  assert list((tmp_path / "cache").rglob("*.tmp")) == []
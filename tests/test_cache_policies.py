@@ -0,0 +1,88 @@
+import math
+import random
+
+import pytest
+
+from premade_questions.cache_policies import CachePolicyRegistry, Trace, compare_policies, hit_rate
+
+
+def baseline_simulation(kind, cache_size, requests):
+  """
+  The list-based simulation CachingQuestion used before the policy engine, as (hit, evicted, cache state) per request.
+  Kept here as the reference the engine has to agree with.
+  """
+  cache_state = []
+  last_used = {}
+  steps = []
+  for request_number, request in enumerate(requests):
+    was_hit = request in cache_state
+    evicted = None
+    if not was_hit:
+      if len(cache_state) == cache_size:
+        evicted = cache_state[0]
+        cache_state = cache_state[1:]
+      cache_state.append(request)
+    last_used[request] = request_number
+
+    if kind == "LRU":
+      cache_state = sorted(cache_state, key=(lambda e: last_used[e]))
+    elif kind == "Belady":
+      upcoming_requests = requests[request_number+1:]
+      cache_state = sorted(
+        cache_state,
+        key=(lambda e: (upcoming_requests.index(e), -e) if e in upcoming_requests else (math.inf, -e)),
+        reverse=True
+      )
+    steps.append((was_hit, evicted, list(cache_state)))
+  return steps
+
+
+def random_traces(count, seed=0):
+  rng = random.Random(seed)
+  for _ in range(count):
+    num_elements = rng.randint(2, 8)
+    yield rng.randint(1, 5), [rng.randrange(num_elements) for _ in range(rng.randint(1, 30))]
+
+
+@pytest.mark.parametrize("kind", ["FIFO", "LRU", "Belady"])
+def test_matches_the_baseline_simulation(kind):
+  for cache_size, requests in random_traces(500):
+    policy = CachePolicyRegistry.create(kind, cache_size, requests)
+    for request, (was_hit, evicted, cache_state) in zip(requests, baseline_simulation(kind, cache_size, requests)):
+      assert policy.access(request) == (was_hit, evicted), (cache_size, requests)
+      assert policy.contents() == cache_state, (cache_size, requests)
+
+
+def test_belady_is_never_beaten():
+  for cache_size, requests in random_traces(300, seed=1):
+    runs = compare_policies(CachePolicyRegistry.names(), cache_size, Trace(requests))
+    best = max(run.num_hits for run in runs.values())
+    assert runs["Belady"].num_hits == best, (cache_size, requests)
+
+
+def test_belady_checks_the_trace():
+  policy = CachePolicyRegistry.create("Belady", 2, [1, 2, 3])
+  policy.access(1)
+  with pytest.raises(ValueError):
+    policy.access(3)
+  with pytest.raises(ValueError):
+    CachePolicyRegistry.create("Belady", 2)
+
+
+@pytest.mark.parametrize("kind", ["FIFO", "LRU", "Belady", "LFU", "Clock", "TwoQ"])
+def test_every_policy_stays_within_its_size(kind):
+  for cache_size, requests in random_traces(200, seed=2):
+    policy = CachePolicyRegistry.create(kind, cache_size, requests)
+    cached = set()
+    for request in requests:
+      was_hit, evicted = policy.access(request)
+      assert was_hit == (request in cached)
+      cached.discard(evicted)
+      cached.add(request)
+      assert set(policy.contents()) == cached
+      assert len(policy) == len(cached) <= cache_size
+
+
+def test_hit_rate_counts_compulsory_misses():
+  assert hit_rate("LRU", 2, [1, 2, 1, 2]) == 50.0
+  assert hit_rate("LRU", 2, []) == 0.0
@@ -0,0 +1,208 @@
+import http.server
+import json
+import socket
+import threading
+
+import pytest
+
+canvasapi = pytest.importorskip("canvasapi")
+requests = pytest.importorskip("requests")
+
+import canvasapi.course
+import canvasapi.exceptions
+
+import canvas_requests
+from canvas_requests import AdaptiveLimiter, CanvasRequestLayer
+
+# The mock server is plain http
+pytestmark = pytest.mark.filterwarnings("ignore:Canvas may respond unexpectedly")
+
+
+class MockCanvasHandler(http.server.BaseHTTPRequestHandler):
+  def log_message(self, *args):
+    pass
+  
+  def handle_request(self):
+    body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+    path = self.path.split("?")[0]
+    self.server.received.append((self.command, path, body))
+    
+    # Each (method, path) has a script of responses, after which it answers 200
+    script = self.server.scripts.get((self.command, path), [])
+    status, headers, content = script.pop(0) if script else (200, {}, {"id": 1})
+    if status is None:
+      # Drop the connection after reading the request, like a timeout or a reset would
+      return
+    data = content if isinstance(content, bytes) else json.dumps(content).encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(data)))
+    for header, value in {**self.server.headers, **headers}.items():
+      self.send_header(header, str(value))
+    self.end_headers()
+    self.wfile.write(data)
+  
+  do_GET = handle_request
+  do_POST = handle_request
+
+
+@pytest.fixture
+def server():
+  server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MockCanvasHandler)
+  server.received = []
+  server.scripts = {}
+  server.headers = {}
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  yield server
+  server.shutdown()
+  server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+  sleeps = []
+  monkeypatch.setattr(canvas_requests.time, "sleep", sleeps.append)
+  return sleeps
+
+
+def make_canvas(port):
+  canvas = canvasapi.Canvas(f"http://127.0.0.1:{port}", "token")
+  course = canvasapi.course.Course(canvas._Canvas__requester, {"id": 1})
+  return canvas, course
+
+
+def unused_port():
+  with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    return s.getsockname()[1]
+
+
+QUIZZES = ("POST", "/api/v1/courses/1/quizzes")
+COURSE = ("GET", "/api/v1/courses/1")
+
+
+def count_received(server, request):
+  return sum(1 for method, path, _ in server.received if (method, path) == request)
+
+
+def test_backoff_is_bounded():
+  layer = CanvasRequestLayer()
+  for attempt in range(10):
+    for _ in range(20):
+      backoff = layer.get_backoff(attempt)
+      assert 0 <= backoff <= min(layer.MAX_DELAY, layer.BASE_DELAY * 2 ** attempt)
+
+
+def test_limiter_halves_and_grows_within_bounds():
+  limiter = AdaptiveLimiter(4)
+  limiter.decrease()
+  assert limiter.limit == 2
+  for _ in range(5):
+    limiter.decrease()
+  assert limiter.limit == limiter.min_concurrency
+  for _ in range(100):
+    limiter.increase()
+  assert limiter.limit == 4
+
+
+@pytest.mark.parametrize("status, content", [
+  (429, {"errors": "slow down"}),
+  (403, b"403 Forbidden (Rate Limit Exceeded)"),
+])
+def test_throttled_create_waits_and_retries(server, sleeps, status, content):
+  canvas, course = make_canvas(server.server_address[1])
+  layer = CanvasRequestLayer(canvas)
+  server.scripts[QUIZZES] = [(status, {"Retry-After": 5}, content)]
+  
+  # Canvas refused the request, so even a create is safe to send again
+  quiz = layer.call(course.create_quiz, quiz={"title": "test"}, idempotent=False)
+  
+  assert quiz.id == 1
+  assert count_received(server, QUIZZES) == 2
+  assert layer.metrics.throttled == 1
+  assert layer.metrics.retries == 1
+  # The retry waited out Retry-After on top of its backoff
+  assert any(4 < sleep <= 5 for sleep in sleeps)
+  # Halved from 4, then grown a little by the success
+  assert 2 <= layer.limiter.limit < 3
+
+
+def test_limiter_only_grows_with_plenty_of_rate_limit_left(server, sleeps):
+  canvas, _ = make_canvas(server.server_address[1])
+  layer = CanvasRequestLayer(canvas)
+  layer.limiter.limit = 1
+  
+  server.headers["X-Rate-Limit-Remaining"] = CanvasRequestLayer.HIGH_WATER_MARK - 1
+  for _ in range(5):
+    layer.call(canvas.get_course, 1)
+  assert layer.limiter.limit == 1
+  assert sleeps == []
+  
+  server.headers["X-Rate-Limit-Remaining"] = CanvasRequestLayer.HIGH_WATER_MARK + 1
+  for _ in range(5):
+    layer.call(canvas.get_course, 1)
+  assert layer.limiter.limit > 2
+
+
+def test_low_rate_limit_waits_before_sending(server, sleeps):
+  canvas, _ = make_canvas(server.server_address[1])
+  layer = CanvasRequestLayer(canvas)
+  server.headers["X-Rate-Limit-Remaining"] = CanvasRequestLayer.LOW_WATER_MARK - 50
+  
+  layer.call(canvas.get_course, 1)
+  assert sleeps == []
+  layer.call(canvas.get_course, 1)
+  assert sleeps == [pytest.approx(50 / CanvasRequestLayer.REFILL_PER_SECOND)]
+  assert layer.metrics.throttle_waits == 1
+
+
+def test_dropped_create_is_not_retried(server, sleeps):
+  canvas, course = make_canvas(server.server_address[1])
+  layer = CanvasRequestLayer(canvas)
+  server.scripts[QUIZZES] = [(None, {}, None)]
+  
+  # Canvas may have created the quiz before the connection went away, so trying again could make a second one
+  with pytest.raises(requests.exceptions.ConnectionError):
+    layer.call(course.create_quiz, quiz={"title": "test"}, idempotent=False)
+  assert count_received(server, QUIZZES) == 1
+  assert layer.metrics.retries == 0
+
+
+def test_failed_create_is_not_retried(server, sleeps):
+  canvas, course = make_canvas(server.server_address[1])
+  layer = CanvasRequestLayer(canvas)
+  server.scripts[QUIZZES] = [(502, {}, {})]
+  
+  with pytest.raises(canvasapi.exceptions.CanvasException):
+    layer.call(course.create_quiz, quiz={"title": "test"}, idempotent=False)
+  assert count_received(server, QUIZZES) == 1
+
+
+def test_dropped_read_is_retried(server, sleeps):
+  canvas, _ = make_canvas(server.server_address[1])
+  layer = CanvasRequestLayer(canvas)
+  server.scripts[COURSE] = [(None, {}, None), (502, {}, {})]
+  
+  course = layer.call(canvas.get_course, 1)
+  assert course.id == 1
+  assert count_received(server, COURSE) == 3
+  assert layer.metrics.retries == 2
+
+
+def test_refused_connection_is_retried_for_creates(sleeps):
+  canvas, course = make_canvas(unused_port())
+  layer = CanvasRequestLayer(canvas, max_attempts=3)
+  
+  # Nothing was sent, so retrying can't create anything twice
+  with pytest.raises(requests.exceptions.ConnectionError):
+    layer.call(course.create_quiz, quiz={"title": "test"}, idempotent=False)
+  assert layer.metrics.requests == 3
+  assert layer.metrics.failures == 1
+
+
+def test_attach_explains_a_missing_session():
+  class RenamedCanvas:
+    pass
+  with pytest.raises(RuntimeError, match="_Canvas__requester._session"):
+    CanvasRequestLayer(RenamedCanvas())
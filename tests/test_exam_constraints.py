@@ -0,0 +1,107 @@
+import collections
+import itertools
+import random
+import types
+
+import pytest
+
+from exam_constraints import ExamComposer, ExamConstraints, InfeasibleConstraints, Range
+from question import Question
+
+MEMORY, PROCESS = Question.Topic.MEMORY, Question.Topic.PROCESS
+
+
+def make_pool(spec):
+  return [types.SimpleNamespace(name=f"q{i}", points_value=points, kind=kind) for i, (points, kind) in enumerate(spec)]
+
+
+def is_valid(selection, constraints):
+  if sum(q.points_value for q in selection) not in constraints.total_points:
+    return False
+  if len(selection) not in constraints.num_questions:
+    return False
+  for topic, points in constraints.topic_points.items():
+    if sum(q.points_value for q in selection if q.kind == topic) not in points:
+      return False
+  for topic, questions in constraints.topic_questions.items():
+    if sum(1 for q in selection if q.kind == topic) not in questions:
+      return False
+  names = [q.name for q in selection]
+  return all(sum(1 for name in names if name in group) <= 1 for group in constraints.at_most_one_of)
+
+
+def brute_force(pool, constraints):
+  return set(
+    frozenset(q.name for q in selection)
+    for k in range(len(pool) + 1)
+    for selection in itertools.combinations(pool, k)
+    if is_valid(selection, constraints)
+  )
+
+
+def check_against_brute_force(pool, constraints, draws_per_selection=200):
+  valid = brute_force(pool, constraints)
+  composer = ExamComposer(pool, constraints)
+  if not valid:
+    with pytest.raises(InfeasibleConstraints):
+      composer.compose(random.Random(0))
+    return
+
+  rng = random.Random(0)
+  draws = len(valid) * draws_per_selection
+  counts = collections.Counter(frozenset(q.name for q in composer.compose(rng)) for _ in range(draws))
+  assert set(counts) == valid
+  for selection in valid:
+    assert 0.6 * draws_per_selection < counts[selection] < 1.4 * draws_per_selection, (selection, counts)
+
+
+def test_overlapping_groups_are_separate_constraints():
+  pool = make_pool([(1, MEMORY)] * 7)
+  constraints = ExamConstraints(total_points=Range(3, 3), at_most_one_of=[["q0", "q5", "q4"], ["q6", "q5", "q2"]])
+  valid = brute_force(pool, constraints)
+  # Neither selection uses two questions from the same group, so both are allowed
+  assert frozenset(["q2", "q3", "q4"]) in valid
+  assert frozenset(["q0", "q1", "q2"]) in valid
+  check_against_brute_force(pool, constraints)
+
+
+def test_overlapping_groups_do_not_make_exams_infeasible():
+  pool = make_pool([(4, MEMORY), (1, PROCESS), (2, PROCESS), (5, MEMORY)])
+  constraints = ExamConstraints(
+    total_points=Range(6, 6),
+    topic_points={MEMORY: Range(4, 6)},
+    topic_questions={MEMORY: Range(0, 1)},
+    at_most_one_of=[["q0", "q3", "q1"], ["q2", "q1", "q3"]],
+  )
+  # q0 and q2 are each in only one of the groups
+  assert brute_force(pool, constraints) == {frozenset(["q0", "q2"])}
+  check_against_brute_force(pool, constraints)
+
+
+def test_groups_spanning_topics_overlap_too():
+  pool = make_pool([(1, MEMORY), (1, PROCESS), (2, MEMORY), (2, PROCESS), (1, MEMORY), (2, PROCESS)])
+  constraints = ExamConstraints(
+    total_points=Range(3, 5),
+    topic_points={MEMORY: Range(1, 3), PROCESS: Range(1, 4)},
+    at_most_one_of=[["q0", "q1"], ["q1", "q2", "q3"], ["q4", "q5"]],
+  )
+  check_against_brute_force(pool, constraints)
+
+
+def test_random_pools_match_brute_force():
+  rng = random.Random(1)
+  for _ in range(25):
+    pool = make_pool([(rng.choice([1, 1.5, 2, 3]), rng.choice([MEMORY, PROCESS])) for _ in range(rng.randint(3, 7))])
+    names = [q.name for q in pool]
+    total = sum(q.points_value for q in pool)
+    low = rng.uniform(0, total)
+    constraints = ExamConstraints(
+      total_points=Range(low, low + rng.choice([0, 1, 3])),
+      num_questions=Range(0, rng.randint(1, len(pool))),
+      at_most_one_of=[rng.sample(names, rng.randint(2, 3)) for _ in range(rng.randint(0, 3))],
+    )
+    if rng.random() < 0.5:
+      constraints.topic_points[MEMORY] = Range(rng.choice([0, 1, 2]), rng.choice([2, 4, float('inf')]))
+    if rng.random() < 0.5:
+      constraints.topic_questions[PROCESS] = Range(0, rng.randint(1, 3))
+    check_against_brute_force(pool, constraints, draws_per_selection=100)
@@ -0,0 +1,124 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from generation import render_variation
+from misc import OutputFormat
+from question import Question, QuestionRegistry
+from renderers import MarkdownRenderer
+
+SRC_DIR = os.path.join(os.path.dirname(__file__), "..", "src")
+
+FINGERPRINT_SCRIPT = """
+from question import QuestionRegistry
+question = QuestionRegistry.create("FromGenerator", name="generated", points_value=1, generator={generator!r})
+print(question.refresh(seed=7))
+"""
+
+# Answers are a dict, so a fingerprint using hash() or set ordering would change between processes
+GENERATOR = 'return {"text": f"Pick {random.randint(0, 10**6)}", "values": {random.randint(0, 9), "a", "b"}}'
+
+
+def make_question(generator='return f"Pick {random.randint(0, 10**6)}"', name="generated"):
+  question = QuestionRegistry.create("FromGenerator", name=name, points_value=1, generator=generator)
+  question.renderer = MarkdownRenderer()
+  question.exam_seed = 1
+  return question
+
+
+def test_fingerprint_follows_the_seed():
+  question = make_question()
+  assert question.refresh(seed=1) == question.refresh(seed=1) == make_question().refresh(seed=1)
+  assert question.refresh(seed=1) != question.refresh(seed=2)
+  # Taking the fingerprint doesn't change what gets rendered
+  question.refresh(seed=3)
+  rendered = question.render__latex()
+  question.get_fingerprint()
+  assert question.render__latex() == rendered
+
+
+def test_fingerprint_is_stable_across_runs():
+  fingerprints = set()
+  for hash_seed in ["1", "2", "3"]:
+    result = subprocess.run(
+      [sys.executable, "-c", FINGERPRINT_SCRIPT.format(generator=GENERATOR)],
+      cwd=SRC_DIR, env={**os.environ, "PYTHONHASHSEED": hash_seed}, capture_output=True, text=True, check=True
+    )
+    fingerprints.add(result.stdout.strip())
+  assert fingerprints == {make_question(GENERATOR).refresh(seed=7)}
+
+
+def test_duplicates_are_skipped_before_rendering(monkeypatch):
+  pytest.importorskip("canvasapi")
+  pytest.importorskip("dotenv")
+  import canvas_interface
+  from test_upload_journal import FakeCanvas, FakeCourse, FakeQuiz, FakeQuizDefinition
+
+  # Only three different variations to be had
+  question = make_question('return f"Pick {random.randint(0, 2)}"')
+  rendered = []
+  render = question.render__canvas
+  monkeypatch.setattr(question, "render__canvas", lambda *args, **kwargs: rendered.append(1) or render(*args, **kwargs))
+
+  canvas_quiz = FakeQuiz()
+  interface = canvas_interface.CanvasInterface(course_id=1, canvas=FakeCanvas(FakeCourse(canvas_quiz)))
+  stats = interface.push_quiz_to_canvas(FakeQuizDefinition([question]), 5, upload_concurrency=1)
+
+  assert stats.uploaded == len(rendered) == 3
+  assert stats.duplicates == stats.generated - 3 > 0
+  assert sorted(canvas_quiz.questions[100]) == sorted(set(canvas_quiz.questions[100]))
+
+
+def premade_question_types():
+  # Paging has no parameter key, so this covers the unrendered body too
+  QuestionRegistry.load_premade_questions()
+  names = []
+  for name, question_class in sorted(QuestionRegistry._registry.items()):
+    if question_class.__module__.startswith(f"{QuestionRegistry.PREMADE_PACKAGE}.") and not question_class.__module__.endswith(".basic"):
+      names.append(name)
+  return names
+
+
+@pytest.mark.parametrize("question_type", premade_question_types())
+def test_fingerprints_tell_variations_apart_exactly(question_type):
+  question = QuestionRegistry.create(question_type, name=question_type, points_value=1)
+  question.renderer = MarkdownRenderer()
+  rendered_by_fingerprint = {}
+  for seed in range(40):
+    variation = render_variation(question, OutputFormat.LATEX, seed)
+    # Canvas shuffles the answers, so their order isn't part of the variation
+    rendered = (variation.rendered, sorted(repr(answer.value) for answer in question.answers))
+    rendered_by_fingerprint.setdefault(variation.fingerprint, []).append(rendered)
+
+  # The same fingerprint always means the same question, and different fingerprints mean different questions
+  for renders in rendered_by_fingerprint.values():
+    assert all(rendered == renders[0] for rendered in renders)
+  firsts = [renders[0] for renders in rendered_by_fingerprint.values()]
+  assert all(a != b for i, a in enumerate(firsts) for b in firsts[i+1:])
+
+
+def test_parameter_keys_are_kept_apart_by_class():
+  class First(Question):
+    def get_parameter_key(self):
+      return (1, 2)
+
+    def get_body_lines(self, *args, **kwargs):
+      return [str(self.rng.random())]
+
+  class Second(First):
+    pass
+
+  first, second = First(), Second()
+  # The body draws from the rng, but the parameter key decides the fingerprint
+  assert first.get_fingerprint() == First().get_fingerprint()
+  assert first.get_fingerprint() != second.get_fingerprint()
+
+
+def test_duplicates_are_counted_by_class(monkeypatch):
+  monkeypatch.setattr(Question, "duplicates_skipped", Question.duplicates_skipped.copy())
+  Question.duplicates_skipped.clear()
+  make_question().record_duplicate()
+  make_question().record_duplicate()
+  assert Question.duplicates_skipped == {"FromGenerator": 2}
@@ -0,0 +1,62 @@
+import pytest
+
+from latex_build import COMBINED_MARKER, CompileResult, combine_documents, split_document
+
+PREAMBLE = "\\documentclass{article}\n\\newcounter{NumPoints}\n"
+
+
+def make_document(body, preamble=PREAMBLE):
+  return f"{preamble}\\begin{{document}}\n{body}\n\\end{{document}}\n"
+
+
+def test_combined_documents_share_one_preamble():
+  combined = combine_documents(
+    [("first", make_document("First body")), ("second", make_document("Second body"))],
+    reset=r"\setcounter{NumPoints}{0}"
+  )
+  assert combined.startswith(PREAMBLE + "\\begin{document}")
+  assert combined.count("\\begin{document}") == 1
+  assert combined.count("\\end{document}") == 1
+  assert combined.count(r"\setcounter{NumPoints}{0}") == 2
+  assert combined.index("First body") < combined.index(f"{COMBINED_MARKER}:second:") < combined.index("Second body")
+
+
+def test_documents_must_match_to_be_combined():
+  with pytest.raises(ValueError):
+    combine_documents([("first", make_document("a")), ("second", make_document("b", preamble="\\documentclass{book}\n"))])
+  with pytest.raises(ValueError):
+    combine_documents([("first", "not a document")])
+  with pytest.raises(ValueError):
+    combine_documents([])
+
+
+def test_split_gives_each_document_its_pages(tmp_path):
+  pypdf = pytest.importorskip("pypdf")
+
+  # Pages are told apart by their width
+  writer = pypdf.PdfWriter()
+  for width in range(100, 106):
+    writer.add_blank_page(width=width, height=100)
+  pdf_path = tmp_path / "combined.pdf"
+  writer.write(str(pdf_path))
+
+  # What the \typeout in combine_documents leaves in the log: the number of pages shipped out before each document
+  log_path = tmp_path / "combined.log"
+  log_path.write_text("\n".join([
+    "This is pdfTeX",
+    f"{COMBINED_MARKER}:exam_000:0",
+    "[1] [2]",
+    f"{COMBINED_MARKER}:exam_001:2",
+    "[3]",
+    f"{COMBINED_MARKER}:exam_002:3",
+    "[4] [5] [6]",
+  ]))
+
+  paths = split_document(CompileResult("combined", pdf_path=str(pdf_path), log_path=str(log_path)))
+  assert list(paths) == ["exam_000", "exam_001", "exam_002"]
+  widths = {
+    name: [int(page.mediabox.width) for page in pypdf.PdfReader(path).pages]
+    for name, path in paths.items()
+  }
+  assert widths == {"exam_000": [100, 101], "exam_001": [102], "exam_002": [103, 104, 105]}
+  assert paths["exam_000"] == str(tmp_path / "exam_000.pdf")
@@ -0,0 +1,32 @@
+import logging
+
+from premade_questions import memory_questions
+from premade_questions.cache_policies import compare_policies, distinguishable_policies
+from premade_questions.memory_questions import CachingQuestion
+
+
+def test_differential_traces_tell_the_policy_apart():
+  question = CachingQuestion(differential=True)
+  for seed in range(20):
+    question.refresh(seed=seed)
+    assert question.is_interesting()
+    policy_names = sorted({kind.name for kind in question.compare_against} | {question.cache_policy.name})
+    runs = compare_policies(policy_names, question.cache_size, question.requests)
+    assert question.cache_policy.name in distinguishable_policies(runs)
+
+
+def test_differential_fallback_is_not_interesting_until_we_settle(monkeypatch, caplog):
+  monkeypatch.setattr(memory_questions, "distinguishable_policies", lambda runs: [])
+  monkeypatch.setattr(CachingQuestion, "MAX_DIFFERENTIAL_CANDIDATES", 5)
+
+  with caplog.at_level(logging.WARNING, logger=memory_questions.__name__):
+    question = CachingQuestion(differential=True)
+    assert not question.distinguishes_policies
+    assert not question.is_interesting()
+    assert "starting over" in caplog.text
+
+    # Refreshing keeps looking for a while, and then settles for a trace that doesn't tell the policies apart
+    question.refresh(seed=1)
+  assert question.failed_differential_rounds == CachingQuestion.MAX_DIFFERENTIAL_ROUNDS
+  assert question.is_interesting()
+  assert "using one that doesn't" in caplog.text
@@ -0,0 +1,38 @@
+import pytest
+
+from generation import render_variation
+from misc import OutputFormat
+from question import QuestionRegistry
+from renderers import MarkdownRenderer
+
+
+def premade_question_types():
+  # The questions in basic wrap text or code from the exam yaml, so they can't be built without it
+  QuestionRegistry.load_premade_questions()
+  return sorted(
+    name for name, question_class in QuestionRegistry._registry.items()
+    if question_class.__module__.startswith(f"{QuestionRegistry.PREMADE_PACKAGE}.")
+    and question_class.__module__ != f"{QuestionRegistry.PREMADE_PACKAGE}.basic"
+  )
+
+
+def render(question_type, seed):
+  question = QuestionRegistry.create(question_type, name=question_type, points_value=1)
+  question.renderer = MarkdownRenderer()
+  variation = render_variation(question, OutputFormat.LATEX, seed)
+  # Not every question puts its answers in the latex, so compare those too
+  return variation.rendered, [(answer.key, repr(answer.value)) for answer in question.answers]
+
+
+@pytest.mark.parametrize("question_type", premade_question_types())
+def test_same_seed_gives_the_same_question(question_type):
+  assert render(question_type, 1) == render(question_type, 1)
+  # A fresh question built in between mustn't change what the seed gives either
+  QuestionRegistry.create(question_type, name=question_type, points_value=1)
+  assert render(question_type, 2) == render(question_type, 2)
+
+
+@pytest.mark.parametrize("question_type", premade_question_types())
+def test_different_seeds_give_different_questions(question_type):
+  first = render(question_type, 1)
+  assert any(render(question_type, seed) != first for seed in range(2, 6))
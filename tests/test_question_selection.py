@@ -0,0 +1,88 @@
+import collections
+import itertools
+import logging
+import random
+import types
+
+import pytest
+
+from question_selection import PointTotalSolver, select_questions
+
+
+def make_questions(points, kinds=None):
+  kinds = kinds or ["misc"] * len(points)
+  return [types.SimpleNamespace(name=f"q{i}", points_value=p, kind=k) for i, (p, k) in enumerate(zip(points, kinds))]
+
+
+def brute_force(questions, total):
+  return [
+    frozenset(q.name for q in subset)
+    for k in range(len(questions) + 1)
+    for subset in itertools.combinations(questions, k)
+    if abs(sum(q.points_value for q in subset) - total) < 1e-9
+  ]
+
+
+@pytest.mark.parametrize("points", [
+  [1, 2, 2, 3, 5, 5, 5, 8],
+  [0.5, 1.5, 2.5, 2.5, 1, 4],
+  [1/3, 2/3, 1, 1, 4/3],
+  [0, 1, 1, 2],
+])
+def test_count_matches_brute_force(points):
+  questions = make_questions(points)
+  solver = PointTotalSolver(questions)
+  totals = set(sum(subset) for k in range(len(points) + 1) for subset in itertools.combinations(points, k))
+  for total in sorted(totals) + [0.25, 100]:
+    assert solver.count_solutions(total) == len(brute_force(questions, total)), total
+
+
+def test_count_rejects_unreachable_totals():
+  solver = PointTotalSolver(make_questions([2, 4]))
+  assert solver.count_solutions(-2) == 0
+  assert solver.count_solutions(3) == 0
+  assert solver.sample(3) is None
+  with pytest.raises(ValueError):
+    PointTotalSolver(make_questions([1, -1]))
+
+
+@pytest.mark.parametrize("points, total", [([1, 1, 2, 2, 3, 4], 5), ([0.5, 1, 1.5, 1.5, 2.5], 3)])
+def test_samples_are_uniform(points, total):
+  questions = make_questions(points)
+  solver = PointTotalSolver(questions)
+  valid = brute_force(questions, total)
+  draws_per_subset = 500
+  rng = random.Random(0)
+  counts = collections.Counter(
+    frozenset(q.name for q in solver.sample(total, rng)) for _ in range(len(valid) * draws_per_subset)
+  )
+  assert set(counts) == set(valid)
+  for subset in valid:
+    assert 0.8 * draws_per_subset < counts[subset] < 1.2 * draws_per_subset, counts
+
+
+def test_samples_follow_the_seed():
+  solver = PointTotalSolver(make_questions([1, 1, 2, 2, 3, 4, 5, 5]))
+  first = [solver.sample(8, random.Random(3)) for _ in range(5)]
+  assert first == [solver.sample(8, random.Random(3)) for _ in range(5)]
+
+
+def test_outline_picks_are_redrawn_until_the_rest_fits():
+  # Picking the 3 point memory question first leaves -1 points, so only the other memory question works
+  questions = make_questions([3, 1, 1], kinds=["memory", "memory", "process"])
+  outline = [{"num_to_pick": 1, "filters": {"kind": "memory"}}]
+  for seed in range(20):
+    picked = select_questions(questions, 2, outline, random.Random(seed))
+    assert sorted(q.name for q in picked) == ["q1", "q2"]
+
+
+def test_falls_back_to_the_outline_picks(caplog):
+  questions = make_questions([3, 1, 1], kinds=["memory", "memory", "process"])
+  outline = [{"num_to_pick": 1, "filters": {"kind": "memory"}}]
+  with caplog.at_level(logging.WARNING, logger="question_selection"):
+    picked = select_questions(questions, 100, outline, random.Random(0), max_attempts=5)
+  assert len(picked) == 1 and picked[0].kind == "memory"
+  assert "No set of questions adds up to 100 points" in caplog.text
+
+  # Without an outline there is nothing to redraw or fall back on
+  assert select_questions(questions, 100, rng=random.Random(0)) == []
@@ -0,0 +1,118 @@
+from typing import List, Tuple
+
+import pytest
+
+from misc import OutputFormat
+from renderers import CachingRenderer, MarkdownRenderer, RenderCache, Renderer
+
+
+class CountingRenderer(Renderer):
+  NAME = "counting"
+
+  def __init__(self, version="1"):
+    self.version = version
+    self.batches = []
+
+  def get_version(self) -> str:
+    return self.version
+
+  def convert(self, text: str, output_format: OutputFormat) -> str:
+    return f"<{output_format.name} {self.version}>{text}"
+
+  def convert_batch(self, fragments: List[Tuple[str, OutputFormat]]) -> List[str]:
+    self.batches.append(list(fragments))
+    return super().convert_batch(fragments)
+
+
+class RendererA(Renderer):
+  NAME = "same"
+
+  def convert(self, text: str, output_format: OutputFormat) -> str:
+    return text
+
+
+class RendererB(Renderer):
+  NAME = "same"
+
+  def convert(self, text: str, output_format: OutputFormat) -> str:
+    return text.upper()
+
+
+class TweakedMarkdownRenderer(MarkdownRenderer):
+  pass
+
+
+def test_key_depends_on_text_format_and_version():
+  key = RenderCache.make_key("text", OutputFormat.CANVAS, "v1")
+  assert key == RenderCache.make_key("text", OutputFormat.CANVAS, "v1")
+  assert key != RenderCache.make_key("text!", OutputFormat.CANVAS, "v1")
+  assert key != RenderCache.make_key("text", OutputFormat.LATEX, "v1")
+  assert key != RenderCache.make_key("text", OutputFormat.CANVAS, "v2")
+
+
+def test_key_fields_do_not_run_together():
+  assert RenderCache.make_key("b", OutputFormat.CANVAS, "a") != RenderCache.make_key("", OutputFormat.CANVAS, "a\0b")
+
+
+def test_only_misses_reach_the_renderer_once_each():
+  counting = CountingRenderer()
+  renderer = CachingRenderer(counting)
+
+  first = renderer.convert_batch([("a", OutputFormat.CANVAS), ("b", OutputFormat.CANVAS), ("a", OutputFormat.CANVAS)])
+  assert first == ["<CANVAS 1>a", "<CANVAS 1>b", "<CANVAS 1>a"]
+  assert counting.batches == [[("a", OutputFormat.CANVAS), ("b", OutputFormat.CANVAS)]]
+
+  second = renderer.convert_batch([("b", OutputFormat.CANVAS), ("a", OutputFormat.LATEX)])
+  assert second == ["<CANVAS 1>b", "<LATEX 1>a"]
+  assert counting.batches[-1] == [("a", OutputFormat.LATEX)]
+  assert (renderer.cache.hits, renderer.cache.misses) == (1, 4)
+
+
+def test_new_renderer_version_misses():
+  cache = RenderCache()
+  CachingRenderer(CountingRenderer("1"), cache).convert("a", OutputFormat.CANVAS)
+
+  upgraded = CountingRenderer("2")
+  assert CachingRenderer(upgraded, cache).convert("a", OutputFormat.CANVAS) == "<CANVAS 2>a"
+  assert len(upgraded.batches) == 1
+
+
+def test_entries_persist_on_disk(tmp_path):
+  key = RenderCache.make_key("a", OutputFormat.CANVAS, "1")
+  RenderCache(cache_dir=str(tmp_path)).put(key, "rendered")
+
+  cache = RenderCache(cache_dir=str(tmp_path))
+  assert cache.get(key) == "rendered"
+  assert cache.get(key) == "rendered"
+  assert (cache.disk_hits, cache.hits, cache.misses) == (1, 1, 0)
+  assert list(tmp_path.rglob("*.tmp")) == []
+
+
+def test_memory_is_least_recently_used():
+  cache = RenderCache(max_entries=2)
+  cache.put("a", "A")
+  cache.put("b", "B")
+  cache.get("a")
+  cache.put("c", "C")
+  assert cache.get("b") is None
+  assert cache.get("a") == "A"
+  assert cache.get("c") == "C"
+
+
+def test_renderer_version_follows_its_source():
+  assert RendererA().get_version() == RendererA().get_version()
+  assert RendererA().get_version() != RendererB().get_version()
+  assert RendererA().get_version().startswith("same-")
+  # Subclasses hash their own source on top of their parents'
+  assert TweakedMarkdownRenderer().get_version() != MarkdownRenderer().get_version()
+
+
+def test_caching_renderer_reports_the_wrapped_version():
+  assert CachingRenderer(MarkdownRenderer()).get_version() == MarkdownRenderer().get_version()
+
+
+def test_markdown_version_includes_the_fallback():
+  assert MarkdownRenderer(fallback=CountingRenderer("1")).get_version().endswith("+1")
+  assert MarkdownRenderer(fallback=CountingRenderer("1")).get_version() != MarkdownRenderer(fallback=CountingRenderer("2")).get_version()
+  # Pandoc, by default
+  assert "+pandoc-" in MarkdownRenderer().get_version()
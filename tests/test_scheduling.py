@@ -0,0 +1,138 @@
+import collections
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from premade_questions.process import SchedulingQuestion
+
+
+def random_workloads(count, num_jobs, seed=0):
+  rng = random.Random(seed)
+  # Arrivals from a small range so that plenty of jobs arrive together
+  return [[(rng.randint(0, 4), rng.randint(1, 6)) for _ in range(num_jobs)] for _ in range(count)]
+
+
+@pytest.mark.parametrize("kind", list(SchedulingQuestion.Kind))
+def test_batch_matches_the_scalar_simulation(kind):
+  for num_jobs in [1, 3, 5]:
+    workloads = random_workloads(100, num_jobs)
+    arrivals = [[arrival for arrival, _ in workload] for workload in workloads]
+    durations = [[duration for _, duration in workload] for workload in workloads]
+    response, tat = SchedulingQuestion.simulate_batch(kind, arrivals, durations)
+    for i, workload in enumerate(workloads):
+      question = SchedulingQuestion(scheduler_kind=kind, workload=workload)
+      for job_id, stats in question.job_stats.items():
+        assert response[i, job_id] == pytest.approx(stats["Response"]), workload
+        assert tat[i, job_id] == pytest.approx(stats["TAT"]), workload
+
+
+@pytest.mark.parametrize("kind", list(SchedulingQuestion.Kind))
+def test_batch_questions_match_simulated_ones(kind):
+  questions = SchedulingQuestion.generate_batch(20, scheduler_kind=kind, rng=np.random.default_rng(0))
+  assert len(questions) == 20
+  for question in questions:
+    workload = [(stats["arrival"], stats["duration"]) for _, stats in sorted(question.job_stats.items())]
+    simulated = SchedulingQuestion(scheduler_kind=kind, workload=workload)
+    assert question.workload_is_interesting()
+    assert question.SCHEDULER_NAME == simulated.SCHEDULER_NAME
+    assert [a.key for a in question.answers] == [a.key for a in simulated.answers]
+    assert [a.value for a in question.answers] == pytest.approx([a.value for a in simulated.answers])
+
+    # The timeline is only simulated when the explanation needs it
+    assert question.timeline is None
+    question.simulate_timeline()
+    assert question.timeline == simulated.timeline
+    for job_id, stats in question.job_stats.items():
+      assert stats["state_changes"] == pytest.approx(simulated.job_stats[job_id]["state_changes"])
+
+
+def baseline_simulation(question, jobs_to_run, time_quantum=None):
+  """
+  The tick loop SchedulingQuestion used before the event-driven simulation, returning its timeline.
+  Kept here as the reference the rewrite has to agree with.  Round robin used a 1e-4 time quantum.
+  """
+  is_rr = (question.SCHEDULER_KIND == SchedulingQuestion.Kind.RoundRobin)
+  curr_time = 0
+  timeline = collections.defaultdict(list)
+  timeline[curr_time].append("Simulation Start")
+  for job in jobs_to_run:
+    timeline[job.arrival].append(f"Job{job.job_id} arrived")
+
+  while len(jobs_to_run) > 0:
+    possible_time_slices = []
+    available_jobs = [j for j in jobs_to_run if j.arrival <= curr_time]
+    future_jobs = [j for j in jobs_to_run if j.arrival > curr_time]
+
+    selected_job = None
+    if len(available_jobs) > 0:
+      selected_job = min(available_jobs, key=(lambda j: question.SELECTOR(j, curr_time)))
+      if selected_job.has_started():
+        timeline[curr_time].append(f"Starting Job{selected_job.job_id} (resp = {curr_time - selected_job.arrival:0.2f}s)")
+      selected_job.run(curr_time, is_rr)
+      possible_time_slices.append(selected_job.time_remaining(curr_time))
+
+    if question.PREEMPTABLE or len(possible_time_slices) == 0:
+      if len(future_jobs) != 0:
+        possible_time_slices.append(min(j.arrival for j in future_jobs) - curr_time)
+    if time_quantum is not None:
+      possible_time_slices.append(time_quantum)
+
+    next_time_slice = min(possible_time_slices)
+    if not is_rr:
+      if selected_job is not None:
+        timeline[curr_time].append(f"Running Job{selected_job.job_id} for {next_time_slice:0.2f}s")
+      else:
+        timeline[curr_time].append(f"(No job running)")
+    curr_time += next_time_slice
+
+    if selected_job is not None:
+      selected_job.stop(curr_time, is_rr)
+      if selected_job.is_complete(curr_time):
+        timeline[curr_time].append(f"Completed Job{selected_job.job_id} (TAT = {selected_job.turnaround_time:0.2f}s)")
+    jobs_to_run = [j for j in jobs_to_run if not j.is_complete(curr_time)]
+  return timeline
+
+
+def make_jobs(workload):
+  return [SchedulingQuestion.Job(job_id, arrival, duration) for job_id, (arrival, duration) in enumerate(workload)]
+
+
+@pytest.mark.parametrize("kind", [kind for kind in SchedulingQuestion.Kind if kind != SchedulingQuestion.Kind.RoundRobin])
+def test_matches_the_baseline_simulation(kind):
+  question = SchedulingQuestion(scheduler_kind=kind, workload=[(0, 1)])
+  for workload in random_workloads(300, 4, seed=1):
+    jobs, baseline_jobs = make_jobs(workload), make_jobs(workload)
+    question.simulation(jobs, question.SELECTOR, question.PREEMPTABLE)
+    baseline_timeline = baseline_simulation(question, baseline_jobs)
+    assert question.timeline == baseline_timeline, workload
+    for job, baseline_job in zip(jobs, baseline_jobs):
+      assert (job.response_time, job.turnaround_time) == (baseline_job.response_time, baseline_job.turnaround_time)
+      assert job.state_change_times == baseline_job.state_change_times
+
+
+def test_round_robin_matches_the_baseline_time_quantum():
+  question = SchedulingQuestion(scheduler_kind=SchedulingQuestion.Kind.RoundRobin, workload=[(0, 1)])
+  # The baseline takes a step per 1e-4s, so these are kept short.  Jobs 0 and 1 arrive together.
+  for workload in [[(0, 2), (0, 1), (1, 2)], [(0, 1), (0, 1)], [(1, 2), (0, 1), (2, 1)], [(0, 3), (2, 1), (2, 2)]]:
+    jobs, baseline_jobs = make_jobs(workload), make_jobs(workload)
+    question.simulation(jobs, question.SELECTOR, question.PREEMPTABLE)
+    baseline_simulation(question, baseline_jobs, time_quantum=1e-04)
+    for job, baseline_job in zip(jobs, baseline_jobs):
+      assert job.response_time == pytest.approx(baseline_job.response_time, abs=1e-3), workload
+      assert job.turnaround_time == pytest.approx(baseline_job.turnaround_time, abs=1e-3), workload
+
+
+def test_round_robin_golden_values():
+  # Jobs 0 and 1 arrive together and share the processor until job 1 finishes at 2, then job 0 shares with job 2 from 3
+  question = SchedulingQuestion(scheduler_kind="RoundRobin", workload=[(0, 3), (0, 1), (3, 2)])
+  assert [question.job_stats[i]["Response"] for i in range(3)] == pytest.approx([0, 0, 0], abs=1e-6)
+  assert [question.job_stats[i]["TAT"] for i in range(3)] == pytest.approx([5, 2, 3], abs=1e-6)
+  assert dict(question.timeline) == {
+    0: ["Simulation Start", "Job0 arrived", "Job1 arrived", "Starting Job0 (resp = 0.00s)", "Starting Job1 (resp = 0.00s)"],
+    2: ["Completed Job1 (TAT = 2.00s)"],
+    3: ["Job2 arrived", "Starting Job2 (resp = 0.00s)"],
+    5: ["Completed Job0 (TAT = 5.00s)"],
+    6: ["Completed Job2 (TAT = 3.00s)"],
+  }
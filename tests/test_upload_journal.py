@@ -0,0 +1,150 @@
+import collections
+import itertools
+import types
+
+import pytest
+
+from question import QuestionRegistry
+from renderers import MarkdownRenderer
+from upload_journal import UploadJournal
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+  return str(tmp_path / "journal.sqlite")
+
+
+def test_quizzes_are_remembered_per_course_and_title(journal_path):
+  journal = UploadJournal(journal_path)
+  assert journal.get_quiz_id(1, "quiz") is None
+  journal.record_quiz(1, "quiz", 10)
+  journal.record_quiz(2, "quiz", 20)
+  assert journal.get_quiz_id(1, "quiz") == 10
+  assert journal.get_quiz_id(2, "quiz") == 20
+  assert journal.get_quiz_id(1, "other") is None
+  # Recreating a quiz that was deleted from canvas replaces it
+  journal.record_quiz(1, "quiz", 11)
+  assert journal.get_quiz_id(1, "quiz") == 11
+
+
+def test_groups_are_only_complete_once_marked(journal_path):
+  journal = UploadJournal(journal_path)
+  assert journal.get_group(10, 0, "question") is None
+  journal.record_group(10, 0, "question", 100)
+  assert journal.get_group(10, 0, "question") == (100, False)
+  # The same question at another position, or another question at the same one, is a different group
+  assert journal.get_group(10, 1, "question") is None
+  assert journal.get_group(10, 0, "renamed") is None
+  journal.mark_group_complete(100)
+  assert journal.get_group(10, 0, "question") == (100, True)
+
+
+def test_everything_survives_reopening(journal_path):
+  journal = UploadJournal(journal_path)
+  journal.record_quiz(1, "quiz", 10)
+  journal.record_group(10, 0, "question", 100)
+  journal.record_variation(100, "a")
+  journal.record_variation(100, "a")
+  journal.record_variation(100, "b")
+  journal.record_variation(101, "c")
+  journal.close()
+
+  journal = UploadJournal(journal_path)
+  assert journal.get_quiz_id(1, "quiz") == 10
+  assert journal.get_group(10, 0, "question") == (100, False)
+  assert journal.get_variations(100) == {"a", "b"}
+  assert journal.get_variations(102) == set()
+
+
+class FakeQuiz:
+  id = 7
+
+  def __init__(self):
+    self.group_ids = itertools.count(100)
+    self.groups = []
+    self.questions = collections.defaultdict(list)
+    self.broken_groups = set()
+
+  def create_question_group(self, groups):
+    self.groups.append(next(self.group_ids))
+    return types.SimpleNamespace(id=self.groups[-1])
+
+  def create_question(self, question):
+    import canvasapi.exceptions
+    group_id = question["quiz_group_id"]
+    if group_id in self.broken_groups and len(self.questions[group_id]) >= 1:
+      raise canvasapi.exceptions.CanvasException("Internal server error")
+    self.questions[group_id].append(question["question_text"])
+
+
+class FakeCourse:
+  id = 1
+
+  def __init__(self, quiz):
+    self.quiz = quiz
+    self.quizzes_created = 0
+
+  def get_assignment_groups(self):
+    return [types.SimpleNamespace(name="dev", id=1)]
+
+  def create_quiz(self, quiz):
+    self.quizzes_created += 1
+    return self.quiz
+
+  def get_quiz(self, quiz_id):
+    assert quiz_id == self.quiz.id
+    return self.quiz
+
+
+class FakeCanvas:
+  def __init__(self, course):
+    self.course = course
+    self._Canvas__requester = types.SimpleNamespace(_session=types.SimpleNamespace(hooks={"response": []}))
+
+  def get_course(self, course):
+    return self.course
+
+
+class FakeQuizDefinition(list):
+  name = "quiz"
+
+
+def make_quiz():
+  questions = []
+  for name in ["first", "second"]:
+    question = QuestionRegistry.create(
+      "FromGenerator", name=name, points_value=1, generator='return f"Pick {random.randint(0, 10**6)}"'
+    )
+    question.renderer = MarkdownRenderer()
+    question.exam_seed = 1
+    questions.append(question)
+  return FakeQuizDefinition(questions)
+
+
+def test_resumed_push_only_uploads_what_is_missing(journal_path, monkeypatch):
+  pytest.importorskip("canvasapi")
+  pytest.importorskip("dotenv")
+  import canvas_interface
+  monkeypatch.setattr(canvas_interface.CanvasRequestLayer, "BASE_DELAY", 0)
+
+  canvas_quiz = FakeQuiz()
+  course = FakeCourse(canvas_quiz)
+  interface = canvas_interface.CanvasInterface(course_id=1, canvas=FakeCanvas(course))
+
+  # The second group stops taking questions after its first one
+  canvas_quiz.broken_groups.add(101)
+  journal = UploadJournal(journal_path)
+  stats = interface.push_quiz_to_canvas(make_quiz(), 3, upload_concurrency=1, journal=journal)
+  assert (stats.uploaded, stats.missing) == (4, 2)
+  assert journal.get_group(canvas_quiz.id, 0, "first") == (100, True)
+  assert journal.get_group(canvas_quiz.id, 1, "second") == (101, False)
+  assert len(journal.get_variations(101)) == 1
+
+  canvas_quiz.broken_groups.clear()
+  stats = interface.push_quiz_to_canvas(make_quiz(), 3, upload_concurrency=1, journal=journal, resume=True)
+  assert (stats.skipped_groups, stats.resumed, stats.uploaded, stats.missing) == (1, 1, 2, 0)
+  assert course.quizzes_created == 1
+  assert canvas_quiz.groups == [100, 101]
+  assert journal.get_group(canvas_quiz.id, 1, "second") == (101, True)
+  assert len(canvas_quiz.questions[100]) == 3
+  assert len(set(canvas_quiz.questions[101])) == 3
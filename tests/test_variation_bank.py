@@ -0,0 +1,98 @@
+import hashlib
+import inspect
+
+import pytest
+
+from generation import render_variation
+from misc import OutputFormat
+from question import Question, QuestionRegistry
+from renderers import MarkdownRenderer
+from variation_bank import VariationBank
+
+GENERATOR = 'return f"Pick {random.randint(0, 10**6)}"'
+
+
+def make_question(name="generated", generator=GENERATOR, renderer=None):
+  question = QuestionRegistry.create("FromGenerator", name=name, points_value=1, generator=generator)
+  question.renderer = renderer if renderer is not None else MarkdownRenderer()
+  question.exam_seed = 1
+  return question
+
+
+@pytest.fixture
+def bank(tmp_path):
+  bank = VariationBank(str(tmp_path / "bank.sqlite"))
+  yield bank
+  bank.close()
+
+
+def test_key_ignores_the_name_but_not_the_kwargs():
+  key = VariationBank.get_key(make_question(), OutputFormat.LATEX)
+  assert key == VariationBank.get_key(make_question(name="renamed"), OutputFormat.LATEX)
+  assert key != VariationBank.get_key(make_question(generator='return "fixed"'), OutputFormat.LATEX)
+  assert key != VariationBank.get_key(make_question(), OutputFormat.CANVAS)
+
+
+def test_key_includes_the_renderer_version():
+  class OtherRenderer(MarkdownRenderer):
+    NAME = "other"
+  key = VariationBank.get_key(make_question(), OutputFormat.LATEX)
+  assert key[3] == MarkdownRenderer().get_version()
+  assert key != VariationBank.get_key(make_question(renderer=OtherRenderer()), OutputFormat.LATEX)
+
+
+def test_questions_outside_the_registry_are_not_banked():
+  question = make_question()
+  question.registry_spec = None
+  assert VariationBank.get_key(question, OutputFormat.LATEX) is None
+
+
+def test_code_version_hashes_the_question_modules():
+  question_class = type(make_question())
+  digest = hashlib.sha256()
+  for source_file in sorted({inspect.getsourcefile(question_class), inspect.getsourcefile(Question)}):
+    with open(source_file, "rb") as fid:
+      digest.update(fid.read())
+  assert VariationBank.get_code_version(question_class) == digest.hexdigest()
+
+
+def test_each_variation_is_kept_once(bank):
+  question = make_question()
+  variation = render_variation(question, OutputFormat.LATEX, question.next_seed())
+  assert bank.put(question, OutputFormat.LATEX, variation.seed, variation.rendered, variation.fingerprint)
+  assert not bank.put(question, OutputFormat.LATEX, 12345, variation.rendered, variation.fingerprint)
+  assert bank.count(question, OutputFormat.LATEX) == 1
+  assert bank.get(question, OutputFormat.LATEX, variation.seed) == variation.rendered
+
+
+def test_draw_skips_excluded_fingerprints_as_they_are_added(bank):
+  question = make_question()
+  variations = [render_variation(question, OutputFormat.LATEX, question.next_seed()) for _ in range(4)]
+  for variation in variations:
+    bank.put(question, OutputFormat.LATEX, variation.seed, variation.rendered, variation.fingerprint)
+
+  exclude = {variations[0].fingerprint}
+  drawn = []
+  for fingerprint, block in bank.draw(question, OutputFormat.LATEX, exclude):
+    drawn.append(fingerprint)
+    # e.g. another pdf in the same run taking the next one
+    exclude.add(variations[2].fingerprint)
+  assert drawn == [variations[1].fingerprint, variations[3].fingerprint]
+
+
+def test_canvas_variations_round_trip(tmp_path):
+  question = make_question()
+  variation = render_variation(question, OutputFormat.CANVAS, question.next_seed(), None, None)
+
+  path = str(tmp_path / "bank.sqlite")
+  bank = VariationBank(path)
+  bank.put(question, OutputFormat.CANVAS, variation.seed, variation.rendered, variation.fingerprint)
+  bank.close()
+
+  # A later run, with a fresh question of the same kind
+  bank = VariationBank(path)
+  [(fingerprint, banked)] = list(bank.draw(make_question(name="later"), OutputFormat.CANVAS, set()))
+  bank.close()
+  assert fingerprint == variation.fingerprint
+  for field in ["question_text", "question_type", "answers", "neutral_comments_html", "points_possible"]:
+    assert banked[field] == variation.rendered[field]
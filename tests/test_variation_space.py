@@ -0,0 +1,168 @@
+import math
+
+import pytest
+
+from question import QuestionRegistry
+from renderers import MarkdownRenderer
+from variation_space import VariationSpaceEstimate
+
+
+def observe_counts(estimate, counts):
+  """Observes fingerprint i counts[i] times."""
+  for fingerprint, count in enumerate(counts):
+    for _ in range(count):
+      estimate.observe(str(fingerprint))
+  return estimate
+
+
+def test_chao1_with_singletons_and_doubletons():
+  # f1 = 2, f2 = 2: 2*2 / (2*2) = 1 unseen
+  estimate = observe_counts(VariationSpaceEstimate(), [1, 1, 2, 2] + [5] * 4)
+  assert estimate.num_distinct == 8
+  assert estimate.estimate_unseen() == pytest.approx(1)
+  assert estimate.estimate() == pytest.approx(9)
+  assert not estimate.is_exhausted()
+
+
+def test_chao1_without_doubletons():
+  # f2 = 0 uses the bias-corrected f1 * (f1 - 1) / 2
+  assert observe_counts(VariationSpaceEstimate(), [1] * 5 + [4] * 5).estimate_unseen() == pytest.approx(10)
+  # A single singleton and no doubletons means nothing is left to find
+  estimate = observe_counts(VariationSpaceEstimate(), [1] + [7] * 3)
+  assert estimate.estimate_unseen() == 0
+  assert estimate.is_exhausted()
+
+
+def test_chao1_without_singletons():
+  estimate = observe_counts(VariationSpaceEstimate(), [2] * 4 + [3] * 4)
+  assert estimate.estimate_unseen() == 0
+  assert estimate.is_exhausted()
+
+
+def test_needs_enough_attempts_before_trusting_the_estimate():
+  estimate = observe_counts(VariationSpaceEstimate(), [3] * 3)
+  assert estimate.num_attempts < VariationSpaceEstimate.MIN_ATTEMPTS
+  assert estimate.estimate_unseen() == 0
+  assert not estimate.is_exhausted()
+  observe_counts(estimate, [0, 0, 0] + [20])
+  assert estimate.is_exhausted()
+
+
+def test_known_variation_count_caps_the_estimate():
+  estimate = observe_counts(VariationSpaceEstimate(possible_variations=6), [1] * 5)
+  assert estimate.estimate_unseen() == 1
+  assert not estimate.is_exhausted()
+  estimate.observe("another")
+  # Exhausted as soon as every variation has been seen, however few attempts that took
+  assert estimate.num_attempts == 6
+  assert estimate.is_exhausted()
+  assert estimate.estimate() == 6
+
+
+def push_question(question, num_variations, monkeypatch):
+  pytest.importorskip("canvasapi")
+  pytest.importorskip("dotenv")
+  import canvas_interface
+  from test_upload_journal import FakeCanvas, FakeCourse, FakeQuiz, FakeQuizDefinition
+
+  question.renderer = MarkdownRenderer()
+  question.exam_seed = 1
+  canvas_quiz = FakeQuiz()
+  interface = canvas_interface.CanvasInterface(course_id=1, canvas=FakeCanvas(FakeCourse(canvas_quiz)))
+  stats = interface.push_quiz_to_canvas(FakeQuizDefinition([question]), num_variations, upload_concurrency=1)
+  return canvas_interface, stats
+
+
+def test_push_stops_once_every_known_variation_is_seen(monkeypatch):
+  question = QuestionRegistry.create(
+    "FromGenerator", name="small", points_value=1, possible_variations=3,
+    generator='return f"Pick {random.randint(0, 2)}"'
+  )
+  # Only as many as the question has are wanted, so it stops as soon as it has seen them all
+  _, stats = push_question(question, 10, monkeypatch)
+  assert stats.uploaded == 3
+  assert stats.generated == stats.uploaded + stats.duplicates < 20
+
+
+def test_push_stops_once_the_estimate_runs_out(monkeypatch):
+  # Without a known count it takes MIN_ATTEMPTS attempts, and there is no second round for variations it couldn't find
+  question = QuestionRegistry.create(
+    "FromGenerator", name="small", points_value=1, generator='return f"Pick {random.randint(0, 3)}"'
+  )
+  canvas_interface, stats = push_question(question, 10, monkeypatch)
+  assert stats.uploaded == 4
+  assert VariationSpaceEstimate.MIN_ATTEMPTS <= stats.generated < 100
+  assert stats.generated + stats.attempts_saved == canvas_interface.QUESTION_VARIATIONS_TO_TRY
+
+
+class EnumeratingRng:
+  """
+  Stands in for a question's rng, making the choices given in `path` and the first option after that.
+  Records how many options each call had, so every path through instantiate can be walked.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self.num_options = []
+
+  def pick(self, options):
+    index = self.path[len(self.num_options)] if len(self.num_options) < len(self.path) else 0
+    self.num_options.append(len(options))
+    return options[index]
+
+  def randint(self, a, b):
+    return self.pick(range(a, b + 1))
+
+  def randrange(self, a, b):
+    return self.pick(range(a, b))
+
+  def choice(self, options):
+    return self.pick(list(options))
+
+
+def parameter_keys(question):
+  """Every parameter key instantiate can give, found by walking each path through its random choices."""
+  keys = set()
+  paths = [[]]
+  while paths:
+    path = paths.pop()
+    question.rng = EnumeratingRng(path)
+    question.instantiate()
+    keys.add(question.get_parameter_key())
+    num_options = question.rng.num_options
+    # Branch on the first call this path didn't decide, and explore the rest of its options
+    for depth in range(len(path), len(num_options)):
+      paths.extend(path + [0] * (depth - len(path)) + [i] for i in range(1, num_options[depth]))
+  return keys
+
+
+@pytest.mark.parametrize("question_type, limits", [
+  ("BitsAndBytes", {}),
+  ("HexAndBinary", {"MAX_HEXITS": 2}),
+  ("INodeAccesses", {}),
+])
+def test_possible_variations_are_exact(question_type, limits, monkeypatch):
+  question_class = type(QuestionRegistry.create(question_type))
+  for name, value in limits.items():
+    monkeypatch.setattr(question_class, name, value)
+  question = QuestionRegistry.create(question_type)
+  assert len(parameter_keys(question)) == question.possible_variations
+
+
+def test_hard_drive_possible_variations():
+  # Too many to walk, but every choice is independent and ends up in the key
+  question = QuestionRegistry.create("HardDriveAccessTime")
+  question.rng = EnumeratingRng([])
+  question.instantiate()
+  num_options = question.rng.num_options
+  assert len(num_options) == 5
+  assert question.possible_variations == math.prod(num_options)
+  base_key = question.get_parameter_key()
+  for depth, n in enumerate(num_options):
+    keys = set()
+    for i in range(n):
+      question.rng = EnumeratingRng([0] * depth + [i])
+      question.instantiate()
+      keys.add(question.get_parameter_key())
+      assert question.rng.num_options == num_options
+    assert len(keys) == n and base_key in keys